@@ -1,14 +1,51 @@
-from flask import Flask, render_template, request, jsonify, session, send_file, redirect, url_for
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, jsonify, session, send_file, redirect, url_for, Response, stream_with_context, g
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
+import logging
+import app_logging
+# Configured before the app's own modules are imported so their startup warnings are structured too
+app_logging.configure()
 from db_config import DatabaseConnection
+from subscription_service import activate_subscription
 from mysql.connector import Error as MySQLError
 from datetime import datetime, timedelta
 import uuid
 import os
+import tempfile
+import json
+import re
 import stripe
+import stripe_client
+import background_jobs
+import upload_gc
+import storage
+import quota
+import retention
+import image_pipeline
+import model_backends
+import driving_library
+import video_segments
+import talking_engine
+import faceswap_engine
+import metrics
+import db_metrics
+import profiling
+import password_hashing
+import rate_limit
+import session_store
+from quota import QuotaExceeded
+from password_hashing import HashingBusy
+from rate_limit import RateLimited
+from media_validation import UploadValidationError, save_validated_upload, validate_bytes, sniff_type
+from cache import TTLCache
+from subscription_sweeper import sweep_expired_subscriptions
+from file_cleanup import enqueue_files, enqueue_user_files, reap_cleanup_queue, reconcile_animation_files
 import requests
 import time
+import threading
+import functools
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__, 
             static_folder='static',
@@ -16,6 +53,10 @@ app = Flask(__name__,
             template_folder='templates')
 
 app.secret_key = os.getenv('SECRET_KEY', 'your_secret_key_here_change_in_production')
+# Reverse proxies in front of the app (Railway has one); their X-Forwarded-For entry is the client address
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', '1'))
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['ANIMATIONS_FOLDER'] = 'static/animations'
 app.config['PROFILE_PICTURES_FOLDER'] = 'static/uploads/profile_pictures'
@@ -23,6 +64,8 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # Stripe configuration
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY', '')
+# Overridable so load tests can run against devtools/fake_stripe_server.py
+stripe.api_base = os.getenv('STRIPE_API_BASE', stripe.api_base)
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
 
@@ -50,10 +93,9 @@ os.makedirs(os.path.join(app.config['ANIMATIONS_FOLDER'], 'makeittalk'), exist_o
 # Check if gradio_client is available
 try:
     from gradio_client import Client
-    print("✅ gradio_client package is available")
+    logger.info("✅ gradio_client package is available")
 except ImportError:
-    print("⚠️ WARNING: gradio_client package is not installed. FOMD feature will not work.")
-    print("   Install it with: pip install gradio-client")
+    logger.warning("gradio_client package is not installed. FOMD feature will not work. Install it with: pip install gradio-client")
 
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov'}
@@ -63,7 +105,121 @@ def allowed_file(filename, allowed_extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
 def get_db():
-    return DatabaseConnection().get_connection()
+    # Queries are counted and timed for /metrics
+    return db_metrics.InstrumentedConnection(DatabaseConnection().get_connection())
+
+# Server-side sessions and entitlement snapshots when SESSION_BACKEND is local or db
+SERVER_SESSIONS = session_store.init_app(app, get_db)
+
+def quota_role():
+    """
+    The logged-in user's role from users (via load_entitlement), whose plan
+    limits apply; not the session's copy, which a sweep downgrade leaves stale
+    """
+    user = load_entitlement(session['user_id'])
+    return user['role'] if user else 'user'
+
+def check_upload_quota(incoming_bytes=None):
+    """Reject an upload up front if the user is already at their plan's limits (raises QuotaExceeded)"""
+    if incoming_bytes is None:
+        # Estimate the decoded size; base64 JSON bodies are ~4/3 of the file
+        incoming_bytes = request.content_length or 0
+        if request.is_json:
+            incoming_bytes = incoming_bytes * 3 // 4
+    role = quota_role()
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    try:
+        quota.check_quota(cursor, session['user_id'], role, incoming_bytes)
+    finally:
+        cursor.close()
+        db.close()
+
+def record_animation(tool_type, animation_path, full_path):
+    """
+    Insert the animations row for a file already written to full_path and
+    charge it to the user's storage counters in the same transaction.
+    The file is removed again if the row can't be saved (e.g. QuotaExceeded).
+    """
+    file_size = os.path.getsize(full_path)
+    role = quota_role()
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        quota.reserve(cursor, session['user_id'], role, file_size)
+        cursor.execute(
+            """INSERT INTO animations (user_id, tool_type, animation_path, status, file_size)
+               VALUES (%s, %s, %s, %s, %s)""",
+            (session['user_id'], tool_type, animation_path, 'completed', file_size)
+        )
+        db.commit()
+        return cursor.lastrowid
+    except Exception:
+        db.rollback()
+        remove_files(full_path)
+        raise
+    finally:
+        cursor.close()
+        db.close()
+
+def new_animation_path(tool_type, extension):
+    """Allocate a sharded location for a new animation file; returns (relative_path, full_path)"""
+    filename = f"{tool_type}_{uuid.uuid4()}.{extension}"
+    relative_path = storage.animation_relpath(tool_type, filename)
+    return relative_path, storage.prepare_path(app.static_folder, relative_path)
+
+# Temp inputs saved under UPLOAD_FOLDER are reclaimed by the upload GC after this long
+TEMP_UPLOAD_TTL = int(os.getenv('TEMP_UPLOAD_TTL', '3600'))
+
+def track_temp_uploads(*paths):
+    """Record temp input files so the upload GC reclaims them if the request never cleans up"""
+    relative_paths = [os.path.relpath(os.path.abspath(path), app.static_folder).replace(os.sep, '/') for path in paths if path]
+    try:
+        db = get_db()
+        try:
+            upload_gc.track_temp_uploads(db, relative_paths, TEMP_UPLOAD_TTL)
+        finally:
+            db.close()
+    except Exception as e:
+        # Untracked files are still collected by the GC's directory scan
+        logger.warning("Error tracking temp uploads: %s", e)
+
+def remove_files(*paths):
+    """Delete files a request no longer needs (temp inputs, rejected outputs); None entries are skipped"""
+    for path in paths:
+        if not path:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Error removing temp upload %s: %s", path, e)
+
+# Cold-storage tier for rarely viewed animations, and the batched access recorder
+archive_tier = retention.tier_from_env()
+access_recorder = retention.AccessRecorder()
+
+# Short-lived per-process cache of {role, subscription_status} by user_id for
+# load_entitlement (account status and subscriber checks). Anything that
+# changes a user's role or status drops the entry; the TTL bounds staleness
+# across gunicorn workers. The suspension check doesn't trust it: it reads
+# users and refreshes the entry for the request's later checks. Not used with
+# server-side sessions, whose versioned snapshots are invalidated everywhere
+# at once.
+ENTITLEMENT_CACHE_TTL = int(os.getenv('ENTITLEMENT_CACHE_TTL', '30'))
+entitlement_cache = TTLCache(max_entries=10000)
+
+# FOMD replicas (FOMD_HF_SPACE_URLS) used by the batch endpoint, and its item cap
+fomd_pool = model_backends.BackendPool.from_env('FOMD', 'https://Tc12345-fomd.hf.space')
+FOMD_BATCH_MAX_ITEMS = int(os.getenv('FOMD_BATCH_MAX_ITEMS', '10'))
+# MakeItTalk replicas: MAKEITTALK_HF_SPACE_URLS, or the single MAKEITTALK_API_URL
+makeittalk_pool = model_backends.BackendPool.from_env('MAKEITTALK', os.getenv('MAKEITTALK_API_URL'))
+# Face swap replicas (FACESWAP_HF_SPACE_URLS); concurrent swaps are micro-batched per backend
+faceswap_pool = model_backends.BackendPool.from_env('FACESWAP', 'https://Tc12345-faceswap.hf.space')
+faceswap_batcher = faceswap_engine.MicroBatcher(faceswap_pool, faceswap_engine.swap_batch)
+# Backend file handles of registered driving videos, refreshed on expiry
+driving_video_cache = driving_library.RemoteFileCache()
 
 
 def validate_card(card_number, expiry_date, cvv, card_name):
@@ -134,28 +290,69 @@ def validate_card(card_number, expiry_date, cvv, card_name):
     return True, None
 
 
+def _query_entitlement(user_id):
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT role, subscription_status FROM users WHERE user_id = %s", (user_id,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        db.close()
+
+def load_entitlement(user_id, fresh=False):
+    """
+    {role, subscription_status} for user_id (None if the user is gone), shared by
+    check_account_status and check_user_subscriber_access through entitlement_cache
+    so a request checking both costs at most one query. fresh=True reads users
+    and refreshes the cache entry. With server-side sessions the user's current
+    snapshot is used instead, and users is only read after the snapshot was
+    invalidated or expired.
+    """
+    if SERVER_SESSIONS:
+        version, user = session_store.get_entitlement(user_id)
+        if user is None:
+            user = _query_entitlement(user_id)
+            if user:
+                session_store.put_entitlement(user_id, version, user)
+        return user
+
+    user = None if fresh else entitlement_cache.get(user_id)
+    if user is None:
+        user = _query_entitlement(user_id)
+        if user:
+            entitlement_cache.set(user_id, user, ENTITLEMENT_CACHE_TTL)
+    return user
+
+def invalidate_entitlement(user_id):
+    """Call after changing a user's role or subscription_status"""
+    entitlement_cache.delete(user_id)
+    if SERVER_SESSIONS:
+        try:
+            session_store.bump_entitlement(user_id)
+        except Exception as e:
+            # The old snapshot is still dropped once it's older than ENTITLEMENT_SNAPSHOT_TTL
+            logger.error("Could not invalidate entitlement snapshot for user %s: %s", user_id, e)
+
 def check_account_status():
     """Check if the logged-in user's account is suspended"""
     if 'user_id' not in session:
         return None
     
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
     try:
-        cursor.execute("SELECT subscription_status FROM users WHERE user_id = %s", (session['user_id'],))
-        user = cursor.fetchone()
+        # Suspensions take effect at once: an admin's suspend only drops the
+        # entitlement_cache entry of the worker that handled it, so with cookie
+        # sessions users is read here on every request. Server-side snapshots
+        # are invalidated in every worker and don't need this.
+        user = load_entitlement(session['user_id'], fresh=not SERVER_SESSIONS)
         
         if user and user.get('subscription_status') == 'suspended':
             session.clear()  # Clear session if suspended
             return 'suspended'
         return 'active' if user else None
     except Exception as e:
-        print(f"Error checking account status: {e}")
+        logger.error("Error checking account status: %s", e)
         return None
-    finally:
-        cursor.close()
-        db.close()
 
 def check_user_subscriber_access():
     """Check if user is a subscriber or admin by querying database (not just session)"""
@@ -163,13 +360,7 @@ def check_user_subscriber_access():
         return False, None, None
     
     try:
-        db = get_db()
-        cursor = db.cursor(dictionary=True)
-        cursor.execute("SELECT role, subscription_status FROM users WHERE user_id = %s", (session['user_id'],))
-        user = cursor.fetchone()
-        cursor.close()
-        db.close()
-        
+        user = load_entitlement(session['user_id'])
         if not user:
             return False, None, None
         
@@ -186,27 +377,35 @@ def check_user_subscriber_access():
         has_access = (current_role in ['subscriber', 'admin']) and (current_status == 'active')
         return has_access, current_role, current_status
     except Exception as e:
-        print(f"Error checking subscriber access: {e}")
+        logger.error("Error checking subscriber access: %s", e)
         # Fallback to session check
         return session.get('role') in ['subscriber', 'admin'], session.get('role'), session.get('subscription_status')
 
 def create_talking_animation(image_path, audio_path, output_path, api_url=None):
     """
-    Stub function for MakeItTalk animation creation.
-    Replace this with your actual MakeItTalk implementation.
+    Create MakeItTalk animation on the MakeItTalk backend pool.
+    The audio is resampled and silence-trimmed, long audio is rendered as
+    parallel chunks and stitched together; the image is uploaded once per backend.
+    api_url targets a single backend instead of the configured pool.
     """
-    try:
-        # TODO: Implement actual MakeItTalk animation logic here
-        # For now, return a placeholder response
+    pool = model_backends.BackendPool([model_backends.GradioBackend(api_url)]) if api_url else makeittalk_pool
+    if pool is None:
         return {
             'status': 'error',
-            'message': 'MakeItTalk animation feature not yet implemented. Please implement the create_talking_animation function.'
-        }
-    except Exception as e:
-        return {
-            'status': 'error',
-            'message': f'Animation creation failed: {str(e)}'
+            'message': 'MakeItTalk backend is not configured. Set MAKEITTALK_API_URL or MAKEITTALK_HF_SPACE_URLS.'
         }
+    
+    image = model_backends.SharedUpload(image_path)
+    
+    def render_chunk(backend, chunk_path, chunk_output_path):
+        outputs = backend.predict([image.ref_for(backend), backend.upload(chunk_path)])
+        backend.download(outputs[0], chunk_output_path)
+    
+    result = talking_engine.render_talking(pool, render_chunk, audio_path, output_path,
+                                           work_root=app.config['UPLOAD_FOLDER'])
+    if result['status'] != 'success':
+        remove_files(output_path)
+    return result
 
 def create_fomd_animation(image_path, video_path, output_path, hf_space_url=None):
     """
@@ -216,50 +415,35 @@ def create_fomd_animation(image_path, video_path, output_path, hf_space_url=None
     try:
         # Use direct HTTP API calls instead of Python client
         # This gives us more control over file uploads
-        print("Using direct HTTP API calls to Gradio space")
+        logger.debug("Using direct HTTP API calls to Gradio space")
         
         # Use hf.space URL directly - this is the correct format for Gradio API
         if not hf_space_url:
             hf_space_url = "https://Tc12345-fomd.hf.space"
         
-        # Ensure we have the hf.space URL format
-        if 'hf.space' not in hf_space_url:
-            # Convert space path to hf.space URL
-            if '/' in hf_space_url:
-                username, space_name = hf_space_url.split('/')
-                hf_space_url = f"https://{username}-{space_name}.hf.space"
-            else:
-                hf_space_url = "https://Tc12345-fomd.hf.space"
+        # 'user/space' becomes the hf.space URL; full URLs (e.g. a local test server) are kept
+        hf_space_url = model_backends.normalize_space_url(hf_space_url)
         
         base_url = hf_space_url.rstrip('/')
-        print(f"Using hf.space URL: {base_url}")
+        logger.debug("Using hf.space URL: %s", base_url)
         
         # Gradio spaces accept files directly in the predict API call
         # We don't need to upload separately - send files as multipart/form-data
-        print("Calling predict API with files directly...")
+        logger.debug("Calling predict API with files directly...")
         
         # Gradio API endpoint format
         # For hf.space URLs, the API is typically at /api/predict
         # But we need to make sure we're using the correct base URL
         predict_endpoints = []
         
-        # Use hf.space URL directly (this is the correct format)
-        if hf_space_url and 'hf.space' in hf_space_url:
-            hf_space_base = hf_space_url.rstrip('/')
-            predict_endpoints = [
-                f"{hf_space_base}/api/predict",  # Most common format
-                f"{hf_space_base}/api/queue/push",  # Alternative queue API
-            ]
-        else:
-            # Fallback to constructed URL
-            predict_endpoints = [
-                f"{base_url}/api/predict",
-                f"{base_url}/api/queue/push",
-            ]
+        predict_endpoints = [
+            f"{base_url}/api/predict",  # Most common format
+            f"{base_url}/api/queue/push",  # Alternative queue API
+        ]
         
         # Prepare files for multipart/form-data upload
         # Gradio expects files in the 'data' field as a list
-        print(f"Preparing files: Image={image_path}, Video={video_path}")
+        logger.debug("Preparing files: Image=%s, Video=%s", image_path, video_path)
         
         # Try different endpoint formats and file formats
         response = None
@@ -268,7 +452,7 @@ def create_fomd_animation(image_path, video_path, output_path, hf_space_url=None
         # Open files once - we'll need to reopen for each attempt
         for predict_url in predict_endpoints:
             try:
-                print(f"Trying endpoint: {predict_url}")
+                logger.debug("Trying endpoint: %s", predict_url)
                 
                 # Open files for this attempt
                 with open(image_path, 'rb') as img_file, open(video_path, 'rb') as vid_file:
@@ -288,11 +472,11 @@ def create_fomd_animation(image_path, video_path, output_path, hf_space_url=None
                     response = requests.post(predict_url, files=files, timeout=300)
                     
                     if response.status_code == 200:
-                        print(f"✅ Success with endpoint: {predict_url}")
+                        logger.debug("✅ Success with endpoint: %s", predict_url)
                         break
                     elif response.status_code != 404:
                         # If it's not 404, the endpoint exists but format might be wrong
-                        print(f"Endpoint exists but returned {response.status_code}: {response.text[:200]}")
+                        logger.warning("Endpoint exists but returned %s: %s", response.status_code, response.text[:200])
                         # Try JSON format
                         img_file.seek(0)
                         vid_file.seek(0)
@@ -304,11 +488,11 @@ def create_fomd_animation(image_path, video_path, output_path, hf_space_url=None
                         }
                         response = requests.post(predict_url, json=data, timeout=300)
                         if response.status_code == 200:
-                            print(f"✅ Success with JSON format on endpoint: {predict_url}")
+                            logger.debug("✅ Success with JSON format on endpoint: %s", predict_url)
                             break
             except Exception as e:
                 last_error = e
-                print(f"Endpoint {predict_url} failed: {e}")
+                logger.warning("Endpoint %s failed: %s", predict_url, e)
                 continue
         
         if response is None:
@@ -317,7 +501,7 @@ def create_fomd_animation(image_path, video_path, output_path, hf_space_url=None
         # Process successful response
         if response.status_code == 200:
             result = response.json()
-            print(f"Predict API response: {result}")
+            app_logging.log_payload(logger, "Predict API response", result)
             
             # Extract video URL from result
             if 'data' in result and len(result['data']) > 0:
@@ -325,7 +509,7 @@ def create_fomd_animation(image_path, video_path, output_path, hf_space_url=None
                 
                 # Download the video
                 if video_url.startswith('http'):
-                    print(f"Downloading video from: {video_url}")
+                    logger.debug("Downloading video from: %s", video_url)
                     video_response = requests.get(video_url, timeout=300)
                     video_response.raise_for_status()
                     
@@ -339,7 +523,7 @@ def create_fomd_animation(image_path, video_path, output_path, hf_space_url=None
                 else:
                     # If it's a relative path, make it absolute
                     video_url = f"{base_url}{video_url}" if video_url.startswith('/') else f"{base_url}/{video_url}"
-                    print(f"Converted to absolute URL: {video_url}")
+                    logger.debug("Converted to absolute URL: %s", video_url)
                     video_response = requests.get(video_url, timeout=300)
                     video_response.raise_for_status()
                     with open(output_path, 'wb') as f:
@@ -355,16 +539,14 @@ def create_fomd_animation(image_path, video_path, output_path, hf_space_url=None
                 }
         else:
             error_text = response.text[:500] if response.text else 'No error message'
-            print(f"Predict API failed: Status {response.status_code}, Response: {error_text}")
+            logger.error("Predict API failed: Status %s, Response: %s", response.status_code, error_text)
             return {
                 'status': 'error',
                 'message': f'Predict API failed with status {response.status_code}: {error_text}'
             }
             
     except Exception as e:
-        print(f"FOMD animation creation error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("FOMD animation creation error: %s", e)
         return {
             'status': 'error',
             'message': f'Animation creation failed: {str(e)}'
@@ -392,14 +574,77 @@ def create_fomd_animation_http(image_path, video_path, output_path, hf_space_url
         # and API communication correctly.
                 
     except Exception as e:
-        print(f"HTTP API error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("HTTP API error: %s", e)
         return {
             'status': 'error',
             'message': f'HTTP API call failed: {str(e)}. Please ensure gradio_client is installed.'
         }
 
+def render_fomd_item(backend, video, image_path, output_path):
+    """
+    Animate one source image on a backend. video is a SharedUpload or a
+    library handle, so the driving video's backend file is reused.
+    """
+    video_ref = video.ref_for(backend)
+    image_ref = backend.upload(image_path)
+    try:
+        outputs = backend.predict([image_ref, video_ref])
+    except model_backends.BackendError:
+        # A cached library video may have been cleaned up on the backend
+        if not video.refresh(backend, video_ref):
+            raise
+        outputs = backend.predict([image_ref, video.ref_for(backend)])
+    backend.download(outputs[0], output_path)
+
+def create_fomd_animation_from_library(image_path, driving_video, output_path):
+    """Create FOMD animation with a registered driving video; only the image is uploaded"""
+    try:
+        with fomd_pool.acquire() as backend:
+            render_fomd_item(backend, driving_video, image_path, output_path)
+        return {
+            'status': 'success',
+            'message': 'Animation created successfully'
+        }
+    except Exception as e:
+        logger.error("FOMD animation creation error: %s", e)
+        remove_files(output_path)
+        return {
+            'status': 'error',
+            'message': f'Animation creation failed: {str(e)}'
+        }
+
+def create_fomd_animation_segmented(image_path, video_path, output_path):
+    """
+    Create FOMD animation for a long driving video by rendering keyframe-aligned
+    segments in parallel across the FOMD replicas and joining them losslessly.
+    The source image is uploaded once per backend and shared by all segments.
+    """
+    image = model_backends.SharedUpload(image_path)
+    
+    def render_segment(backend, segment_path, segment_output_path):
+        outputs = backend.predict([image.ref_for(backend), backend.upload(segment_path)])
+        backend.download(outputs[0], segment_output_path)
+    
+    result = video_segments.render_segmented(fomd_pool, render_segment, video_path, output_path,
+                                             work_root=app.config['UPLOAD_FOLDER'])
+    if result['status'] != 'success':
+        remove_files(output_path)
+    return result
+
+def driving_video_handle(video_id):
+    """Backend file handle for a registered driving video, or None if it doesn't exist"""
+    db = get_db()
+    try:
+        video = driving_library.get_video(db, video_id)
+    finally:
+        db.close()
+    if not video:
+        return None
+    full_path = storage.resolve_path(app.static_folder, video['video_path'])
+    if not full_path or not os.path.exists(full_path):
+        return None
+    return driving_video_cache.handle(full_path)
+
 # ============================================
 # MAIN ROUTES (HTML Pages)
 # ============================================
@@ -459,7 +704,7 @@ def user_dashboard():
         subscription_status = user.get('subscription_status', 'inactive')
         
     except Exception as e:
-        print(f"Error fetching user info: {e}")
+        logger.error("Error fetching user info: %s", e)
         fullname = 'User'
         subscription_status = 'inactive'
     
@@ -482,31 +727,32 @@ def subscriber_dashboard():
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        # Get user info
-        cursor.execute("SELECT fullname, subscription_plan FROM users WHERE user_id = %s", (session['user_id'],))
+        # Get user info with the most recent completed subscription, in one query
+        cursor.execute(
+            """SELECT u.fullname, u.subscription_plan,
+                      s.plan_type, s.start_date, s.end_date, s.payment_status, s.amount
+               FROM users u
+               LEFT JOIN subscriptions s ON s.subscription_id = (
+                   SELECT subscription_id FROM subscriptions
+                   WHERE user_id = u.user_id AND payment_status = 'completed'
+                   ORDER BY created_at DESC
+                   LIMIT 1
+               )
+               WHERE u.user_id = %s""",
+            (session['user_id'],)
+        )
         user = cursor.fetchone()
         
         if user:
             fullname = user.get('fullname', 'Subscriber')
             
-            # Get subscription details (most recent active subscription)
-            cursor.execute(
-                """SELECT plan_type, start_date, end_date, payment_status, amount 
-                   FROM subscriptions 
-                   WHERE user_id = %s AND payment_status = 'completed'
-                   ORDER BY created_at DESC 
-                   LIMIT 1""",
-                (session['user_id'],)
-            )
-            subscription = cursor.fetchone()
-            
-            if subscription:
+            if user.get('payment_status'):
                 subscription_info = {
-                    'plan_type': subscription.get('plan_type', 'monthly'),
-                    'start_date': subscription.get('start_date'),
-                    'end_date': subscription.get('end_date'),
-                    'amount': float(subscription.get('amount', 0)),
-                    'payment_status': subscription.get('payment_status', 'completed')
+                    'plan_type': user.get('plan_type') or 'monthly',
+                    'start_date': user.get('start_date'),
+                    'end_date': user.get('end_date'),
+                    'amount': float(user.get('amount') or 0),
+                    'payment_status': user.get('payment_status')
                 }
             elif user.get('subscription_plan'):
                 # Fallback to user table if no subscription record found
@@ -524,9 +770,7 @@ def subscriber_dashboard():
         cursor.close()
         db.close()
     except Exception as e:
-        print(f"Error fetching subscriber info: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error fetching subscriber info: %s", e)
         fullname = 'Subscriber'
         subscription_info = None
     
@@ -551,7 +795,7 @@ def admin_dashboard():
         db.close()
         fullname = user.get('fullname', 'Admin') if user else 'Admin'
     except Exception as e:
-        print(f"Error fetching user fullname: {e}")
+        logger.error("Error fetching user fullname: %s", e)
         fullname = 'Admin'
     
     return render_template('admin.html', user_fullname=fullname)
@@ -624,7 +868,7 @@ def makeittalk_page():
         
         return render_template('makeittalk.html', user_role=current_role)
     except Exception as e:
-        print(f"Error checking user role for makeittalk: {e}")
+        logger.error("Error checking user role for makeittalk: %s", e)
         # Fallback to session check
         if session.get('role') not in ['subscriber', 'admin']:
             return redirect(url_for('payment_page'))
@@ -666,7 +910,7 @@ def fomd_page():
         
         return render_template('fomd.html', user_role=current_role)
     except Exception as e:
-        print(f"Error checking user role for fomd: {e}")
+        logger.error("Error checking user role for fomd: %s", e)
         # Fallback to session check
         if session.get('role') not in ['subscriber', 'admin']:
             return redirect(url_for('payment_page'))
@@ -685,9 +929,84 @@ def faceswap_page():
         return redirect(url_for('login_page'))
     return render_template('faceswap.html', user_role=session.get('role'))
 
+# ============================================
+# RATE LIMITING (admission control for expensive endpoints)
+# ============================================
+def rate_limited(policy_name, per='user'):
+    """
+    Admit the request through rate_limit's policy before running the view:
+    per='user' limits the logged-in user (requests without a session are left
+    to the view's 401), per='address' limits the client address. Over the
+    limit the view isn't run and a 429 with Retry-After is returned.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            subscriber = False
+            if per == 'address':
+                caller = request.remote_addr or 'unknown'
+            elif 'user_id' in session:
+                caller = session['user_id']
+                try:
+                    user = load_entitlement(caller)
+                    subscriber = bool(user) and user['role'] in ('subscriber', 'admin') and user['subscription_status'] == 'active'
+                except Exception as e:
+                    logger.warning("Could not load entitlement for rate limiting: %s", e)
+            else:
+                return view(*args, **kwargs)
+
+            try:
+                job_id = rate_limit.admit(policy_name, caller, subscriber)
+            except RateLimited as e:
+                response = jsonify({'success': False, 'message': str(e)})
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response, 429
+            if job_id is None:
+                return view(*args, **kwargs)
+
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            except BaseException:
+                rate_limit.release(job_id)
+                raise
+            if response.is_streamed:
+                # Streamed responses keep working after the view returns
+                response.call_on_close(lambda: rate_limit.release(job_id))
+            else:
+                rate_limit.release(job_id)
+            return response
+        return wrapper
+    return decorator
+
 # ============================================
 # API ENDPOINTS
 # ============================================
+def hashing_busy_response(e):
+    """503 for requests turned away because the password hashing pool is saturated"""
+    response = jsonify({'success': False, 'message': 'The server is busy. Please try again in a moment.'})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+def upgrade_password_hash(user_id, password_hash, password):
+    """Re-hash a password made with older cost parameters (best effort, after a successful login)"""
+    try:
+        if not password_hashing.needs_rehash(password_hash):
+            return
+        new_hash = password_hashing.hash_password(password)
+        db = get_db()
+        cursor = db.cursor()
+        # Only replace the hash that was checked, in case the password changed meanwhile
+        cursor.execute("UPDATE users SET password = %s WHERE user_id = %s AND password = %s",
+                       (new_hash, user_id, password_hash))
+        db.commit()
+        cursor.close()
+        db.close()
+        metrics.inc('password_rehash_total')
+    except HashingBusy:
+        pass
+    except Exception as e:
+        logger.warning("Could not upgrade password hash for user %s: %s", user_id, e)
+
 @app.route('/api/signup', methods=['POST'])
 def api_signup():
     db = None
@@ -707,25 +1026,24 @@ def api_signup():
         if len(password) < 6:
             return jsonify({'success': False, 'message': 'Password must be at least 6 characters long'}), 400
         
+        # Hashed before a DB connection is taken, so none is held while waiting for the hashing pool
+        hashed_password = password_hashing.hash_password(password)
+        
         # Get database connection with proper error handling
         try:
             db = get_db()
             if not db:
-                print("ERROR: get_db() returned None")
+                logger.error("get_db() returned None")
                 return jsonify({'success': False, 'message': 'Database connection failed. Please try again.'}), 500
             if not db.is_connected():
-                print("ERROR: Database connection is not active")
+                logger.error("Database connection is not active")
                 return jsonify({'success': False, 'message': 'Database connection is not active. Please try again.'}), 500
-            print("Database connection successful")
+            logger.debug("Database connection successful")
         except MySQLError as db_error:
-            print(f"Database connection error (MySQL Error): {db_error}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Database connection error (MySQL Error): %s", db_error)
             return jsonify({'success': False, 'message': f'Database connection error: {str(db_error)}'}), 500
         except Exception as db_error:
-            print(f"Database connection error (General): {db_error}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Database connection error (General): %s", db_error)
             return jsonify({'success': False, 'message': f'Database connection error: {str(db_error)}'}), 500
         
         cursor = db.cursor(dictionary=True)
@@ -739,7 +1057,6 @@ def api_signup():
             return jsonify({'success': False, 'message': 'Email already exists'}), 400
         
         # Insert new user (no email verification needed)
-        hashed_password = generate_password_hash(password)
         cursor.execute(
             """INSERT INTO users (fullname, email, password, role, subscription_status) 
                VALUES (%s, %s, %s, %s, %s)""",
@@ -755,10 +1072,10 @@ def api_signup():
             'message': 'Account created successfully! You can now login.'
         })
     
+    except HashingBusy as e:
+        return hashing_busy_response(e)
     except Exception as e:
-        print(f"Signup error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Signup error: %s", e)
         # Ensure we close connections even on error
         if cursor:
             try:
@@ -773,6 +1090,7 @@ def api_signup():
         return jsonify({'success': False, 'message': f'Signup failed: {str(e)}'}), 500
 
 @app.route('/api/login', methods=['POST'])
+@rate_limited('login', per='address')
 def api_login():
     try:
         data = request.get_json()
@@ -791,9 +1109,11 @@ def api_login():
         cursor.close()
         db.close()
         
-        if not user or not check_password_hash(user['password'], password):
+        if not user or not password_hashing.verify_password(user['password'], password):
             return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
         
+        upgrade_password_hash(user['user_id'], user['password'], password)
+        
         # Check if account is suspended
         if user.get('subscription_status') == 'suspended':
             return jsonify({'success': False, 'message': 'Your account has been suspended. Please contact an administrator.'}), 403
@@ -811,8 +1131,10 @@ def api_login():
             'redirect': url_for(f'{user["role"]}_dashboard') if user['role'] != 'user' else url_for('user_dashboard')
         })
     
+    except HashingBusy as e:
+        return hashing_busy_response(e)
     except Exception as e:
-        print(f"Login error: {e}")
+        logger.error("Login error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/logout', methods=['POST'])
@@ -832,56 +1154,14 @@ def api_delete_account():
         db = get_db()
         cursor = db.cursor()
         
-        # Delete user's profile picture if exists
-        cursor.execute("SELECT profile_picture FROM users WHERE user_id = %s", (user_id,))
-        user = cursor.fetchone()
-        
-        if user and user[0]:
-            profile_pic_path = os.path.join('static', user[0])
-            if os.path.exists(profile_pic_path):
-                try:
-                    os.remove(profile_pic_path)
-                    print(f"Deleted profile picture: {profile_pic_path}")
-                except Exception as e:
-                    print(f"Error deleting profile picture: {e}")
-        
-        # Delete user's animations (if table exists)
-        try:
-            cursor.execute("SELECT animation_path FROM animations WHERE user_id = %s", (user_id,))
-            animations = cursor.fetchall()
-            
-            for anim in animations:
-                if anim[0]:
-                    anim_path = os.path.join('static', anim[0])
-                    if os.path.exists(anim_path):
-                        try:
-                            os.remove(anim_path)
-                            print(f"Deleted animation: {anim_path}")
-                        except Exception as e:
-                            print(f"Error deleting animation: {e}")
-        except Exception as e:
-            print(f"Animations table may not exist or error accessing it: {e}")
-        
-        # Delete user's avatars (if table exists)
-        try:
-            cursor.execute("SELECT avatar_path FROM avatars WHERE user_id = %s", (user_id,))
-            avatars = cursor.fetchall()
-            
-            for avatar in avatars:
-                if avatar[0]:
-                    avatar_path = os.path.join('static', avatar[0])
-                    if os.path.exists(avatar_path):
-                        try:
-                            os.remove(avatar_path)
-                            print(f"Deleted avatar: {avatar_path}")
-                        except Exception as e:
-                            print(f"Error deleting avatar: {e}")
-        except Exception as e:
-            print(f"Avatars table may not exist or error accessing it: {e}")
+        # Queue the user's files (profile picture, animations, avatars) for the
+        # background reaper; they're removed from disk after the commit below
+        enqueue_user_files(cursor, user_id)
         
         # Delete user from database
         cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
         db.commit()
+        invalidate_entitlement(user_id)
         
         # Clear session
         session.clear()
@@ -889,9 +1169,7 @@ def api_delete_account():
         return jsonify({'success': True, 'message': 'Account deleted successfully'})
     
     except Exception as e:
-        print(f"Delete account error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Delete account error: %s", e)
         if db:
             db.rollback()
         return jsonify({'success': False, 'message': f'Failed to delete account: {str(e)}'}), 500
@@ -934,14 +1212,17 @@ def api_change_password():
         # Verify current password
         cursor.execute("SELECT password FROM users WHERE user_id = %s", (session['user_id'],))
         user = cursor.fetchone()
+        # Not held while hashing
+        cursor.close()
+        db.close()
         
-        if not user or not check_password_hash(user['password'], current_password):
-            cursor.close()
-            db.close()
+        if not user or not password_hashing.verify_password(user['password'], current_password):
             return jsonify({'success': False, 'message': 'Current password is incorrect'}), 401
         
         # Update password
-        hashed_password = generate_password_hash(new_password)
+        hashed_password = password_hashing.hash_password(new_password)
+        db = get_db()
+        cursor = db.cursor()
         cursor.execute(
             "UPDATE users SET password = %s WHERE user_id = %s",
             (hashed_password, session['user_id'])
@@ -953,8 +1234,10 @@ def api_change_password():
         
         return jsonify({'success': True, 'message': 'Password changed successfully'})
     
+    except HashingBusy as e:
+        return hashing_busy_response(e)
     except Exception as e:
-        print(f"Change password error: {e}")
+        logger.error("Change password error: %s", e)
         return jsonify({'success': False, 'message': 'An error occurred. Please try again.'}), 500
 
 @app.route('/api/profile', methods=['GET', 'PUT'])
@@ -975,11 +1258,14 @@ def api_profile():
                          (session['user_id'],))
             user = cursor.fetchone()
             profile_pic = user.get('profile_picture') if user else None
-            print(f"📥 Profile GET - User ID: {session['user_id']}, Role: {user.get('role') if user else 'None'}, Profile Picture: {profile_pic}")
+            logger.debug("📥 Profile GET - User ID: %s, Role: %s, Profile Picture: %s", session['user_id'], user.get('role') if user else 'None', profile_pic)
             if profile_pic:
-                full_path = os.path.join('static', profile_pic)
-                file_exists = os.path.exists(full_path)
-                print(f"   → Profile picture file exists: {file_exists} at {full_path}")
+                # Resized avatar variants (filled in by the image pipeline shortly after upload)
+                cursor.execute("SELECT size, variant_path FROM profile_picture_variants WHERE user_id = %s",
+                               (session['user_id'],))
+                variants = {row['size']: f"/static/{row['variant_path']}" for row in cursor.fetchall()}
+                user['profile_picture_variants'] = variants
+                user['profile_picture_url'] = variants.get(256) or f"/static/{profile_pic}"
             return jsonify({'success': True, 'user': user})
         
         elif request.method == 'PUT':
@@ -999,7 +1285,7 @@ def api_profile():
             return jsonify({'success': True, 'message': 'Profile updated'})
     
     except Exception as e:
-        print(f"Profile error: {e}")
+        logger.error("Profile error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
     finally:
         cursor.close()
@@ -1026,55 +1312,56 @@ def api_upload_profile_picture():
     if not allowed_file(file.filename, ALLOWED_PROFILE_PICTURE_EXTENSIONS):
         return jsonify({'success': False, 'message': 'Invalid file type. Allowed: PNG, JPG, JPEG, GIF, WEBP'}), 400
     
+    uncommitted_file = None
+    upload_path = None
     try:
-        # Generate unique filename: user_id_timestamp.extension
+        # Generate unique filename: user_id_timestamp_random.extension
         user_id = session['user_id']
         file_ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{user_id}_{int(datetime.now().timestamp())}.{file_ext}"
-        filepath = os.path.join(app.config['PROFILE_PICTURES_FOLDER'], filename)
+        filename = f"{user_id}_{int(datetime.now().timestamp())}_{uuid.uuid4().hex[:8]}.{file_ext}"
         
-        # Save file
-        file.save(filepath)
+        # Relative path for database storage (sharded under uploads/profile_pictures)
+        relative_path = storage.profile_picture_relpath(filename)
+        filepath = storage.prepare_path(app.static_folder, relative_path)
         
-        # Get relative path for database storage
-        relative_path = f"uploads/profile_pictures/{filename}"
+        # The raw upload (with its EXIF: GPS, camera serial) goes to a path outside static/;
+        # only the metadata-free re-encode is published
+        fd, upload_path = tempfile.mkstemp(prefix='profile_picture_', suffix=f'.{file_ext}')
+        os.close(fd)
+        save_validated_upload(file, upload_path, 'image')
+        uncommitted_file = filepath
+        image_pipeline.strip_profile_picture(upload_path, filepath)
         
         # Update database
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        # Get old profile picture path to delete it
-        cursor.execute("SELECT profile_picture FROM users WHERE user_id = %s", (user_id,))
-        old_user = cursor.fetchone()
-        old_picture_path = old_user.get('profile_picture') if old_user else None
+        # Queue the old profile picture and its variants for deletion
+        cursor.execute(
+            """SELECT profile_picture AS file_path FROM users WHERE user_id = %s AND profile_picture IS NOT NULL
+               UNION ALL
+               SELECT variant_path FROM profile_picture_variants WHERE user_id = %s""",
+            (user_id, user_id)
+        )
+        enqueue_files(cursor, [row['file_path'] for row in cursor.fetchall()
+                               if row['file_path'].startswith('uploads/')])
+        cursor.execute("DELETE FROM profile_picture_variants WHERE user_id = %s", (user_id,))
         
         # Update user's profile picture
-        print(f"📸 Updating profile picture for user_id {user_id} with path: {relative_path}")
+        logger.debug("📸 Updating profile picture for user_id %s with path: %s", user_id, relative_path)
         cursor.execute(
             "UPDATE users SET profile_picture = %s WHERE user_id = %s",
             (relative_path, user_id)
         )
         db.commit()
-        print(f"✓ Database UPDATE executed and committed")
-        
-        # Verify the update
-        cursor.execute("SELECT profile_picture FROM users WHERE user_id = %s", (user_id,))
-        updated_user = cursor.fetchone()
-        saved_path = updated_user.get('profile_picture') if updated_user else None
-        print(f"✓ Profile picture saved to database: {saved_path}")
-        print(f"✓ File exists check: {os.path.exists(filepath)}")
+        uncommitted_file = None
+        logger.info("✓ Profile picture saved to database: %s", relative_path)
         
         cursor.close()
         db.close()
         
-        # Delete old profile picture if it exists
-        if old_picture_path and old_picture_path.startswith('uploads/'):
-            old_full_path = os.path.join('static', old_picture_path)
-            if os.path.exists(old_full_path):
-                try:
-                    os.remove(old_full_path)
-                except Exception as e:
-                    print(f"Error deleting old profile picture: {e}")
+        # Build resized variants without holding up the response
+        image_pipeline.submit_profile_picture(get_db, app.static_folder, user_id, relative_path)
         
         return jsonify({
             'success': True, 
@@ -1082,11 +1369,19 @@ def api_upload_profile_picture():
             'profile_picture': relative_path
         })
     
+    except UploadValidationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except image_pipeline.ImageProcessingError as e:
+        logger.warning("Profile picture rejected, could not strip it: %s", e.__cause__ or e)
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
-        print(f"Profile picture upload error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Profile picture upload error: %s", e)
+        # Don't leave the new file behind if the database update failed
+        if uncommitted_file:
+            remove_files(uncommitted_file)
         return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        remove_files(upload_path)
 
 
 @app.route('/api/stripe/create-checkout-session', methods=['POST'])
@@ -1126,7 +1421,7 @@ def create_checkout_session():
         if user['stripe_customer_id']:
             customer_id = user['stripe_customer_id']
         else:
-            customer = stripe.Customer.create(
+            customer = stripe_client.create_customer(
                 email=user['email'],
                 name=user['fullname'],
                 metadata={'user_id': str(session['user_id'])}
@@ -1141,7 +1436,7 @@ def create_checkout_session():
             db.commit()
         
         # Create checkout session
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = stripe_client.create_checkout_session(
             customer=customer_id,
             payment_method_types=['card'],
             line_items=[{
@@ -1164,12 +1459,10 @@ def create_checkout_session():
         })
     
     except stripe.error.StripeError as e:
-        print(f"Stripe error: {e}")
+        logger.error("Stripe error: %s", e)
         return jsonify({'success': False, 'message': f'Stripe error: {str(e)}'}), 500
     except Exception as e:
-        print(f"Create checkout session error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Create checkout session error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
     finally:
         if cursor:
@@ -1187,107 +1480,64 @@ def verify_session(session_id):
     db = None
     cursor = None
     try:
-        checkout_session = stripe.checkout.Session.retrieve(session_id)
+        # Sessions we've already applied are answered from our own DB, no Stripe call needed
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        cursor.execute(
+            """SELECT s.plan_type, s.stripe_subscription_id, u.stripe_customer_id, u.role, u.subscription_status
+               FROM subscriptions s JOIN users u ON u.user_id = s.user_id
+               WHERE s.stripe_session_id = %s AND s.user_id = %s""",
+            (session_id, session['user_id'])
+        )
+        applied = cursor.fetchone()
+        cursor.close()
+        cursor = None
+        # End the read's implicit transaction: activate_subscription starts its own on this connection
+        db.rollback()
+        
+        if applied:
+            session['role'] = applied['role']
+            session['subscription_status'] = applied['subscription_status']
+            return jsonify({
+                'success': True,
+                'status': 'paid',
+                'subscription_id': applied['stripe_subscription_id'],
+                'customer_id': applied['stripe_customer_id'],
+                'role': applied['role'],
+                'subscription_status': applied['subscription_status'],
+                'plan_type': applied['plan_type'],
+                'message': 'Subscription activated successfully!'
+            })
+        
+        checkout_session = stripe_client.retrieve_checkout_session(session_id)
         
         if checkout_session.payment_status == 'paid':
             user_id = session['user_id']
-            plan_type = checkout_session.metadata.get('plan_type', 'monthly') if checkout_session.metadata else 'monthly'
-            
-            # Update user subscription in database IMMEDIATELY (don't wait for webhook)
-            db = get_db()
-            cursor = db.cursor(dictionary=True)
-            
-            # Check if user already has an active subscription (plan change scenario)
-            cursor.execute(
-                """SELECT subscription_end_date FROM users 
-                   WHERE user_id = %s AND subscription_status = 'active' AND subscription_end_date IS NOT NULL""",
-                (user_id,)
+            plan_type = stripe_client.metadata_value(checkout_session, 'plan_type', 'monthly')
+            
+            # Update user subscription in database IMMEDIATELY (don't wait for webhook).
+            # If the webhook already applied this session, nothing is written twice.
+            user = activate_subscription(
+                db, user_id, plan_type,
+                stripe_subscription_id=checkout_session.subscription,
+                stripe_session_id=checkout_session.id
             )
-            existing_user = cursor.fetchone()
-            
-            # Calculate end date
-            start_date = datetime.now().date()
-            if existing_user and existing_user.get('subscription_end_date'):
-                # Extend from existing end date (plan change)
-                existing_end_date = existing_user['subscription_end_date']
-                if isinstance(existing_end_date, str):
-                    existing_end_date = datetime.strptime(existing_end_date, '%Y-%m-%d').date()
-                
-                if plan_type == 'monthly':
-                    end_date = existing_end_date + timedelta(days=30)
-                    amount = 9.99
-                else:
-                    end_date = existing_end_date + timedelta(days=365)
-                    amount = 99.99
-            else:
-                # New subscription - start from today
-                if plan_type == 'monthly':
-                    end_date = start_date + timedelta(days=30)
-                    amount = 9.99
-                else:
-                    end_date = start_date + timedelta(days=365)
-                    amount = 99.99
-            
-            # Update user to subscriber
-            cursor.execute(
-                """UPDATE users 
-                   SET role = 'subscriber', 
-                       subscription_status = 'active',
-                       stripe_subscription_id = %s,
-                       subscription_plan = %s,
-                       subscription_end_date = %s
-                   WHERE user_id = %s""",
-                (checkout_session.subscription, plan_type, end_date, user_id)
-            )
-            
-            # Check if subscription record exists, if not create it
-            cursor.execute(
-                "SELECT subscription_id FROM subscriptions WHERE user_id = %s AND stripe_subscription_id = %s",
-                (user_id, checkout_session.subscription)
-            )
-            existing_sub = cursor.fetchone()
-            
-            # Get the start_date based on whether this is a new subscription or plan change
-            if existing_user and existing_user.get('subscription_end_date'):
-                # Plan change - use existing end_date as the new start_date
-                if isinstance(existing_user['subscription_end_date'], str):
-                    subscription_start_date = datetime.strptime(existing_user['subscription_end_date'], '%Y-%m-%d').date()
-                else:
-                    subscription_start_date = existing_user['subscription_end_date']
-            else:
-                # New subscription - use today
-                subscription_start_date = datetime.now().date()
-            
-            if not existing_sub:
-                # Create subscription record if it doesn't exist
-                cursor.execute(
-                    """INSERT INTO subscriptions 
-                       (user_id, plan_type, start_date, end_date, payment_status, amount, stripe_subscription_id)
-                       VALUES (%s, %s, %s, %s, 'completed', %s, %s)""",
-                    (user_id, plan_type, subscription_start_date, end_date, amount, checkout_session.subscription)
-                )
-            
-            db.commit()
-            print(f'✅ Subscription activated immediately for user {user_id} (plan: {plan_type})')
+            if user['applied']:
+                invalidate_entitlement(user_id)
+                logger.info("✅ Subscription activated immediately for user %s (plan: %s)", user_id, plan_type)
             
             # Refresh session with updated role
-            cursor.execute("SELECT role, subscription_status, subscription_plan FROM users WHERE user_id = %s", (user_id,))
-            user = cursor.fetchone()
-            
-            if user:
-                session['role'] = user.get('role', 'user')
-                session['subscription_status'] = user.get('subscription_status', 'inactive')
-            
-            cursor.close()
-            db.close()
+            if user['role']:
+                session['role'] = user['role']
+                session['subscription_status'] = user['subscription_status']
             
             return jsonify({
                 'success': True,
                 'status': checkout_session.payment_status,
                 'subscription_id': checkout_session.subscription,
                 'customer_id': checkout_session.customer,
-                'role': user.get('role', 'user') if user else 'user',
-                'subscription_status': user.get('subscription_status', 'inactive') if user else 'inactive',
+                'role': user['role'] or 'user',
+                'subscription_status': user['subscription_status'] or 'inactive',
                 'plan_type': plan_type,
                 'message': 'Subscription activated successfully!'
             })
@@ -1298,12 +1548,10 @@ def verify_session(session_id):
                 'message': 'Payment not yet processed'
             })
     except stripe.error.StripeError as e:
-        print(f"Stripe error in verify-session: {e}")
+        logger.error("Stripe error in verify-session: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
     except Exception as e:
-        print(f"Error in verify-session: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in verify-session: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
     finally:
         if cursor:
@@ -1346,9 +1594,7 @@ def refresh_user_session():
             'message': 'Session refreshed successfully'
         })
     except Exception as e:
-        print(f"Error refreshing session: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error refreshing session: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -1363,10 +1609,10 @@ def stripe_webhook():
             payload, sig_header, STRIPE_WEBHOOK_SECRET
         )
     except ValueError:
-        print('Invalid payload')
+        logger.warning('Invalid payload')
         return jsonify({'error': 'Invalid payload'}), 400
     except stripe.error.SignatureVerificationError:
-        print('Invalid signature')
+        logger.warning('Invalid signature')
         return jsonify({'error': 'Invalid signature'}), 400
     
     # Handle the event
@@ -1375,82 +1621,28 @@ def stripe_webhook():
     try:
         if event['type'] == 'checkout.session.completed':
             session = event['data']['object']
-            user_id = int(session['metadata'].get('user_id', 0))
-            plan_type = session['metadata'].get('plan_type', 'monthly')
+            user_id = int(stripe_client.metadata_value(session, 'user_id', 0))
+            plan_type = stripe_client.metadata_value(session, 'plan_type', 'monthly')
             
-            # Update user subscription
+            # Update user subscription (no-op if verify-session already applied it)
             db = get_db()
-            cursor = db.cursor(dictionary=True)
-            
-            # Check if user already has an active subscription (plan change scenario)
-            cursor.execute(
-                """SELECT subscription_end_date FROM users 
-                   WHERE user_id = %s AND subscription_status = 'active' AND subscription_end_date IS NOT NULL""",
-                (user_id,)
-            )
-            existing_user = cursor.fetchone()
-            
-            # Calculate end date
-            start_date = datetime.now().date()
-            if existing_user and existing_user.get('subscription_end_date'):
-                # Extend from existing end date (plan change)
-                existing_end_date = existing_user['subscription_end_date']
-                if isinstance(existing_end_date, str):
-                    existing_end_date = datetime.strptime(existing_end_date, '%Y-%m-%d').date()
-                
-                if plan_type == 'monthly':
-                    end_date = existing_end_date + timedelta(days=30)
-                    amount = 9.99
-                else:
-                    end_date = existing_end_date + timedelta(days=365)
-                    amount = 99.99
-            else:
-                # New subscription - start from today
-                if plan_type == 'monthly':
-                    end_date = start_date + timedelta(days=30)
-                    amount = 9.99
-                else:
-                    end_date = start_date + timedelta(days=365)
-                    amount = 99.99
-            
-            # Update user
-            cursor.execute(
-                """UPDATE users 
-                   SET role = 'subscriber', 
-                       subscription_status = 'active',
-                       stripe_subscription_id = %s,
-                       subscription_plan = %s,
-                       subscription_end_date = %s
-                   WHERE user_id = %s""",
-                (session['subscription'], plan_type, end_date, user_id)
+            result = activate_subscription(
+                db, user_id, plan_type,
+                stripe_subscription_id=session['subscription'],
+                stripe_session_id=session['id']
             )
-            
-            # Get the start_date based on whether this is a new subscription or plan change
-            if existing_user and existing_user.get('subscription_end_date'):
-                # Plan change - use existing end_date as the new start_date
-                if isinstance(existing_user['subscription_end_date'], str):
-                    subscription_start_date = datetime.strptime(existing_user['subscription_end_date'], '%Y-%m-%d').date()
-                else:
-                    subscription_start_date = existing_user['subscription_end_date']
+            if result['applied']:
+                invalidate_entitlement(user_id)
+                logger.info("Subscription activated for user %s", user_id)
             else:
-                # New subscription - use today
-                subscription_start_date = datetime.now().date()
-            
-            # Create subscription record
-            cursor.execute(
-                """INSERT INTO subscriptions 
-                   (user_id, plan_type, start_date, end_date, payment_status, amount, stripe_subscription_id)
-                   VALUES (%s, %s, %s, %s, 'completed', %s, %s)""",
-                (user_id, plan_type, subscription_start_date, end_date, amount, session['subscription'])
-            )
-            
-            db.commit()
-            print(f'Subscription activated for user {user_id}')
+                logger.info("Checkout session %s already applied for user %s", session["id"], user_id)
         
         elif event['type'] == 'customer.subscription.updated':
             subscription = event['data']['object']
             subscription_id = subscription['id']
             
+            stripe_client.invalidate_subscription(subscription_id)
+            
             db = get_db()
             cursor = db.cursor(dictionary=True)
             
@@ -1470,12 +1662,15 @@ def stripe_webhook():
                         (end_date, user['user_id'])
                     )
                     db.commit()
-                    print(f'Subscription updated for user {user["user_id"]}')
+                    invalidate_entitlement(user['user_id'])
+                    logger.info("Subscription updated for user %s", user["user_id"])
         
         elif event['type'] == 'customer.subscription.deleted':
             subscription = event['data']['object']
             subscription_id = subscription['id']
             
+            stripe_client.invalidate_subscription(subscription_id)
+            
             db = get_db()
             cursor = db.cursor()
             
@@ -1497,14 +1692,13 @@ def stripe_webhook():
                     (subscription_id,)
                 )
                 db.commit()
-                print(f'Subscription canceled for user {user[0]}')
+                invalidate_entitlement(user[0])
+                logger.info("Subscription canceled for user %s", user[0])
         
         return jsonify({'received': True})
     
     except Exception as e:
-        print(f'Webhook error: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception("Webhook error: %s", e)
         return jsonify({'error': str(e)}), 500
     finally:
         if cursor:
@@ -1534,10 +1728,7 @@ def cancel_subscription():
             return jsonify({'success': False, 'message': 'No active subscription found'}), 404
         
         # Cancel subscription at period end
-        subscription = stripe.Subscription.modify(
-            user['stripe_subscription_id'],
-            cancel_at_period_end=True
-        )
+        subscription = stripe_client.cancel_subscription_at_period_end(user['stripe_subscription_id'])
         
         return jsonify({
             'success': True,
@@ -1547,7 +1738,7 @@ def cancel_subscription():
     except stripe.error.StripeError as e:
         return jsonify({'success': False, 'message': str(e)}), 500
     except Exception as e:
-        print(f'Cancel subscription error: {e}')
+        logger.error("Cancel subscription error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
     finally:
         if cursor:
@@ -1569,7 +1760,7 @@ def admin_get_users():
         return jsonify({'success': True, 'users': users})
     
     except Exception as e:
-        print(f"Get users error: {e}")
+        logger.error("Get users error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
     finally:
         cursor.close()
@@ -1592,12 +1783,14 @@ def admin_manage_user(user_id):
                 cursor.execute("UPDATE users SET subscription_status = %s WHERE user_id = %s", 
                              ('suspended', user_id))
                 db.commit()
+                invalidate_entitlement(user_id)
                 return jsonify({'success': True, 'message': 'User suspended'})
             
             elif action == 'activate':
                 cursor.execute("UPDATE users SET subscription_status = %s WHERE user_id = %s", 
                              ('active', user_id))
                 db.commit()
+                invalidate_entitlement(user_id)
                 return jsonify({'success': True, 'message': 'User activated'})
             
             elif action == 'edit':
@@ -1628,12 +1821,14 @@ def admin_manage_user(user_id):
             if user_id == session['user_id']:
                 return jsonify({'success': False, 'message': 'Cannot delete your own account'}), 400
             
+            enqueue_user_files(cursor, user_id)
             cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
             db.commit()
+            invalidate_entitlement(user_id)
             return jsonify({'success': True, 'message': 'User deleted successfully'})
     
     except Exception as e:
-        print(f"Manage user error: {e}")
+        logger.error("Manage user error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
     finally:
         cursor.close()
@@ -1660,6 +1855,9 @@ def admin_create_admin():
         if len(password) < 6:
             return jsonify({'success': False, 'message': 'Password must be at least 6 characters long'}), 400
         
+        # Hash password (before taking a DB connection)
+        hashed_password = password_hashing.hash_password(password)
+        
         # Check if email already exists
         db = get_db()
         cursor = db.cursor(dictionary=True)
@@ -1671,10 +1869,6 @@ def admin_create_admin():
             db.close()
             return jsonify({'success': False, 'message': 'Email already exists'}), 400
         
-        # Hash password
-        from werkzeug.security import generate_password_hash
-        hashed_password = generate_password_hash(password)
-        
         # Create admin account
         cursor.execute(
             """INSERT INTO users (fullname, email, password, role, subscription_status) 
@@ -1684,7 +1878,7 @@ def admin_create_admin():
         db.commit()
         
         new_admin_id = cursor.lastrowid
-        print(f'✅ Admin account created: {email} (user_id: {new_admin_id})')
+        logger.info("✅ Admin account created: %s (user_id: %s)", email, new_admin_id)
         
         cursor.close()
         db.close()
@@ -1695,10 +1889,10 @@ def admin_create_admin():
             'user_id': new_admin_id
         })
     
+    except HashingBusy as e:
+        return hashing_busy_response(e)
     except Exception as e:
-        print(f"Create admin error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Create admin error: %s", e)
         if db:
             db.rollback()
         return jsonify({'success': False, 'message': f'Error creating admin: {str(e)}'}), 500
@@ -1712,6 +1906,7 @@ def admin_create_admin():
 # MAKEITTALK API ENDPOINTS
 # ============================================
 @app.route('/api/makeittalk/animate', methods=['POST'])
+@rate_limited('animate')
 def makeittalk_animate():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
@@ -1734,6 +1929,9 @@ def makeittalk_animate():
         return jsonify({'success': False, 'message': 'No files selected'}), 400
     
     try:
+        # Don't spend a model run on a user who can't store the result
+        check_upload_quota(0)
+        
         # Save uploaded files
         image_filename = secure_filename(f"{uuid.uuid4()}_{image_file.filename}")
         audio_filename = secure_filename(f"{uuid.uuid4()}_{audio_file.filename}")
@@ -1741,45 +1939,37 @@ def makeittalk_animate():
         image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
         audio_path = os.path.join(app.config['UPLOAD_FOLDER'], audio_filename)
         
-        image_file.save(image_path)
-        audio_file.save(audio_path)
+        save_validated_upload(image_file, image_path, 'image')
+        try:
+            save_validated_upload(audio_file, audio_path, 'audio')
+        except UploadValidationError:
+            remove_files(image_path)
+            raise
+        track_temp_uploads(image_path, audio_path)
         
         # Generate output filename
-        output_filename = f"makeittalk_{uuid.uuid4()}.mp4"
-        output_path = os.path.join(app.config['ANIMATIONS_FOLDER'], 'makeittalk', output_filename)
-        
-        # Get ngrok URL from environment variable or use default
-        api_url = os.environ.get('MAKEITTALK_API_URL', None)
-        
-        # Process with MakeItTalk
-        result = create_talking_animation(
-            image_path=image_path,
-            audio_path=audio_path,
-            output_path=output_path,
-            api_url=api_url
-        )
+        animation_path, output_path = new_animation_path('makeittalk', 'mp4')
         
-        if result['status'] == 'success':
-            # Save to database
-            db = get_db()
-            cursor = db.cursor()
-            
-            cursor.execute(
-                "INSERT INTO animations (user_id, tool_type, animation_path, status) VALUES (%s, %s, %s, %s)",
-                (session['user_id'], 'makeittalk', f'animations/makeittalk/{output_filename}', 'completed')
+        # Process with MakeItTalk on the backend pool (MAKEITTALK_API_URL / MAKEITTALK_HF_SPACE_URLS)
+        try:
+            result = create_talking_animation(
+                image_path=image_path,
+                audio_path=audio_path,
+                output_path=output_path
             )
-            db.commit()
-            
-            animation_id = cursor.lastrowid
-            
-            cursor.close()
-            db.close()
+        finally:
+            # Clean up temporary files
+            remove_files(image_path, audio_path)
+        
+        if result['status'] == 'success':
+            # Save to database (charged against the user's storage quota)
+            animation_id = record_animation('makeittalk', animation_path, output_path)
             
             return jsonify({
                 'success': True,
                 'message': 'Animation created successfully',
                 'animation_id': animation_id,
-                'video_url': f'/static/animations/makeittalk/{output_filename}'
+                'video_url': f'/static/{animation_path}'
             })
         else:
             return jsonify({
@@ -1787,14 +1977,96 @@ def makeittalk_animate():
                 'message': result.get('message', 'Animation generation failed')
             }), 500
     
+    except QuotaExceeded as e:
+        return jsonify({'success': False, 'message': str(e)}), 403
+    except UploadValidationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
-        print(f"MakeItTalk error: {e}")
+        logger.error("MakeItTalk error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # ============================================
 # FACESWAP API ENDPOINTS
 # ============================================
+@app.route('/api/faceswap/swap', methods=['POST'])
+@rate_limited('animate')
+def faceswap_swap():
+    """
+    Swap the face from 'source' onto 'target' on the server and save the result
+    straight to the user's items; only the stored image's URL is returned.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    # Check if account is suspended
+    status = check_account_status()
+    if status == 'suspended':
+        return jsonify({'success': False, 'message': 'Your account has been suspended. Please contact an administrator.'}), 403
+    
+    # Check if user is a regular user or subscriber (not admin)
+    if session.get('role') not in ['user', 'subscriber']:
+        return jsonify({'success': False, 'message': 'Access denied. Only users and subscribers can use face swap.'}), 403
+    
+    source_file = request.files.get('source')
+    target_file = request.files.get('target')
+    if not source_file or not target_file or source_file.filename == '' or target_file.filename == '':
+        return jsonify({'success': False, 'message': 'Source and target images required'}), 400
+    
+    source_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(f"{uuid.uuid4()}_{source_file.filename}"))
+    target_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(f"{uuid.uuid4()}_{target_file.filename}"))
+    output_path = None
+    try:
+        # Don't spend a model run on a user who can't store the result
+        check_upload_quota(0)
+        
+        save_validated_upload(source_file, source_path, 'image')
+        save_validated_upload(target_file, target_path, 'image')
+        track_temp_uploads(source_path, target_path)
+        
+        animation_path, output_path = new_animation_path('faceswap', 'png')
+        faceswap_batcher.submit({'source_path': source_path, 'target_path': target_path, 'output_path': output_path},
+                                on_abandoned=lambda item: remove_files(*item.values()))
+        
+        # The space decides the output format; keep the extension honest
+        with open(output_path, 'rb') as f:
+            media_type = sniff_type(f.read(64))
+        if media_type not in (None, 'png'):
+            extension = 'jpg' if media_type == 'jpeg' else media_type
+            new_path, new_output_path = new_animation_path('faceswap', extension)
+            os.replace(output_path, new_output_path)
+            animation_path, output_path = new_path, new_output_path
+        
+        # Save to database (charged against the user's storage quota)
+        animation_id = record_animation('faceswap', animation_path, output_path)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Face swap completed successfully',
+            'animation_id': animation_id,
+            'image_url': f'/static/{animation_path}'
+        })
+    
+    except QuotaExceeded as e:
+        return jsonify({'success': False, 'message': str(e)}), 403
+    except UploadValidationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except faceswap_engine.BatchTimeout as e:
+        logger.error("Face swap timed out (batch running: %s)", e.still_running)
+        if e.still_running:
+            # The running batch still reads the inputs and writes the output; on_abandoned removes them
+            source_path = target_path = None
+        else:
+            remove_files(output_path)
+        return jsonify({'success': False, 'message': 'Face swap timed out. Please try again.'}), 504
+    except Exception as e:
+        logger.error("Face swap error: %s", e)
+        remove_files(output_path)
+        return jsonify({'success': False, 'message': f'Face swap failed: {str(e)[:500]}'}), 502
+    finally:
+        remove_files(source_path, target_path)
+
 @app.route('/api/faceswap/save', methods=['POST'])
+@rate_limited('save')
 def faceswap_save():
     """Save face swap result to database and server"""
     if 'user_id' not in session:
@@ -1810,6 +2082,8 @@ def faceswap_save():
         return jsonify({'success': False, 'message': 'Access denied. Only users and subscribers can use face swap.'}), 403
     
     try:
+        check_upload_quota()
+        
         # Get image data from request
         if 'image' not in request.files:
             # Try to get base64 data from JSON
@@ -1826,35 +2100,23 @@ def faceswap_save():
                 image_data = image_data.split(',')[1]
             
             image_bytes = base64.b64decode(image_data)
+            validate_bytes(image_bytes, 'image')
             
             # Generate filename
-            output_filename = f"faceswap_{uuid.uuid4()}.png"
-            output_path = os.path.join(app.config['ANIMATIONS_FOLDER'], 'faceswap', output_filename)
+            animation_path, output_path = new_animation_path('faceswap', 'png')
             
             # Save image directly (base64 decoded bytes)
             with open(output_path, 'wb') as f:
                 f.write(image_bytes)
             
-            # Save to database
-            db = get_db()
-            cursor = db.cursor()
-            
-            cursor.execute(
-                "INSERT INTO animations (user_id, tool_type, animation_path, status) VALUES (%s, %s, %s, %s)",
-                (session['user_id'], 'faceswap', f'animations/faceswap/{output_filename}', 'completed')
-            )
-            db.commit()
-            
-            animation_id = cursor.lastrowid
-            
-            cursor.close()
-            db.close()
+            # Save to database (charged against the user's storage quota)
+            animation_id = record_animation('faceswap', animation_path, output_path)
             
             return jsonify({
                 'success': True,
                 'message': 'Face swap saved successfully',
                 'animation_id': animation_id,
-                'image_url': f'/static/animations/faceswap/{output_filename}'
+                'image_url': f'/static/{animation_path}'
             })
         else:
             # Handle file upload
@@ -1863,41 +2125,31 @@ def faceswap_save():
                 return jsonify({'success': False, 'message': 'No file selected'}), 400
             
             # Generate filename
-            output_filename = f"faceswap_{uuid.uuid4()}.{file.filename.rsplit('.', 1)[1].lower()}"
-            output_path = os.path.join(app.config['ANIMATIONS_FOLDER'], 'faceswap', output_filename)
+            animation_path, output_path = new_animation_path('faceswap', file.filename.rsplit('.', 1)[1].lower())
             
             # Save file
-            file.save(output_path)
+            save_validated_upload(file, output_path, 'image')
             
-            # Save to database
-            db = get_db()
-            cursor = db.cursor()
-            
-            cursor.execute(
-                "INSERT INTO animations (user_id, tool_type, animation_path, status) VALUES (%s, %s, %s, %s)",
-                (session['user_id'], 'faceswap', f'animations/faceswap/{output_filename}', 'completed')
-            )
-            db.commit()
-            
-            animation_id = cursor.lastrowid
-            
-            cursor.close()
-            db.close()
+            # Save to database (charged against the user's storage quota)
+            animation_id = record_animation('faceswap', animation_path, output_path)
             
             return jsonify({
                 'success': True,
                 'message': 'Face swap saved successfully',
                 'animation_id': animation_id,
-                'image_url': f'/static/animations/faceswap/{output_filename}'
+                'image_url': f'/static/{animation_path}'
             })
     
+    except QuotaExceeded as e:
+        return jsonify({'success': False, 'message': str(e)}), 403
+    except UploadValidationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
-        print(f"Face swap save error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Face swap save error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/makeittalk/save', methods=['POST'])
+@rate_limited('save')
 def makeittalk_save():
     """Save MakeItTalk animation result to database and server"""
     if 'user_id' not in session:
@@ -1914,6 +2166,8 @@ def makeittalk_save():
         return jsonify({'success': False, 'message': 'Subscription required. Please upgrade to access this feature.'}), 403
     
     try:
+        check_upload_quota()
+        
         # Get video data from request
         if 'video' not in request.files:
             # Try to get base64 data from JSON
@@ -1929,35 +2183,23 @@ def makeittalk_save():
                 video_data = video_data.split(',')[1]
             
             video_bytes = base64.b64decode(video_data)
+            validate_bytes(video_bytes, 'video')
             
             # Generate filename
-            output_filename = f"makeittalk_{uuid.uuid4()}.mp4"
-            output_path = os.path.join(app.config['ANIMATIONS_FOLDER'], 'makeittalk', output_filename)
+            animation_path, output_path = new_animation_path('makeittalk', 'mp4')
             
             # Save video
             with open(output_path, 'wb') as f:
                 f.write(video_bytes)
             
-            # Save to database
-            db = get_db()
-            cursor = db.cursor()
-            
-            cursor.execute(
-                "INSERT INTO animations (user_id, tool_type, animation_path, status) VALUES (%s, %s, %s, %s)",
-                (session['user_id'], 'makeittalk', f'animations/makeittalk/{output_filename}', 'completed')
-            )
-            db.commit()
-            
-            animation_id = cursor.lastrowid
-            
-            cursor.close()
-            db.close()
+            # Save to database (charged against the user's storage quota)
+            animation_id = record_animation('makeittalk', animation_path, output_path)
             
             return jsonify({
                 'success': True,
                 'message': 'MakeItTalk animation saved successfully',
                 'animation_id': animation_id,
-                'video_url': f'/static/animations/makeittalk/{output_filename}'
+                'video_url': f'/static/{animation_path}'
             })
         else:
             # Handle file upload
@@ -1966,38 +2208,27 @@ def makeittalk_save():
                 return jsonify({'success': False, 'message': 'No file selected'}), 400
             
             # Generate filename
-            output_filename = f"makeittalk_{uuid.uuid4()}.mp4"
-            output_path = os.path.join(app.config['ANIMATIONS_FOLDER'], 'makeittalk', output_filename)
+            animation_path, output_path = new_animation_path('makeittalk', 'mp4')
             
             # Save file
-            file.save(output_path)
-            
-            # Save to database
-            db = get_db()
-            cursor = db.cursor()
+            save_validated_upload(file, output_path, 'video')
             
-            cursor.execute(
-                "INSERT INTO animations (user_id, tool_type, animation_path, status) VALUES (%s, %s, %s, %s)",
-                (session['user_id'], 'makeittalk', f'animations/makeittalk/{output_filename}', 'completed')
-            )
-            db.commit()
-            
-            animation_id = cursor.lastrowid
-            
-            cursor.close()
-            db.close()
+            # Save to database (charged against the user's storage quota)
+            animation_id = record_animation('makeittalk', animation_path, output_path)
             
             return jsonify({
                 'success': True,
                 'message': 'MakeItTalk animation saved successfully',
                 'animation_id': animation_id,
-                'video_url': f'/static/animations/makeittalk/{output_filename}'
+                'video_url': f'/static/{animation_path}'
             })
     
+    except QuotaExceeded as e:
+        return jsonify({'success': False, 'message': str(e)}), 403
+    except UploadValidationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
-        print(f"MakeItTalk save error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("MakeItTalk save error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/animation/delete/<int:animation_id>', methods=['DELETE'])
@@ -2017,7 +2248,7 @@ def delete_animation(animation_id):
         
         # Verify the animation belongs to the current user
         cursor.execute(
-            "SELECT animation_id, tool_type, animation_path FROM animations WHERE animation_id = %s AND user_id = %s",
+            "SELECT animation_id, tool_type, animation_path, file_size, storage_tier FROM animations WHERE animation_id = %s AND user_id = %s",
             (animation_id, session['user_id'])
         )
         
@@ -2028,21 +2259,13 @@ def delete_animation(animation_id):
             db.close()
             return jsonify({'success': False, 'message': 'Animation not found or access denied'}), 404
         
-        # Delete the file from server
+        # Delete from database and queue the file for the background reaper in one transaction
         # animation_path in DB is like 'animations/faceswap/filename.png'
-        # Full path is 'static/animations/faceswap/filename.png'
-        file_path = os.path.join('static', animation['animation_path'])
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                print(f"Deleted file: {file_path}")
-        except Exception as file_error:
-            print(f"Error deleting file {file_path}: {file_error}")
-            # Continue with database deletion even if file deletion fails
-        
-        # Delete from database
+        enqueue_files(cursor, [animation['animation_path']], archived=animation['storage_tier'] == 'archived')
         cursor.execute("DELETE FROM animations WHERE animation_id = %s AND user_id = %s", 
                       (animation_id, session['user_id']))
+        if cursor.rowcount:
+            quota.release(cursor, session['user_id'], animation['file_size'])
         db.commit()
         
         cursor.close()
@@ -2054,15 +2277,14 @@ def delete_animation(animation_id):
         })
     
     except Exception as e:
-        print(f"Delete animation error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Delete animation error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # ============================================
 # FOMD API ENDPOINTS
 # ============================================
 @app.route('/api/fomd/animate', methods=['POST'])
+@rate_limited('animate')
 def fomd_animate():
     """Process FOMD animation with image and video files"""
     try:
@@ -2075,7 +2297,7 @@ def fomd_animate():
             if status == 'suspended':
                 return jsonify({'success': False, 'message': 'Your account has been suspended. Please contact an administrator.'}), 403
         except Exception as status_err:
-            print(f"Error checking account status: {status_err}")
+            logger.error("Error checking account status: %s", status_err)
             # Continue anyway - don't block on status check errors
         
         # Check if user is a subscriber or admin (check database, not just session)
@@ -2084,73 +2306,79 @@ def fomd_animate():
             if not has_access:
                 return jsonify({'success': False, 'message': 'Subscription required. Please upgrade to access this feature.'}), 403
         except Exception as access_err:
-            print(f"Error checking subscriber access: {access_err}")
+            logger.error("Error checking subscriber access: %s", access_err)
             return jsonify({'success': False, 'message': 'Error checking access permissions. Please try again.'}), 500
         
-        if 'image' not in request.files or 'video' not in request.files:
+        # A registered driving video (driving_video_id) replaces the uploaded one
+        driving_video_id = request.form.get('driving_video_id', type=int)
+        
+        if 'image' not in request.files or ('video' not in request.files and not driving_video_id):
             return jsonify({'success': False, 'message': 'Image and video files required'}), 400
         
         image_file = request.files['image']
-        video_file = request.files['video']
+        video_file = None if driving_video_id else request.files['video']
         
-        if image_file.filename == '' or video_file.filename == '':
+        if image_file.filename == '' or (video_file is not None and video_file.filename == ''):
             return jsonify({'success': False, 'message': 'No files selected'}), 400
         
+        driving_video = None
+        if driving_video_id:
+            driving_video = driving_video_handle(driving_video_id)
+            if not driving_video:
+                return jsonify({'success': False, 'message': 'Driving video not found'}), 404
+        
+        # Don't spend a model run on a user who can't store the result
+        check_upload_quota(0)
+        
         # Save uploaded files temporarily
         image_filename = secure_filename(f"{uuid.uuid4()}_{image_file.filename}")
-        video_filename = secure_filename(f"{uuid.uuid4()}_{video_file.filename}")
-        
         image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-        video_path = os.path.join(app.config['UPLOAD_FOLDER'], video_filename)
+        video_path = None
         
-        image_file.save(image_path)
-        video_file.save(video_path)
+        save_validated_upload(image_file, image_path, 'image')
+        if video_file is not None:
+            video_filename = secure_filename(f"{uuid.uuid4()}_{video_file.filename}")
+            video_path = os.path.join(app.config['UPLOAD_FOLDER'], video_filename)
+            try:
+                save_validated_upload(video_file, video_path, 'video')
+            except UploadValidationError:
+                remove_files(image_path)
+                raise
+        track_temp_uploads(image_path, video_path)
         
         # Generate output filename
-        output_filename = f"fomd_{uuid.uuid4()}.mp4"
-        output_path = os.path.join(app.config['ANIMATIONS_FOLDER'], 'fomd', output_filename)
+        animation_path, output_path = new_animation_path('fomd', 'mp4')
         
         # Get HuggingFace space URL from environment or use default
         hf_space_url = os.environ.get('FOMD_HF_SPACE_URL', 'https://Tc12345-fomd.hf.space')
         
         # Process with FOMD via HuggingFace API
-        result = create_fomd_animation(
-            image_path=image_path,
-            video_path=video_path,
-            output_path=output_path,
-            hf_space_url=hf_space_url
-        )
-        
-        # Clean up temporary files
         try:
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            if os.path.exists(video_path):
-                os.remove(video_path)
-        except:
-            pass
+            if driving_video:
+                result = create_fomd_animation_from_library(image_path, driving_video, output_path)
+            elif video_segments.should_segment(fomd_pool, video_path):
+                # Long clip: render segments in parallel instead of one long job
+                result = create_fomd_animation_segmented(image_path, video_path, output_path)
+            else:
+                result = create_fomd_animation(
+                    image_path=image_path,
+                    video_path=video_path,
+                    output_path=output_path,
+                    hf_space_url=hf_space_url
+                )
+        finally:
+            # Clean up temporary files
+            remove_files(image_path, video_path)
         
         if result['status'] == 'success':
-            # Save to database
-            db = get_db()
-            cursor = db.cursor()
-            
-            cursor.execute(
-                "INSERT INTO animations (user_id, tool_type, animation_path, status) VALUES (%s, %s, %s, %s)",
-                (session['user_id'], 'fomd', f'animations/fomd/{output_filename}', 'completed')
-            )
-            db.commit()
-            
-            animation_id = cursor.lastrowid
-            
-            cursor.close()
-            db.close()
+            # Save to database (charged against the user's storage quota)
+            animation_id = record_animation('fomd', animation_path, output_path)
             
             return jsonify({
                 'success': True,
                 'message': 'Animation created successfully',
                 'animation_id': animation_id,
-                'video_url': f'/static/animations/fomd/{output_filename}'
+                'video_url': f'/static/{animation_path}'
             })
         else:
             return jsonify({
@@ -2158,11 +2386,12 @@ def fomd_animate():
                 'message': result.get('message', 'Animation generation failed')
             }), 500
     
+    except QuotaExceeded as e:
+        return jsonify({'success': False, 'message': str(e)}), 403
+    except UploadValidationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
-        print(f"FOMD animate error: {e}")
-        import traceback
-        error_trace = traceback.format_exc()
-        print(error_trace)
+        logger.exception("FOMD animate error: %s", e)
         # Always return JSON, even on errors
         error_message = str(e) if str(e) else 'An unexpected error occurred'
         # Truncate very long error messages
@@ -2173,7 +2402,109 @@ def fomd_animate():
             'message': f'FOMD animation failed: {error_message}'
         }), 500
 
+@app.route('/api/fomd/animate-batch', methods=['POST'])
+@rate_limited('animate')
+def fomd_animate_batch():
+    """
+    Animate many source images with one driving video (uploaded, or a
+    registered one via driving_video_id). The video is uploaded to each
+    backend once and reused; items run on the FOMD replicas with
+    bounded concurrency. The response is NDJSON with one line per item as it
+    finishes, then a summary line.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    status = check_account_status()
+    if status == 'suspended':
+        return jsonify({'success': False, 'message': 'Your account has been suspended. Please contact an administrator.'}), 403
+    
+    has_access, role, sub_status = check_user_subscriber_access()
+    if not has_access:
+        return jsonify({'success': False, 'message': 'Subscription required. Please upgrade to access this feature.'}), 403
+    
+    driving_video_id = request.form.get('driving_video_id', type=int)
+    video_file = None if driving_video_id else request.files.get('video')
+    image_files = [f for f in request.files.getlist('images') if f.filename]
+    if (not driving_video_id and (not video_file or video_file.filename == '')) or not image_files:
+        return jsonify({'success': False, 'message': 'A driving video and at least one image are required'}), 400
+    if len(image_files) > FOMD_BATCH_MAX_ITEMS:
+        return jsonify({'success': False, 'message': f'At most {FOMD_BATCH_MAX_ITEMS} images per batch'}), 400
+    
+    video = None
+    if driving_video_id:
+        video = driving_video_handle(driving_video_id)
+        if not video:
+            return jsonify({'success': False, 'message': 'Driving video not found'}), 404
+    
+    video_path = None
+    items = []
+    rejected = []
+    try:
+        # Don't spend model runs on a user who can't store the results
+        check_upload_quota(0)
+        
+        if video_file is not None:
+            video_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(f"{uuid.uuid4()}_{video_file.filename}"))
+            save_validated_upload(video_file, video_path, 'video')
+        
+        for index, image_file in enumerate(image_files):
+            image_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(f"{uuid.uuid4()}_{image_file.filename}"))
+            try:
+                save_validated_upload(image_file, image_path, 'image')
+                items.append({'index': index, 'filename': image_file.filename, 'image_path': image_path})
+            except UploadValidationError as e:
+                rejected.append({'index': index, 'filename': image_file.filename, 'success': False, 'message': str(e)})
+        track_temp_uploads(video_path, *[item['image_path'] for item in items])
+    except (QuotaExceeded, UploadValidationError) as e:
+        remove_files(video_path, *[item['image_path'] for item in items])
+        code = 403 if isinstance(e, QuotaExceeded) else 400
+        return jsonify({'success': False, 'message': str(e)}), code
+    
+    if video is None:
+        video = model_backends.SharedUpload(video_path)
+    
+    def render(backend, item):
+        item['animation_path'], item['output_path'] = new_animation_path('fomd', 'mp4')
+        try:
+            render_fomd_item(backend, video, item['image_path'], item['output_path'])
+        except Exception:
+            remove_files(item['output_path'])
+            raise
+        return item
+    
+    def generate():
+        succeeded = 0
+        try:
+            for result in rejected:
+                yield json.dumps(result) + '\n'
+            
+            for position, item, error in model_backends.run_batch(fomd_pool, items, render):
+                line = {'index': items[position]['index'], 'filename': items[position]['filename']}
+                if error is None:
+                    try:
+                        animation_id = record_animation('fomd', item['animation_path'], item['output_path'])
+                        line.update(success=True, animation_id=animation_id, video_url=f"/static/{item['animation_path']}")
+                        succeeded += 1
+                    except Exception as e:
+                        line.update(success=False, message=str(e))
+                else:
+                    logger.warning("FOMD batch item %s failed: %s", line['index'], error)
+                    line.update(success=False, message=f'FOMD animation failed: {str(error)[:500]}')
+                yield json.dumps(line) + '\n'
+            
+            yield json.dumps({
+                'done': True,
+                'succeeded': succeeded,
+                'failed': len(image_files) - succeeded
+            }) + '\n'
+        finally:
+            remove_files(video_path, *[item['image_path'] for item in items])
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/fomd/save', methods=['POST'])
+@rate_limited('save')
 def fomd_save():
     """Save FOMD animation result to database and server"""
     if 'user_id' not in session:
@@ -2190,6 +2521,8 @@ def fomd_save():
         return jsonify({'success': False, 'message': 'Subscription required. Please upgrade to access this feature.'}), 403
     
     try:
+        check_upload_quota()
+        
         # Get video data from request
         if 'video' not in request.files:
             # Try to get base64 data from JSON
@@ -2206,35 +2539,23 @@ def fomd_save():
                 video_data = video_data.split(',')[1]
             
             video_bytes = base64.b64decode(video_data)
+            validate_bytes(video_bytes, 'video')
             
             # Generate filename
-            output_filename = f"fomd_{uuid.uuid4()}.mp4"
-            output_path = os.path.join(app.config['ANIMATIONS_FOLDER'], 'fomd', output_filename)
+            animation_path, output_path = new_animation_path('fomd', 'mp4')
             
             # Save video
             with open(output_path, 'wb') as f:
                 f.write(video_bytes)
             
-            # Save to database
-            db = get_db()
-            cursor = db.cursor()
-            
-            cursor.execute(
-                "INSERT INTO animations (user_id, tool_type, animation_path, status) VALUES (%s, %s, %s, %s)",
-                (session['user_id'], 'fomd', f'animations/fomd/{output_filename}', 'completed')
-            )
-            db.commit()
-            
-            animation_id = cursor.lastrowid
-            
-            cursor.close()
-            db.close()
+            # Save to database (charged against the user's storage quota)
+            animation_id = record_animation('fomd', animation_path, output_path)
             
             return jsonify({
                 'success': True,
                 'message': 'FOMD animation saved successfully',
                 'animation_id': animation_id,
-                'video_url': f'/static/animations/fomd/{output_filename}'
+                'video_url': f'/static/{animation_path}'
             })
         else:
             # Handle file upload
@@ -2243,40 +2564,101 @@ def fomd_save():
                 return jsonify({'success': False, 'message': 'No file selected'}), 400
             
             # Generate filename
-            output_filename = f"fomd_{uuid.uuid4()}.{file.filename.rsplit('.', 1)[1].lower()}"
-            output_path = os.path.join(app.config['ANIMATIONS_FOLDER'], 'fomd', output_filename)
+            animation_path, output_path = new_animation_path('fomd', file.filename.rsplit('.', 1)[1].lower())
             
             # Save file
-            file.save(output_path)
-            
-            # Save to database
-            db = get_db()
-            cursor = db.cursor()
-            
-            cursor.execute(
-                "INSERT INTO animations (user_id, tool_type, animation_path, status) VALUES (%s, %s, %s, %s)",
-                (session['user_id'], 'fomd', f'animations/fomd/{output_filename}', 'completed')
-            )
-            db.commit()
-            
-            animation_id = cursor.lastrowid
+            save_validated_upload(file, output_path, 'video')
             
-            cursor.close()
-            db.close()
+            # Save to database (charged against the user's storage quota)
+            animation_id = record_animation('fomd', animation_path, output_path)
             
             return jsonify({
                 'success': True,
                 'message': 'FOMD animation saved successfully',
                 'animation_id': animation_id,
-                'video_url': f'/static/animations/fomd/{output_filename}'
+                'video_url': f'/static/{animation_path}'
             })
     
+    except QuotaExceeded as e:
+        return jsonify({'success': False, 'message': str(e)}), 403
+    except UploadValidationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
-        print(f"FOMD save error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("FOMD save error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# ============================================
+# DRIVING VIDEO LIBRARY
+# ============================================
+@app.route('/api/driving-videos', methods=['GET'])
+def list_driving_videos():
+    """Registered driving videos that FOMD requests can reference by driving_video_id"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    db = get_db()
+    try:
+        videos = driving_library.list_videos(db)
+        for video in videos:
+            video['video_url'] = f"/static/{video['video_path']}"
+        return jsonify({'success': True, 'videos': videos})
+    except Exception as e:
+        logger.error("List driving videos error: %s", e)
+        return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        db.close()
+
+@app.route('/api/admin/driving-videos', methods=['POST'])
+def admin_register_driving_video():
+    """Register a driving video: pre-process it and upload it to every FOMD backend (admin-only)"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    video_file = request.files.get('video')
+    name = request.form.get('name', '').strip()
+    if not video_file or video_file.filename == '' or not name:
+        return jsonify({'success': False, 'message': 'Name and video file are required'}), 400
+    
+    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(f"{uuid.uuid4()}_{video_file.filename}"))
+    db = None
+    try:
+        save_validated_upload(video_file, upload_path, 'video')
+        db = get_db()
+        video = driving_library.register_video(db, app.static_folder, upload_path, name, session['user_id'])
+        
+        # Upload to the backends now so the first request doesn't pay for it
+        full_path = os.path.join(app.static_folder, video['video_path'])
+        threading.Thread(target=driving_video_cache.warm, args=(fomd_pool, [full_path]), daemon=True).start()
+        
+        return jsonify({'success': True, 'message': 'Driving video registered', 'video': video})
+    except UploadValidationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error("Register driving video error: %s", e)
+        return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        remove_files(upload_path)
+        if db:
+            db.close()
+
+@app.route('/api/admin/driving-videos/<int:video_id>', methods=['DELETE'])
+def admin_delete_driving_video(video_id):
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    db = get_db()
+    try:
+        video_path = driving_library.delete_video(db, video_id)
+        if not video_path:
+            return jsonify({'success': False, 'message': 'Driving video not found'}), 404
+        driving_video_cache.invalidate(os.path.join(app.static_folder, video_path))
+        return jsonify({'success': True, 'message': 'Driving video deleted'})
+    except Exception as e:
+        logger.error("Delete driving video error: %s", e)
+        return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        db.close()
+
 # ============================================
 # GET USER GENERATED ITEMS
 # ============================================
@@ -2341,14 +2723,248 @@ def get_user_generated_items():
         })
     
     except Exception as e:
-        print(f"Get generated items error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Get generated items error: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# ============================================
+# REQUEST IDS (tagged on every log record)
+# ============================================
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+@app.before_request
+def assign_request_id():
+    # Reuse the proxy's id when it sends a sane one, so logs line up across hops
+    incoming = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming if REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+
+@app.after_request
+def add_request_id_header(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+# ============================================
+# METRICS (Prometheus)
+# ============================================
+@app.before_request
+def start_request_metrics():
+    g.request_started_at = time.perf_counter()
+    db_metrics.reset_request_stats()
+
+@app.after_request
+def record_request_metrics(response):
+    """Latency per endpoint/method/status, bytes in/out, and DB work done by the request"""
+    started_at = getattr(g, 'request_started_at', None)
+    if started_at is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    method, path, status = request.method, request.path, str(response.status_code)
+    if request.content_length:
+        metrics.inc('http_request_bytes_total', request.content_length, endpoint=endpoint)
+    
+    def finish():
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started_at,
+                        endpoint=endpoint, method=method, status=status)
+        if response.content_length:
+            metrics.inc('http_response_bytes_total', response.content_length, endpoint=endpoint)
+        queries, query_seconds = db_metrics.request_stats()
+        metrics.observe('db_queries_per_request', queries, endpoint=endpoint)
+        metrics.observe('db_request_query_seconds', query_seconds, endpoint=endpoint)
+        report_query_trace(response, endpoint, method, path)
+    
+    if response.is_streamed:
+        # A streamed body (and its queries) is produced after this hook; measure once it's been sent
+        response.call_on_close(finish)
+    else:
+        finish()
+    return response
+
+# Send Server-Timing / X-Query-* headers (and the statement summary for
+# requests carrying X-Debug-Queries: 1); on in debug mode or with QUERY_DEBUG_HEADER=1
+QUERY_DEBUG_HEADER = os.getenv('QUERY_DEBUG_HEADER', '0') == '1'
+
+def report_query_trace(response, endpoint, method, path):
+    """
+    Slow-query log and N+1 warnings for the finished request, plus the debug
+    headers (not for streamed responses, whose headers are already sent).
+    """
+    trace = db_metrics.finish_request_trace()
+    if not trace or not trace['queries']:
+        return
+    for entry in trace['slow']:
+        metrics.inc('db_slow_queries_total', endpoint=endpoint)
+        logger.warning("🐢 Slow query (%.0f ms, %s rows) in %s %s: %s", entry['seconds'] * 1000, entry['rows'], method, path, entry['statement'])
+    for statement in trace['repeated']:
+        metrics.inc('db_n_plus_one_total', endpoint=endpoint)
+        logger.warning("Possible N+1 in %s %s: %sx %s", method, path, statement['count'], statement['statement'])
+    
+    if response.is_streamed or not (QUERY_DEBUG_HEADER or app.debug):
+        return
+    response.headers['X-Query-Count'] = str(trace['queries'])
+    response.headers.add('Server-Timing', f'db;dur={trace["seconds"] * 1000:.1f};desc="{trace["queries"]} queries"')
+    if request.headers.get('X-Debug-Queries') == '1':
+        # Top statements by time: count x total ms, rows, normalized text
+        summary = [f"{s['count']}x {s['seconds'] * 1000:.1f}ms {s['rows']}r {s['statement']}"
+                   for s in trace['statements'][:10]]
+        response.headers['X-Query-Summary'] = json.dumps(summary)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint (bearer METRICS_TOKEN required when set)"""
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+# ============================================
+# PROFILING (admin-triggered request profiles, tracemalloc)
+# ============================================
+PROFILE_SECRET = os.getenv('PROFILE_SECRET') or app.secret_key
+
+@app.before_request
+def start_request_profile():
+    """Profile this request if it carries a valid profile token or is randomly sampled"""
+    token = request.headers.get('X-Profile-Token') or request.args.get('_profile')
+    mode = profiling.check_token(PROFILE_SECRET, token) if token else None
+    if mode is None and profiling.should_sample():
+        mode = 'cprofile'
+    if mode:
+        g.request_profile = profiling.start(mode)
+
+@app.after_request
+def save_request_profile(response):
+    profile = g.pop('request_profile', None)
+    if profile is None:
+        return response
+    label = f"{request.endpoint or 'unmatched'}_{g.get('request_id', '')}"
+    method, path = request.method, request.path
+    if response.is_streamed:
+        # Keep profiling while the body is generated; its id can only go to the log
+        response.call_on_close(lambda: finish_request_profile(profile, label, method, path))
+        return response
+    name = finish_request_profile(profile, label, method, path)
+    if name:
+        response.headers['X-Profile-Id'] = name
+    return response
+
+def finish_request_profile(profile, label, method, path):
+    """Stop and save a request's profile; returns the saved name or None"""
+    profile.stop()
+    try:
+        name = profile.save(label)
+        logger.info("Saved request profile %s for %s %s", name, method, path)
+        return name
+    except OSError as e:
+        logger.error("Could not save request profile: %s", e)
+        return None
+
+@app.teardown_request
+def stop_request_profile(exc):
+    # Only left running when after_request didn't get to it
+    profile = g.pop('request_profile', None)
+    if profile is not None:
+        profile.stop()
+
+@app.route('/api/admin/profiling/token', methods=['POST'])
+def admin_profiling_token():
+    """Issue a token that profiles requests sending it as X-Profile-Token or ?_profile= (admin-only)"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'cprofile')
+    if mode not in profiling.MODES:
+        return jsonify({'success': False, 'message': f"mode must be one of {', '.join(profiling.MODES)}"}), 400
+    try:
+        ttl = min(int(data.get('ttl_seconds', profiling.PROFILE_TOKEN_TTL)), 24 * 3600)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'ttl_seconds must be a number'}), 400
+    return jsonify({'success': True, 'token': profiling.make_token(PROFILE_SECRET, mode, ttl), 'mode': mode, 'expires_in': ttl})
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def admin_list_profiles():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    return jsonify({'success': True, 'profiles': profiling.list_profiles()})
+
+@app.route('/api/admin/profiles/<name>', methods=['GET'])
+def admin_download_profile(name):
+    """Download a saved profile; ?format=text renders a cProfile dump as a pstats table"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    path = profiling.profile_path(name)
+    if not path:
+        return jsonify({'success': False, 'message': 'Profile not found'}), 404
+    if request.args.get('format') == 'text' and name.endswith('.prof'):
+        sort = request.args.get('sort', 'cumulative')
+        try:
+            return Response(profiling.pstats_text(path, sort=sort), content_type='text/plain; charset=utf-8')
+        except KeyError:
+            return jsonify({'success': False, 'message': f'Unknown sort key: {sort}'}), 400
+    return send_file(path, as_attachment=True, download_name=name)
+
+@app.route('/api/admin/tracemalloc', methods=['POST', 'DELETE'])
+def admin_tracemalloc():
+    """Start (POST) or stop (DELETE) allocation tracing in the worker handling the request"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    if request.method == 'DELETE':
+        profiling.tracemalloc_stop()
+        return jsonify({'success': True, 'message': 'Allocation tracing stopped', 'pid': os.getpid()})
+    data = request.get_json(silent=True) or {}
+    try:
+        frames = max(1, int(data.get('frames', 10)))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'frames must be a number'}), 400
+    profiling.tracemalloc_start(frames)
+    return jsonify({'success': True, 'message': 'Allocation tracing started', 'pid': os.getpid()})
+
+@app.route('/api/admin/tracemalloc/snapshot', methods=['GET'])
+def admin_tracemalloc_snapshot():
+    """Top allocation sites of this worker and their growth since the previous snapshot"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    report = profiling.tracemalloc_report(limit=request.args.get('limit', 25, type=int))
+    if report is None:
+        return jsonify({'success': False, 'message': 'Allocation tracing is not running in this worker', 'pid': os.getpid()}), 409
+    return jsonify({'success': True, **report})
+
+# ============================================
+# TIERED RETENTION (archived animations)
+# ============================================
+@app.after_request
+def record_animation_access(response):
+    """Note reads of generated files; flushed to animations.last_accessed_at in batches"""
+    if (request.endpoint == 'static' and response.status_code in (200, 206, 304)
+            and request.path.startswith('/static/animations/')):
+        access_recorder.record(request.path[len('/static/'):])
+    return response
+
+def restore_archived_file(relative_path):
+    """Restore an archived animation to static/ so it can be served; returns its path or None"""
+    try:
+        db = get_db()
+        try:
+            return retention.restore_animation(db, app.static_folder, archive_tier, relative_path)
+        finally:
+            db.close()
+    except Exception as e:
+        logger.error("Error restoring archived file %s: %s", relative_path, e)
+        return None
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(e):
+    # Archived animations are restored transparently on first access
+    if request.path.startswith('/static/animations/'):
+        restored_path = restore_archived_file(request.path[len('/static/'):])
+        if restored_path:
+            return send_file(restored_path, conditional=True)
     return render_template('index.html'), 404
 
 @app.errorhandler(500)
@@ -2358,9 +2974,7 @@ def internal_error(e):
 @app.errorhandler(Exception)
 def handle_exception(e):
     """Handle all unhandled exceptions and return JSON for API routes"""
-    print(f"Unhandled exception: {e}")
-    import traceback
-    traceback.print_exc()
+    logger.exception("Unhandled exception: %s", e)
     # If it's an API request, return JSON
     if request.path.startswith('/api/'):
         return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
@@ -2371,15 +2985,144 @@ def handle_exception(e):
         # Fallback if error.html doesn't exist
         return f'<h1>An error occurred</h1><p>{str(e)}</p>', 500
 
+# ============================================
+# BACKGROUND JOBS
+# ============================================
+def _sweep_expired_subscriptions_job(db):
+    downgraded = sweep_expired_subscriptions(db, batch_size=int(os.getenv('SUBSCRIPTION_SWEEP_BATCH_SIZE', '500')))
+    for user_id in downgraded:
+        invalidate_entitlement(user_id)
+    return downgraded
+
+if SERVER_SESSIONS:
+    background_jobs.register_job('session_purge',
+                                 int(os.getenv('SESSION_PURGE_INTERVAL', '3600')),
+                                 lambda db: session_store.purge_expired())
+
+background_jobs.register_job('subscription_sweep',
+                             int(os.getenv('SUBSCRIPTION_SWEEP_INTERVAL', '3600')),
+                             _sweep_expired_subscriptions_job)
+
+background_jobs.register_job('file_cleanup',
+                             int(os.getenv('FILE_CLEANUP_INTERVAL', '60')),
+                             lambda db: reap_cleanup_queue(db, static_root=app.static_folder, archive_tier=archive_tier))
+background_jobs.register_job('animation_file_reconcile',
+                             int(os.getenv('ANIMATION_RECONCILE_INTERVAL', '86400')),
+                             lambda db: reconcile_animation_files(db, static_root=app.static_folder))
+
+background_jobs.register_job('upload_gc',
+                             int(os.getenv('UPLOAD_GC_INTERVAL', '3600')),
+                             lambda db: upload_gc.collect_uploads(
+                                 db, app.static_folder,
+                                 upload_folder=os.path.abspath(app.config['UPLOAD_FOLDER']),
+                                 profile_pictures_folder=os.path.abspath(app.config['PROFILE_PICTURES_FOLDER']),
+                                 orphan_ttl_seconds=int(os.getenv('UPLOAD_GC_ORPHAN_TTL', '86400'))
+                             ))
+
+background_jobs.register_job('quota_reconcile',
+                             int(os.getenv('QUOTA_RECONCILE_INTERVAL', '86400')),
+                             lambda db: quota.reconcile_usage(db, app.static_folder))
+
+background_jobs.register_job('retention_access_flush',
+                             int(os.getenv('RETENTION_ACCESS_FLUSH_INTERVAL', '30')),
+                             access_recorder.flush,
+                             exclusive=False)
+if os.getenv('RETENTION_ENABLED', '0') == '1':
+    background_jobs.register_job('retention_archive',
+                                 int(os.getenv('RETENTION_ARCHIVE_INTERVAL', '86400')),
+                                 lambda db: retention.archive_cold_animations(
+                                     db, app.static_folder, archive_tier,
+                                     min_age_days=int(os.getenv('RETENTION_MIN_AGE_DAYS', '30')),
+                                     min_size_bytes=int(os.getenv('RETENTION_MIN_SIZE_BYTES', '0'))
+                                 ))
+def _warm_driving_videos_job(db):
+    """Keep every registered driving video uploaded to each FOMD backend (per worker cache)"""
+    full_paths = []
+    for video in driving_library.list_videos(db):
+        full_path = storage.resolve_path(app.static_folder, video['video_path'])
+        if full_path and os.path.exists(full_path):
+            full_paths.append(full_path)
+    return driving_video_cache.warm(fomd_pool, full_paths)
+
+background_jobs.register_job('driving_video_warm',
+                             int(os.getenv('DRIVING_VIDEO_WARM_INTERVAL', '1800')),
+                             _warm_driving_videos_job,
+                             exclusive=False)
+
+def start_background_jobs():
+    """
+    Start the registered jobs in this process. Called by the server that runs
+    the app (gunicorn.conf.py post_worker_init, or `python app.py`), not on
+    import, so CLI commands, devtools scripts and helper processes that import
+    app don't run maintenance against the database.
+    """
+    background_jobs.start(get_db)
+
+@app.cli.command('sweep-subscriptions')
+def sweep_subscriptions_command():
+    """Downgrade expired subscribers now (for cron / manual runs)"""
+    downgraded = background_jobs.run_job_once('subscription_sweep', get_db)
+    if downgraded is None:
+        print("Another process is already running the subscription sweep")
+    else:
+        print(f"Downgraded {len(downgraded)} expired subscriber(s)")
+
+@app.cli.command('cleanup-files')
+def cleanup_files_command():
+    """Queue orphaned animation files and drain the file cleanup queue now"""
+    queued = background_jobs.run_job_once('animation_file_reconcile', get_db)
+    removed = background_jobs.run_job_once('file_cleanup', get_db)
+    print(f"Queued {queued or 0} orphaned file(s), completed {removed or 0} cleanup entr(ies)")
+
+@app.cli.command('migrate-storage-layout')
+def migrate_storage_layout_command():
+    """Move animations and profile pictures from the flat layout into shard directories"""
+    db = get_db()
+    try:
+        result = storage.migrate_to_sharded_layout(
+            db, app.static_folder,
+            batch_size=int(os.getenv('STORAGE_MIGRATION_BATCH_SIZE', '500'))
+        )
+    finally:
+        db.close()
+    print(f"Migrated {result['animations']} animation(s) and {result['profile_pictures']} profile picture(s)")
+
+@app.cli.command('collect-uploads')
+def collect_uploads_command():
+    """Reclaim expired temp inputs and orphaned files under static/uploads now"""
+    result = background_jobs.run_job_once('upload_gc', get_db)
+    if result is None:
+        print("Another process is already running the upload GC")
+    else:
+        print(f"Reclaimed {result['files']} file(s), {result['bytes']} bytes")
+
+@app.cli.command('reconcile-quotas')
+def reconcile_quotas_command():
+    """Recompute every user's animation_count/storage_bytes from the animations table"""
+    corrected = background_jobs.run_job_once('quota_reconcile', get_db)
+    print(f"Corrected counters for {corrected or 0} user(s)")
+
+@app.cli.command('archive-cold-animations')
+def archive_cold_animations_command():
+    """Move animations not accessed for RETENTION_MIN_AGE_DAYS to the archive tier now"""
+    db = get_db()
+    try:
+        archived = retention.archive_cold_animations(
+            db, app.static_folder, archive_tier,
+            min_age_days=int(os.getenv('RETENTION_MIN_AGE_DAYS', '30')),
+            min_size_bytes=int(os.getenv('RETENTION_MIN_SIZE_BYTES', '0'))
+        )
+    finally:
+        db.close()
+    print(f"Archived {archived} animation(s)")
+
 # Database connection will be tested on first request
 
 if __name__ == '__main__':
-    print("\n" + "="*60)
-    print("Face Animation Platform Starting...")
-    print("="*60)
-    print(f"Server running at: http://localhost:5000")
-    print(f"Static folder: {app.static_folder}")
-    print(f"Template folder: {app.template_folder}")
-    print("="*60 + "\n")
+    logger.info("Face Animation Platform starting at http://localhost:5000 (static folder: %s, template folder: %s)",
+                app.static_folder, app.template_folder)
     
+    # With the reloader, only the child process that serves requests runs the jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_jobs()
     app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
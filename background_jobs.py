@@ -0,0 +1,77 @@
+import logging
+import os
+import threading
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Periodic maintenance jobs (subscription expiry, file cleanup, ...).
+# Every gunicorn worker starts the same threads; for exclusive jobs a MySQL
+# named lock (GET_LOCK) makes sure only one of them runs at a time.
+# Non-exclusive jobs run in every worker (e.g. flushing per-process buffers).
+_jobs = {}
+_started = False
+_start_lock = threading.Lock()
+
+
+def register_job(name, interval_seconds, fn, exclusive=True):
+    """Register fn(db) to run every interval_seconds"""
+    _jobs[name] = {'interval': interval_seconds, 'fn': fn, 'exclusive': exclusive}
+
+
+def run_job_once(name, get_db):
+    """
+    Run a registered job now, holding its cluster-wide lock if exclusive.
+    Returns the job's result, or None if another process holds the lock.
+    """
+    job = _jobs[name]
+    db = get_db()
+    if not job['exclusive']:
+        try:
+            with metrics.timed('background_job_seconds', job=name):
+                return job['fn'](db)
+        finally:
+            db.close()
+
+    cursor = db.cursor()
+    lock_name = f'face_animation_job:{name}'
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (lock_name,))
+        got_lock = cursor.fetchone()[0] == 1
+        if not got_lock:
+            return None
+        try:
+            with metrics.timed('background_job_seconds', job=name):
+                return job['fn'](db)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+            cursor.fetchone()
+    finally:
+        cursor.close()
+        db.close()
+
+
+def _loop(name, get_db):
+    interval = _jobs[name]['interval']
+    while True:
+        # Sleep first so app startup isn't slowed down by maintenance work
+        time.sleep(interval)
+        try:
+            run_job_once(name, get_db)
+            metrics.inc('background_job_runs_total', job=name, outcome='ok')
+        except Exception as e:
+            metrics.inc('background_job_runs_total', job=name, outcome='error')
+            logger.exception("Background job %s failed: %s", name, e)
+
+
+def start(get_db):
+    """Start one daemon thread per registered job (idempotent per process)"""
+    global _started
+    with _start_lock:
+        if _started or os.getenv('BACKGROUND_JOBS_ENABLED', '1') != '1':
+            return
+        _started = True
+    for name in _jobs:
+        thread = threading.Thread(target=_loop, args=(name, get_db), name=f'job-{name}', daemon=True)
+        thread.start()
@@ -0,0 +1,99 @@
+-- Incremental migrations for databases created from an older database_schema_railway.sql
+-- Fresh installs don't need this file: the schema already contains every change below.
+-- Apply each section once, in order, starting after the last one the database already has.
+-- Sections are not re-runnable: ALTER TABLE ... ADD COLUMN/KEY and CREATE INDEX fail on a
+-- database that already has them (MySQL has no IF NOT EXISTS for either).
+USE railway;
+
+-- Subscription activation is idempotent per Stripe checkout session
+ALTER TABLE subscriptions ADD COLUMN stripe_session_id VARCHAR(255) NULL AFTER stripe_price_id;
+ALTER TABLE subscriptions ADD UNIQUE KEY uniq_subscription_stripe_session (stripe_session_id);
+
+-- Expired-subscription sweeper scans active users by end date
+CREATE INDEX idx_user_subscription_expiry ON users(subscription_status, subscription_end_date);
+
+-- Background file deletion queue for account/animation deletes
+CREATE TABLE IF NOT EXISTS file_cleanup_queue (
+    cleanup_id INT PRIMARY KEY AUTO_INCREMENT,
+    file_path VARCHAR(500) NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    last_error VARCHAR(500) NULL,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX idx_cleanup_next_attempt ON file_cleanup_queue(next_attempt_at);
+CREATE INDEX idx_animation_path ON animations(animation_path);
+
+-- Temporary model inputs under static/uploads, reclaimed by the upload GC once expired
+CREATE TABLE IF NOT EXISTS temp_uploads (
+    temp_upload_id INT PRIMARY KEY AUTO_INCREMENT,
+    file_path VARCHAR(500) NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX idx_temp_upload_expires ON temp_uploads(expires_at);
+CREATE INDEX idx_temp_upload_path ON temp_uploads(file_path);
+CREATE INDEX idx_user_profile_picture ON users(profile_picture);
+
+-- Denormalized per-user storage counters for quota enforcement
+-- (run 'flask reconcile-quotas' afterwards to fill them for existing data)
+ALTER TABLE users ADD COLUMN animation_count INT NOT NULL DEFAULT 0 AFTER subscription_end_date;
+ALTER TABLE users ADD COLUMN storage_bytes BIGINT NOT NULL DEFAULT 0 AFTER animation_count;
+ALTER TABLE animations ADD COLUMN file_size BIGINT NULL AFTER animation_path;
+
+-- Tiered retention: track last access and which tier holds the file
+ALTER TABLE animations ADD COLUMN storage_tier ENUM('hot', 'archived') NOT NULL DEFAULT 'hot' AFTER status;
+ALTER TABLE animations ADD COLUMN last_accessed_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP AFTER storage_tier;
+UPDATE animations SET last_accessed_at = created_at;
+CREATE INDEX idx_animation_retention ON animations(storage_tier, last_accessed_at);
+
+-- Resized avatar variants generated for each profile picture
+CREATE TABLE IF NOT EXISTS profile_picture_variants (
+    user_id INT NOT NULL,
+    size INT NOT NULL,
+    variant_path VARCHAR(500) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, size),
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+CREATE INDEX idx_profile_picture_variant_path ON profile_picture_variants(variant_path);
+
+-- Driving video library (registered clips reused across FOMD requests)
+CREATE TABLE IF NOT EXISTS driving_videos (
+    video_id INT PRIMARY KEY AUTO_INCREMENT,
+    name VARCHAR(255) NOT NULL,
+    video_path VARCHAR(500) NOT NULL,
+    file_size BIGINT NULL,
+    duration_seconds FLOAT NULL,
+    created_by INT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (created_by) REFERENCES users(user_id) ON DELETE SET NULL
+);
+-- One row per driving video path (earlier versions could seed the samples twice)
+DELETE d FROM driving_videos d JOIN driving_videos keep
+    ON keep.video_path = d.video_path AND keep.video_id < d.video_id;
+ALTER TABLE driving_videos ADD UNIQUE KEY uniq_driving_video_path (video_path);
+INSERT IGNORE INTO driving_videos (name, video_path) VALUES
+('Sample 1', 'videos/sample1.mp4'),
+('Sample 2', 'videos/sample2.mp4');
+
+-- Server-side sessions (SESSION_BACKEND=db); the cookie only carries session_id
+CREATE TABLE IF NOT EXISTS user_sessions (
+    session_id CHAR(43) PRIMARY KEY,
+    user_id INT NULL,
+    data TEXT NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+CREATE INDEX idx_user_session_expires ON user_sessions(expires_at);
+
+-- Versioned {role, subscription_status} snapshots; the version is bumped on every role or status change
+CREATE TABLE IF NOT EXISTS user_entitlements (
+    user_id INT PRIMARY KEY,
+    version INT NOT NULL DEFAULT 0,
+    role VARCHAR(20) NULL,
+    subscription_status VARCHAR(20) NULL,
+    cached_at TIMESTAMP NULL
+);
+
+-- Only queue entries for archived animations also delete the archive-tier copy
+ALTER TABLE file_cleanup_queue ADD COLUMN archived BOOLEAN NOT NULL DEFAULT FALSE AFTER file_path;
@@ -16,6 +16,8 @@ CREATE TABLE IF NOT EXISTS users (
     stripe_subscription_id VARCHAR(255) NULL,
     subscription_plan VARCHAR(50) NULL,
     subscription_end_date DATE NULL,
+    animation_count INT NOT NULL DEFAULT 0,
+    storage_bytes BIGINT NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
 );
@@ -27,7 +29,10 @@ CREATE TABLE IF NOT EXISTS animations (
     tool_type ENUM('faceswap', 'fomd', 'makeittalk') DEFAULT 'makeittalk',
     driving_video_path VARCHAR(500),
     animation_path VARCHAR(500) NOT NULL,
+    file_size BIGINT NULL,
     status ENUM('processing', 'completed', 'failed') DEFAULT 'processing',
+    storage_tier ENUM('hot', 'archived') NOT NULL DEFAULT 'hot',
+    last_accessed_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
 );
@@ -43,10 +48,73 @@ CREATE TABLE IF NOT EXISTS subscriptions (
     amount DECIMAL(10, 2) NOT NULL,
     stripe_subscription_id VARCHAR(255) NULL,
     stripe_price_id VARCHAR(255) NULL,
+    stripe_session_id VARCHAR(255) NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    UNIQUE KEY uniq_subscription_stripe_session (stripe_session_id)
+);
+
+-- Resized avatar variants generated for each profile picture
+CREATE TABLE IF NOT EXISTS profile_picture_variants (
+    user_id INT NOT NULL,
+    size INT NOT NULL,
+    variant_path VARCHAR(500) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, size),
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
 );
 
+-- Driving videos registered by admins and referenced by FOMD requests
+-- (video_path is relative to the static folder)
+CREATE TABLE IF NOT EXISTS driving_videos (
+    video_id INT PRIMARY KEY AUTO_INCREMENT,
+    name VARCHAR(255) NOT NULL,
+    video_path VARCHAR(500) NOT NULL,
+    file_size BIGINT NULL,
+    duration_seconds FLOAT NULL,
+    created_by INT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uniq_driving_video_path (video_path),
+    FOREIGN KEY (created_by) REFERENCES users(user_id) ON DELETE SET NULL
+);
+
+-- Files waiting to be removed from disk by the background reaper
+-- (file_path is relative to the static folder, like animations.animation_path)
+CREATE TABLE IF NOT EXISTS file_cleanup_queue (
+    cleanup_id INT PRIMARY KEY AUTO_INCREMENT,
+    file_path VARCHAR(500) NOT NULL,
+    archived BOOLEAN NOT NULL DEFAULT FALSE,
+    attempts INT NOT NULL DEFAULT 0,
+    last_error VARCHAR(500) NULL,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Temporary model inputs under static/uploads, reclaimed by the upload GC once expired
+CREATE TABLE IF NOT EXISTS temp_uploads (
+    temp_upload_id INT PRIMARY KEY AUTO_INCREMENT,
+    file_path VARCHAR(500) NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Server-side sessions (SESSION_BACKEND=db); the cookie only carries session_id
+CREATE TABLE IF NOT EXISTS user_sessions (
+    session_id CHAR(43) PRIMARY KEY,
+    user_id INT NULL,
+    data TEXT NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- Versioned {role, subscription_status} snapshots; the version is bumped on every role or status change
+CREATE TABLE IF NOT EXISTS user_entitlements (
+    user_id INT PRIMARY KEY,
+    version INT NOT NULL DEFAULT 0,
+    role VARCHAR(20) NULL,
+    subscription_status VARCHAR(20) NULL,
+    cached_at TIMESTAMP NULL
+);
+
 -- Insert 2 basic users (password: password123 for all test users)
 INSERT INTO users (fullname, email, password, role, subscription_status) VALUES
 ('John Doe', 'user1@example.com', 'scrypt:32768:8:1$cMpxgI2IvmyyUoI5$195ec3293a475ac13f42ac7e8dffe69f70985f2b4134cb91e535e0748fcc51c081d238ca77987921621c2fa5aa9c382d02eb3b7ca4bef563c540543bd7596be6', 'user', 'inactive'),
@@ -69,9 +137,23 @@ INSERT INTO users (fullname, email, password, role, subscription_status) VALUES
 ('Admin Two', 'admin2@faceanimation.com', 'scrypt:32768:8:1$vVu2kHQeJKrW064K$2d210ca74b1a6d24dfb3b65fe786e5b099c174ed81b69a6bf41b9fbfab3eb3f9e2a5e42f073c4d9a740ca0266d657a1b329e0751b6402d0d77ba9d43ac40a625', 'admin', 'active'),
 ('Admin Three', 'admin3@faceanimation.com', 'scrypt:32768:8:1$mAK3LPa9LMmw6SHh$3c530bdd4a0130f6df306caf62859da85975502f566f397f62bb7b807035d606035f3634376e91549460983047729efa7b874afe57a9240c08826bd8d5398862', 'admin', 'active');
 
+-- Bundled sample driving clips
+INSERT IGNORE INTO driving_videos (name, video_path) VALUES
+('Sample 1', 'videos/sample1.mp4'),
+('Sample 2', 'videos/sample2.mp4');
+
 -- Create indexes for better performance
 CREATE INDEX idx_user_email ON users(email);
+CREATE INDEX idx_user_subscription_expiry ON users(subscription_status, subscription_end_date);
 CREATE INDEX idx_animation_user ON animations(user_id);
 CREATE INDEX idx_animation_status ON animations(status);
 CREATE INDEX idx_animation_tool_type ON animations(tool_type);
+CREATE INDEX idx_animation_path ON animations(animation_path);
+CREATE INDEX idx_animation_retention ON animations(storage_tier, last_accessed_at);
+CREATE INDEX idx_cleanup_next_attempt ON file_cleanup_queue(next_attempt_at);
+CREATE INDEX idx_temp_upload_expires ON temp_uploads(expires_at);
+CREATE INDEX idx_temp_upload_path ON temp_uploads(file_path);
+CREATE INDEX idx_user_profile_picture ON users(profile_picture);
+CREATE INDEX idx_profile_picture_variant_path ON profile_picture_variants(variant_path);
+CREATE INDEX idx_user_session_expires ON user_sessions(expires_at);
 
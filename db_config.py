@@ -1,7 +1,10 @@
+import logging
 import mysql.connector
 from mysql.connector import Error
 import os
 
+logger = logging.getLogger(__name__)
+
 class DatabaseConnection:
     def __init__(self):
         """Initialize database connection"""
@@ -42,10 +45,10 @@ class DatabaseConnection:
             )
             
             if self.connection.is_connected():
-                print("Successfully connected to MySQL database")
+                logger.debug("Successfully connected to MySQL database")
         
         except Error as e:
-            print(f"Error connecting to MySQL: {e}")
+            logger.error("Error connecting to MySQL: %s", e)
             self.connection = None
     
     def get_connection(self):
@@ -64,4 +67,4 @@ class DatabaseConnection:
         """Close the database connection"""
         if self.connection and self.connection.is_connected():
             self.connection.close()
-            print("MySQL connection closed")
\ No newline at end of file
+            logger.debug("MySQL connection closed")
\ No newline at end of file
@@ -0,0 +1,188 @@
+import logging
+import os
+import re
+import threading
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Query instrumentation and tracing for MySQL connections.
+# get_db() wraps every connection so each cursor's execute() is counted and
+# timed globally (db_queries_total / db_query_seconds by statement type).
+# Inside a request the statements are also traced: normalized text,
+# duration and row count, so the request can be checked for slow queries
+# and repeated statements (N+1 patterns) when it finishes.
+
+# Statements slower than this go to the slow-query log
+SLOW_QUERY_SECONDS = float(os.getenv('SLOW_QUERY_SECONDS', '0.2'))
+# A request running the same normalized statement more than this many times is flagged
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '5'))
+
+_request_stats = threading.local()
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s')
+_IN_LIST = re.compile(r'IN\s*\((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_statement(operation):
+    """Statement text with literals and placeholders replaced by ?, for grouping"""
+    if isinstance(operation, bytes):
+        operation = operation.decode('utf-8', errors='replace')
+    text = _STRING_LITERAL.sub('?', operation)
+    text = _PLACEHOLDER.sub('?', text)
+    text = _NUMBER_LITERAL.sub('?', text)
+    text = _IN_LIST.sub('IN (...)', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def reset_request_stats():
+    """Start tracing a new request on this thread"""
+    _request_stats.queries = 0
+    _request_stats.seconds = 0.0
+    _request_stats.trace = []
+
+
+def request_stats():
+    """(query count, seconds spent in queries) for the current request thread"""
+    return getattr(_request_stats, 'queries', 0), getattr(_request_stats, 'seconds', 0.0)
+
+
+def finish_request_trace():
+    """
+    Stop tracing and summarize the request's queries: per normalized statement
+    the count, total seconds and rows, plus the slow entries and the statements
+    over N_PLUS_ONE_THRESHOLD. Returns None if nothing was traced.
+    """
+    trace = getattr(_request_stats, 'trace', None)
+    _request_stats.trace = None
+    if trace is None:
+        return None
+
+    statements = {}
+    for entry in trace:
+        summary = statements.get(entry['statement'])
+        if summary is None:
+            summary = statements[entry['statement']] = {'statement': entry['statement'], 'count': 0, 'seconds': 0.0, 'rows': 0}
+        summary['count'] += 1
+        summary['seconds'] += entry['seconds']
+        summary['rows'] += max(entry['rows'], 0)
+
+    by_time = sorted(statements.values(), key=lambda s: s['seconds'], reverse=True)
+    return {
+        'queries': len(trace),
+        'seconds': sum(entry['seconds'] for entry in trace),
+        'statements': by_time,
+        'slow': [entry for entry in trace if entry['seconds'] >= SLOW_QUERY_SECONDS],
+        'repeated': [s for s in by_time if s['count'] > N_PLUS_ONE_THRESHOLD]
+    }
+
+
+def _statement_type(operation):
+    if isinstance(operation, bytes):
+        operation = operation.decode('utf-8', errors='replace')
+    words = operation.lstrip(' (\n\t').split(None, 1)
+    verb = words[0].upper() if words else ''
+    return verb if verb in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE') else 'OTHER'
+
+
+def _record(operation, elapsed, rowcount):
+    """Count/time one statement; returns its trace entry (None outside a request)"""
+    statement = _statement_type(operation)
+    metrics.inc('db_queries_total', statement=statement)
+    metrics.observe('db_query_seconds', elapsed, statement=statement)
+    _request_stats.queries = getattr(_request_stats, 'queries', 0) + 1
+    _request_stats.seconds = getattr(_request_stats, 'seconds', 0.0) + elapsed
+
+    trace = getattr(_request_stats, 'trace', None)
+    if trace is None:
+        # Background work: no request to attach to, so log slow statements right away
+        if elapsed >= SLOW_QUERY_SECONDS:
+            metrics.inc('db_slow_queries_total', endpoint='background')
+            logger.warning("🐢 Slow query (%.0f ms, background): %s", elapsed * 1000, normalize_statement(operation))
+        return None
+    entry = {'statement': normalize_statement(operation), 'seconds': elapsed, 'rows': rowcount}
+    trace.append(entry)
+    return entry
+
+
+class InstrumentedCursor:
+    """Cursor proxy that records every execute()/executemany() and the rows fetched"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._entry = None
+
+    def _rowcount(self):
+        try:
+            return self._cursor.rowcount
+        except Exception:
+            return -1
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._entry = _record(operation, time.perf_counter() - start, self._rowcount())
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._entry = _record(operation, time.perf_counter() - start, self._rowcount())
+
+    def _count_rows(self, count):
+        # SELECT row counts are only known once the rows are read
+        if self._entry is not None and count:
+            self._entry['rows'] = max(self._entry['rows'], 0) + count
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._count_rows(1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._count_rows(len(rows))
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """Connection proxy whose cursors are instrumented"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._connection.close()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
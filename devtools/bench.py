@@ -0,0 +1,426 @@
+"""
+Load-testing harness: runs scripted scenarios against the app and reports
+p50/p95/p99 latency and requests/sec per scenario.
+
+By default it starts everything itself: a fake FOMD Gradio server, a fake
+Stripe API and the app under gunicorn, pointed at the MySQL database given by
+the usual MYSQL*/DB_* variables (a local MySQL; the schema uses MySQL-only
+SQL, so there is no in-process substitute). --setup-db loads the schema into
+that database first. Bench users are upserted before the run.
+
+    DB_NAME=face_animation_bench python devtools/bench.py --setup-db
+    python devtools/bench.py --scenarios login_storm,gallery --concurrency 32 --duration 20
+    python devtools/bench.py --app-url http://127.0.0.1:5000   # an app you started yourself
+    python devtools/bench.py --compare devtools/bench_results/<earlier run>.json
+
+Scenarios:
+    login_storm     POST /api/login with the bench accounts
+    gallery         dashboard page + /api/user/generated-items for a logged-in subscriber
+    animate_burst   POST /api/fomd/animate (image + driving video) against the fake Gradio server
+    save_uploads    POST /api/fomd/save with a --upload-kb video
+    webhook_flood   signed checkout.session.completed events to /api/stripe/webhook
+
+Results are written to devtools/bench_results/<time>_<commit>.json so runs
+on different commits can be compared with --compare.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'devtools', 'bench_results')
+BENCH_PASSWORD = 'bench-password'
+WEBHOOK_SECRET = 'whsec_bench'
+SCENARIOS = ('login_storm', 'gallery', 'animate_burst', 'save_uploads', 'webhook_flood')
+
+
+# ---------------------------------------------------------------------------
+# Payloads
+# ---------------------------------------------------------------------------
+
+def make_png(size=256):
+    """A real (grey) PNG so upload validation accepts it"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    raw = b''.join(b'\x00' + b'\x80' * size for _ in range(size))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+def make_mp4(size_kb):
+    """ftyp box plus padding: passes content sniffing; the fake backend doesn't decode it"""
+    ftyp = struct.pack('>I', 24) + b'ftypisom' + struct.pack('>I', 512) + b'isommp41'
+    return ftyp + os.urandom(max(size_kb * 1024 - len(ftyp), 0))
+
+
+def stripe_signature(payload, secret=WEBHOOK_SECRET):
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+# ---------------------------------------------------------------------------
+# Services
+# ---------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+class Services:
+    """Fake Gradio + fake Stripe + the app, as subprocesses"""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = []
+        self.app_url = args.app_url
+
+    def _spawn(self, command, env=None):
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                                   stderr=None if self.args.verbose else subprocess.DEVNULL)
+        self.processes.append(process)
+        return process
+
+    def start(self):
+        if self.app_url:
+            return
+        gradio_port, stripe_port, app_port = free_port(), free_port(), free_port()
+        self._spawn([sys.executable, 'devtools/fake_gradio_server.py', '--model', 'fomd', '--port', str(gradio_port),
+                     '--latency', str(self.args.model_latency), '--output-kb', str(self.args.output_kb)])
+        self._spawn([sys.executable, 'devtools/fake_stripe_server.py', '--port', str(stripe_port),
+                     '--latency', str(self.args.stripe_latency)])
+        wait_for(f"http://127.0.0.1:{gradio_port}/stats")
+        wait_for(f"http://127.0.0.1:{stripe_port}/stats")
+
+        env = dict(os.environ)
+        gradio_url = f"http://127.0.0.1:{gradio_port}"
+        env.update({
+            'FOMD_HF_SPACE_URL': gradio_url,
+            'FOMD_HF_SPACE_URLS': gradio_url,
+            'STRIPE_API_BASE': f"http://127.0.0.1:{stripe_port}",
+            'STRIPE_SECRET_KEY': 'sk_test_bench',
+            'STRIPE_WEBHOOK_SECRET': WEBHOOK_SECRET,
+            'LOG_LEVEL': env.get('LOG_LEVEL', 'WARNING'),
+            # Bench accounts save thousands of files; storage quotas are not what is measured
+            'QUOTA_SUBSCRIBER_MAX_ANIMATIONS': '',
+            'QUOTA_SUBSCRIBER_MAX_BYTES': '',
+            # Bench accounts would hit their request limits right away
+            'RATE_LIMIT_ENABLED': '1' if self.args.rate_limits else '0',
+        })
+        self._spawn([sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f"127.0.0.1:{app_port}",
+                     '--workers', str(self.args.workers), '--threads', str(self.args.threads), '--timeout', '300'],
+                    env=env)
+        self.app_url = f"http://127.0.0.1:{app_port}"
+        wait_for(f"{self.app_url}/login", timeout=60)
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+# ---------------------------------------------------------------------------
+# Database
+# ---------------------------------------------------------------------------
+
+def connect_db():
+    sys.path.insert(0, ROOT)
+    from db_config import DatabaseConnection
+    return DatabaseConnection().get_connection()
+
+
+def setup_db():
+    """
+    Load the tables and seed rows of database_schema_railway.sql into the
+    configured database. Safe to re-run: tables and indexes that already
+    exist are kept, and seed rows are only inserted into a fresh database.
+    """
+    from mysql.connector import Error, errorcode
+    db = connect_db()
+    cursor = db.cursor()
+    cursor.execute("SHOW TABLES LIKE 'users'")
+    seeded = cursor.fetchone() is not None
+    with open(os.path.join(ROOT, 'database_schema_railway.sql')) as f:
+        statements = [s.strip() for s in f.read().split(';')]
+    for statement in statements:
+        lines = [line for line in statement.splitlines() if not line.strip().startswith('--')]
+        sql = '\n'.join(lines).strip()
+        # The schema file (re)creates and selects the 'railway' database; stay in the configured one
+        if not sql or sql.upper().startswith(('DROP DATABASE', 'CREATE DATABASE', 'USE ')):
+            continue
+        if seeded and sql.upper().startswith('INSERT'):
+            continue
+        try:
+            cursor.execute(sql)
+        except Error as e:
+            # CREATE INDEX from an earlier setup
+            if e.errno != errorcode.ER_DUP_KEYNAME:
+                raise
+    db.commit()
+    cursor.close()
+    db.close()
+
+
+def seed_users(count):
+    """Upsert active subscriber accounts bench0..bench<count-1>; returns [(user_id, email)]"""
+    from werkzeug.security import generate_password_hash
+    db = connect_db()
+    cursor = db.cursor()
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    users = []
+    for index in range(count):
+        email = f"bench{index}@bench.example"
+        cursor.execute(
+            """INSERT INTO users (fullname, email, password, role, subscription_status)
+               VALUES (%s, %s, %s, 'subscriber', 'active')
+               ON DUPLICATE KEY UPDATE password = VALUES(password), role = 'subscriber', subscription_status = 'active'""",
+            (f"Bench User {index}", email, password_hash)
+        )
+        cursor.execute("SELECT user_id FROM users WHERE email = %s", (email,))
+        users.append((cursor.fetchone()[0], email))
+    db.commit()
+    cursor.close()
+    db.close()
+    return users
+
+
+# ---------------------------------------------------------------------------
+# Scenarios
+# ---------------------------------------------------------------------------
+
+class Context:
+    def __init__(self, args, app_url, users):
+        self.args = args
+        self.app_url = app_url
+        self.users = users
+        self.image = make_png()
+        self.video = make_mp4(args.video_kb)
+        self.upload = make_mp4(args.upload_kb)
+
+
+def login(http, ctx, email):
+    response = http.post(f"{ctx.app_url}/api/login", json={'email': email, 'password': BENCH_PASSWORD}, timeout=60)
+    return response
+
+
+def login_storm(http, ctx, user):
+    http.cookies.clear()
+    return [('POST /api/login', login(http, ctx, user[1]))]
+
+
+def gallery(http, ctx, user):
+    return [
+        ('GET /subscriber', http.get(f"{ctx.app_url}/subscriber", timeout=60, allow_redirects=False)),
+        ('GET /api/user/generated-items', http.get(f"{ctx.app_url}/api/user/generated-items", timeout=60)),
+    ]
+
+
+def animate_burst(http, ctx, user):
+    files = {'image': ('face.png', ctx.image, 'image/png'), 'video': ('drive.mp4', ctx.video, 'video/mp4')}
+    return [('POST /api/fomd/animate', http.post(f"{ctx.app_url}/api/fomd/animate", files=files, timeout=300))]
+
+
+def save_uploads(http, ctx, user):
+    files = {'video': ('result.mp4', ctx.upload, 'video/mp4')}
+    return [('POST /api/fomd/save', http.post(f"{ctx.app_url}/api/fomd/save", files=files, timeout=120))]
+
+
+def webhook_flood(http, ctx, user):
+    event = {
+        'id': f"evt_bench_{uuid.uuid4().hex}", 'object': 'event', 'type': 'checkout.session.completed',
+        'data': {'object': {
+            'id': f"cs_bench_{uuid.uuid4().hex}", 'object': 'checkout.session',
+            'subscription': f"sub_bench_{uuid.uuid4().hex[:16]}",
+            'metadata': {'user_id': str(user[0]), 'plan_type': random.choice(['monthly', 'yearly'])}
+        }}
+    }
+    payload = json.dumps(event)
+    headers = {'Stripe-Signature': stripe_signature(payload), 'Content-Type': 'application/json'}
+    return [('POST /api/stripe/webhook', http.post(f"{ctx.app_url}/api/stripe/webhook", data=payload, headers=headers, timeout=60))]
+
+
+SCENARIO_FUNCTIONS = {
+    'login_storm': login_storm, 'gallery': gallery, 'animate_burst': animate_burst,
+    'save_uploads': save_uploads, 'webhook_flood': webhook_flood,
+}
+# Scenarios whose workers log in once before the timed loop
+NEEDS_LOGIN = {'gallery', 'animate_burst', 'save_uploads'}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for latency, ok in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+    }
+
+
+def run_scenario(name, ctx):
+    """Run one scenario with --concurrency workers for --duration seconds"""
+    function = SCENARIO_FUNCTIONS[name]
+    samples = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + ctx.args.duration
+
+    def worker(index):
+        user = ctx.users[index % len(ctx.users)]
+        http = requests.Session()
+        if name in NEEDS_LOGIN:
+            login(http, ctx, user[1]).raise_for_status()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                results = function(http, ctx, user)
+            except requests.RequestException:
+                results = [(f"{name} (connection error)", None)]
+            elapsed = time.perf_counter() - start
+            with lock:
+                # Multi-request iterations split their time evenly between the requests
+                for label, response in results:
+                    ok = response is not None and response.status_code < 400
+                    samples.setdefault(label, []).append((elapsed / len(results), ok))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=ctx.args.concurrency) as executor:
+        list(executor.map(worker, range(ctx.args.concurrency)))
+    elapsed = time.perf_counter() - start
+    return {label: summarize(values, elapsed) for label, values in samples.items()}
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_table(results, baseline=None):
+    header = f"{'scenario':<15} {'request':<34} {'reqs':>7} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for scenario, requests_by_label in results.items():
+        for label, stats in requests_by_label.items():
+            row = (f"{scenario:<15} {label:<34} {stats['requests']:>7} {stats['errors']:>5} {stats['rps'] or 0:>8.1f} "
+                   f"{stats['p50_ms'] or 0:>9.1f} {stats['p95_ms'] or 0:>9.1f} {stats['p99_ms'] or 0:>9.1f}")
+            previous = (baseline or {}).get(scenario, {}).get(label)
+            if previous:
+                deltas = []
+                for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                    if previous.get(key) and stats.get(key) is not None:
+                        deltas.append(f"{key} {100 * (stats[key] - previous[key]) / previous[key]:+.0f}%")
+                row += '   vs baseline: ' + ', '.join(deltas)
+            print(row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated scenario names')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients per scenario')
+    parser.add_argument('--duration', type=float, default=15, help='seconds per scenario')
+    parser.add_argument('--users', type=int, default=50, help='bench accounts to seed')
+    parser.add_argument('--app-url', help='benchmark an already running app instead of starting one')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers for the started app')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--model-latency', type=float, default=0.5, help='fake Gradio seconds per prediction')
+    parser.add_argument('--output-kb', type=int, default=256, help='fake Gradio result size')
+    parser.add_argument('--stripe-latency', type=float, default=0.05, help='fake Stripe seconds per call')
+    parser.add_argument('--video-kb', type=int, default=512, help='driving video size for animate_burst')
+    parser.add_argument('--upload-kb', type=int, default=1024, help='video size for save_uploads')
+    parser.add_argument('--rate-limits', action='store_true', help='keep rate limiting on in the started app')
+    parser.add_argument('--setup-db', action='store_true', help='load the schema into the configured database first')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--no-save', action='store_true', help="don't write a results file")
+    parser.add_argument('--verbose', action='store_true', help='show output of the started services')
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    if not args.app_url and not shutil.which('gunicorn') and subprocess.call(
+            [sys.executable, '-c', 'import gunicorn'], stderr=subprocess.DEVNULL) != 0:
+        parser.error('gunicorn is not installed; install it or pass --app-url')
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    if args.setup_db:
+        setup_db()
+    users = seed_users(args.users)
+
+    services = Services(args)
+    try:
+        services.start()
+        ctx = Context(args, services.app_url, users)
+        results = {}
+        for name in scenarios:
+            print(f"Running {name} ({args.concurrency} clients, {args.duration:g}s)...", flush=True)
+            results[name] = run_scenario(name, ctx)
+    finally:
+        services.stop()
+
+    print()
+    print_table(results, baseline)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        commit = git_commit()
+        path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}_{commit}.json")
+        config = {key: value for key, value in vars(args).items() if key not in ('compare', 'verbose', 'no_save')}
+        with open(path, 'w') as f:
+            json.dump({'commit': commit, 'created_at': time.time(), 'config': config, 'results': results}, f, indent=2)
+        print(f"\nResults saved to {os.path.relpath(path, ROOT)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Per-endpoint query and memory budgets.
+
+Calls each budgeted endpoint once through the Flask test client, as a seeded
+subscriber, and checks the number of DB queries it ran (counted by
+db_metrics) and its peak Python allocation (tracemalloc). Exits non-zero if
+any budget is exceeded, so a regression in round trips or buffering fails CI
+instead of slipping in.
+
+Needs the same MySQL database as devtools/bench.py (MYSQL*/DB_* variables):
+
+    python devtools/check_budgets.py
+    python devtools/check_budgets.py --only fomd_save --verbose
+
+Entitlement and other in-process caches are cleared before every call, so
+the counts are for a cold request. Add a budget to BUDGETS when an endpoint's
+cost has been brought down and should stay there.
+"""
+import argparse
+import io
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench import make_mp4, make_png, seed_users  # noqa: E402
+
+# max_queries: DB statements per request.
+# max_peak_upload_ratio: peak traced allocation as a multiple of the upload size.
+# max_peak_bytes: absolute peak traced allocation.
+BUDGETS = [
+    {'name': 'generated_items', 'method': 'GET', 'path': '/api/user/generated-items', 'max_queries': 2},
+    {'name': 'subscriber_dashboard', 'method': 'GET', 'path': '/subscriber', 'max_queries': 2},
+    {'name': 'profile', 'method': 'GET', 'path': '/api/profile', 'max_queries': 2},
+    {'name': 'driving_videos', 'method': 'GET', 'path': '/api/driving-videos', 'max_queries': 1},
+    {'name': 'fomd_save', 'method': 'POST', 'path': '/api/fomd/save', 'upload': ('video', 'result.mp4', 4096),
+     'max_queries': 4, 'max_peak_upload_ratio': 2.0},
+    {'name': 'faceswap_save', 'method': 'POST', 'path': '/api/faceswap/save', 'upload': ('image', 'result.png', None),
+     'max_queries': 4, 'max_peak_bytes': 4 * 1024 * 1024},
+]
+
+
+def build_environ(app, budget):
+    """WSGI environ for the call, built up front so the request body isn't part of the traced peak"""
+    from flask.testing import EnvironBuilder
+    data = None
+    upload_size = 0
+    if 'upload' in budget:
+        field, filename, size_kb = budget['upload']
+        content = make_mp4(size_kb) if filename.endswith('.mp4') else make_png(1024)
+        upload_size = len(content)
+        data = {field: (io.BytesIO(content), filename)}
+    builder = EnvironBuilder(app, path=budget['path'], method=budget['method'], data=data)
+    try:
+        return builder.get_environ(), upload_size
+    finally:
+        builder.close()
+
+
+def measure(app_module, client, budget):
+    """(status, queries, peak_bytes, upload_size) for one call of the budgeted endpoint"""
+    import db_metrics
+    app_module.entitlement_cache.clear()
+    environ, upload_size = build_environ(app_module.app, budget)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        response = client.open(environ)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    queries, _ = db_metrics.request_stats()
+
+    # Don't leave budget runs in the bench account's gallery
+    animation_id = (response.get_json(silent=True) or {}).get('animation_id')
+    if animation_id:
+        client.delete(f"/api/animation/delete/{animation_id}")
+    return response.status_code, queries, peak, upload_size
+
+
+def check(budget, status, queries, peak, upload_size):
+    failures = []
+    if status >= 400:
+        failures.append(f"status {status}")
+    if budget.get('max_queries') is not None and queries > budget['max_queries']:
+        failures.append(f"{queries} queries > {budget['max_queries']}")
+    if budget.get('max_peak_bytes') is not None and peak > budget['max_peak_bytes']:
+        failures.append(f"peak {peak} B > {budget['max_peak_bytes']} B")
+    ratio = budget.get('max_peak_upload_ratio')
+    if ratio is not None and upload_size and peak > ratio * upload_size:
+        failures.append(f"peak {peak / upload_size:.2f}x upload > {ratio}x")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', help='comma-separated budget names to check')
+    parser.add_argument('--verbose', action='store_true', help='show app logs')
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        os.environ.setdefault('LOG_LEVEL', 'ERROR')
+    os.environ.setdefault('QUOTA_SUBSCRIBER_MAX_ANIMATIONS', '')
+    os.environ.setdefault('QUOTA_SUBSCRIBER_MAX_BYTES', '')
+    import app as app_module
+
+    budgets = BUDGETS
+    if args.only:
+        names = {name.strip() for name in args.only.split(',')}
+        budgets = [budget for budget in BUDGETS if budget['name'] in names]
+
+    user_id, email = seed_users(1)[0]
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=user_id, email=email, role='subscriber', fullname='Bench User 0')
+
+    failed = 0
+    print(f"{'budget':<22} {'status':>6} {'queries':>8} {'peak KB':>9} {'upload KB':>10}  result")
+    for budget in budgets:
+        status, queries, peak, upload_size = measure(app_module, client, budget)
+        failures = check(budget, status, queries, peak, upload_size)
+        failed += bool(failures)
+        result = 'FAIL: ' + '; '.join(failures) if failures else 'ok'
+        print(f"{budget['name']:<22} {status:>6} {queries:>8} {peak / 1024:>9.0f} {upload_size / 1024:>10.0f}  {result}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
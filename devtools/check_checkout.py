@@ -0,0 +1,118 @@
+"""
+Regression check for the payment success flow (verify-session).
+
+Runs the sequence a paying user goes through when the webhook hasn't
+arrived yet: GET /api/stripe/verify-session/<id> finds nothing applied in
+our DB, Stripe (devtools/fake_stripe_server.py) reports the session paid, and
+the subscription is activated on the same connection. Then checks the user
+became an active subscriber with one subscriptions row, and that a second
+call is answered from the DB without applying the payment twice. Exits
+non-zero on failure.
+
+Needs the same MySQL database as devtools/bench.py (MYSQL*/DB_* variables):
+
+    python devtools/check_checkout.py
+"""
+import argparse
+import os
+import subprocess
+import sys
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench import connect_db, free_port, wait_for  # noqa: E402
+
+
+def create_free_user():
+    """A fresh free account; returns (user_id, email)"""
+    email = f"checkout-{uuid.uuid4().hex[:12]}@bench.example"
+    db = connect_db()
+    cursor = db.cursor()
+    cursor.execute(
+        """INSERT INTO users (fullname, email, password, role, subscription_status)
+           VALUES ('Checkout Check', %s, '-', 'user', 'inactive')""",
+        (email,)
+    )
+    user_id = cursor.lastrowid
+    db.commit()
+    cursor.close()
+    db.close()
+    return user_id, email
+
+
+def user_state(user_id, stripe_session_id):
+    db = connect_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT role, subscription_status FROM users WHERE user_id = %s", (user_id,))
+    role, status = cursor.fetchone()
+    cursor.execute("SELECT COUNT(*) FROM subscriptions WHERE stripe_session_id = %s", (stripe_session_id,))
+    applied = cursor.fetchone()[0]
+    cursor.close()
+    db.close()
+    return role, status, applied
+
+
+def delete_user(user_id):
+    db = connect_db()
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
+    db.commit()
+    cursor.close()
+    db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--verbose', action='store_true', help='show app logs')
+    args = parser.parse_args(argv)
+
+    port = free_port()
+    stripe_server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'devtools', 'fake_stripe_server.py'), '--port', str(port), '--latency', '0'],
+        stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        wait_for(f"http://127.0.0.1:{port}/stats")
+        os.environ.update(STRIPE_API_BASE=f"http://127.0.0.1:{port}", STRIPE_SECRET_KEY='sk_test_check')
+        if not args.verbose:
+            os.environ.setdefault('LOG_LEVEL', 'ERROR')
+        import stripe
+        import app as app_module
+
+        user_id, email = create_free_user()
+        try:
+            checkout_session = stripe.checkout.Session.create(
+                mode='subscription', metadata={'user_id': str(user_id), 'plan_type': 'monthly'},
+                success_url='http://localhost/payment-success', cancel_url='http://localhost/')
+            client = app_module.app.test_client()
+            with client.session_transaction() as session:
+                session.update(user_id=user_id, email=email, role='user', fullname='Checkout Check')
+
+            failures = []
+            for attempt in ('first', 'repeat'):
+                response = client.get(f"/api/stripe/verify-session/{checkout_session.id}")
+                body = response.get_json(silent=True) or {}
+                if response.status_code != 200 or not body.get('success') or body.get('role') != 'subscriber':
+                    failures.append(f"{attempt} call: status {response.status_code}, {body}")
+            role, status, applied = user_state(user_id, checkout_session.id)
+            if (role, status) != ('subscriber', 'active'):
+                failures.append(f"user is {role}/{status}, expected subscriber/active")
+            if applied != 1:
+                failures.append(f"{applied} subscriptions rows for the session, expected 1")
+        finally:
+            delete_user(user_id)
+    finally:
+        stripe_server.terminate()
+        stripe_server.wait()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("ok: verify-session activated the subscription once")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Local stand-in for the FOMD / MakeItTalk / face swap Gradio spaces, for offline testing.
+
+Implements the parts of the Gradio HTTP API the app uses: POST /upload,
+POST /api/<name> (JSON file references, or the multipart data[0]/data[1]
+form the single-clip FOMD path sends) and GET /file=<path>. Predictions take
+--latency seconds (plus --latency-per-mb for every MB of input) and fail at
+--fail-rate, so pooling, chunking and retries can be exercised without a GPU.
+--output-kb makes every result that size instead of a copy of the input.
+
+    python devtools/fake_gradio_server.py --model fomd --port 7861
+    FOMD_HF_SPACE_URLS=http://127.0.0.1:7861,http://127.0.0.1:7862 gunicorn app:app
+
+FOMD returns the driving video as the animation and face swap returns the
+target image. MakeItTalk returns a still video of the image over the audio
+when ffmpeg is installed, otherwise a placeholder file.
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from flask import Flask, request, jsonify, send_file
+
+app = Flask(__name__)
+FILES_DIR = tempfile.mkdtemp(prefix='fake_gradio_')
+config = {'model': 'fomd', 'latency': 0.5, 'latency_per_mb': 0.0, 'fail_rate': 0.0, 'output_kb': 0}
+counters = {'uploads': 0, 'upload_bytes': 0, 'predictions': 0, 'failures': 0}
+
+
+def _store(source_name, data=None, source_path=None):
+    path = os.path.join(FILES_DIR, f"{uuid.uuid4().hex}_{os.path.basename(source_name)}")
+    if source_path:
+        shutil.copyfile(source_path, path)
+    else:
+        with open(path, 'wb') as f:
+            f.write(data)
+    return path
+
+
+def _input_path(value):
+    """Server-side path from a Gradio 3/4 file reference"""
+    if isinstance(value, dict):
+        value = value.get('path') or value.get('name')
+    if not isinstance(value, str) or not value.startswith(FILES_DIR):
+        return None
+    return value if os.path.exists(value) else None
+
+
+@app.route('/upload', methods=['POST'])
+def upload():
+    paths = []
+    for file_storage in request.files.getlist('files'):
+        data = file_storage.read()
+        counters['uploads'] += 1
+        counters['upload_bytes'] += len(data)
+        paths.append(_store(file_storage.filename, data=data))
+    return jsonify(paths)
+
+
+def _store_result(name, source_path):
+    if config['output_kb']:
+        return _store(name, data=os.urandom(config['output_kb'] * 1024))
+    return _store(name, source_path=source_path)
+
+
+@app.route('/api/<name>', methods=['POST'])
+def predict(name):
+    legacy = bool(request.files)
+    if legacy:
+        # Files posted directly as data[0], data[1]; the result is a URL string
+        inputs = [_store(f.filename, data=f.read()) for _, f in sorted(request.files.items())]
+    else:
+        inputs = [_input_path(value) for value in (request.get_json(silent=True) or {}).get('data', [])]
+    if len(inputs) < 2 or not all(inputs):
+        return jsonify({'error': 'Expected two uploaded files'}), 400
+
+    input_mb = sum(os.path.getsize(path) for path in inputs) / (1024 * 1024)
+    time.sleep(config['latency'] + config['latency_per_mb'] * input_mb)
+    counters['predictions'] += 1
+    if random.random() < config['fail_rate']:
+        counters['failures'] += 1
+        return jsonify({'error': 'Simulated backend failure'}), 500
+
+    image_path, media_path = inputs[0], inputs[1]
+    if config['model'] == 'faceswap':
+        output = _store_result('result.png', media_path)
+        file_data = {'path': output, 'url': f"{request.host_url.rstrip('/')}/file={output}"}
+        return jsonify({'data': [file_data, 'Face swap complete']})
+    if config['model'] == 'fomd':
+        output = _store_result('result.mp4', media_path)
+        if legacy:
+            return jsonify({'data': [f"{request.host_url.rstrip('/')}/file={output}"]})
+    else:
+        output = os.path.join(FILES_DIR, f"{uuid.uuid4().hex}_result.mp4")
+        ffmpeg = shutil.which('ffmpeg')
+        result = None
+        if ffmpeg:
+            result = subprocess.run(
+                [ffmpeg, '-y', '-loglevel', 'error', '-loop', '1', '-i', image_path, '-i', media_path,
+                 '-vf', 'scale=256:256', '-c:v', 'libx264', '-tune', 'stillimage', '-pix_fmt', 'yuv420p',
+                 '-c:a', 'aac', '-shortest', output],
+                capture_output=True
+            )
+        if not result or result.returncode != 0:
+            with open(output, 'wb') as f:
+                f.write(b'fake makeittalk video')
+    return jsonify({'data': [{'video': {'path': output, 'url': f"{request.host_url.rstrip('/')}/file={output}"}}]})
+
+
+@app.route('/<path:subpath>', methods=['GET'])
+def serve_file(subpath):
+    # Gradio serves outputs as /file=<absolute path>
+    if not subpath.startswith('file='):
+        return jsonify({'error': 'Not found'}), 404
+    path = '/' + subpath[len('file='):].lstrip('/')
+    if not path.startswith(FILES_DIR) or not os.path.exists(path):
+        return jsonify({'error': 'Not found'}), 404
+    return send_file(path)
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(counters)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=['fomd', 'makeittalk', 'faceswap'], default='fomd')
+    parser.add_argument('--port', type=int, default=7861)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds per prediction')
+    parser.add_argument('--latency-per-mb', type=float, default=0.0, help='extra seconds per MB of input')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of predictions that fail')
+    parser.add_argument('--output-kb', type=int, default=0, help='size of every result (default: copy of the input)')
+    args = parser.parse_args(argv)
+
+    config.update(model=args.model, latency=args.latency, latency_per_mb=args.latency_per_mb,
+                  fail_rate=args.fail_rate, output_kb=args.output_kb)
+    print(f"Fake {args.model} Gradio server on http://127.0.0.1:{args.port} (files in {FILES_DIR})")
+    try:
+        app.run(host='127.0.0.1', port=args.port, threaded=True)
+    finally:
+        shutil.rmtree(FILES_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
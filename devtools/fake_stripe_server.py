@@ -0,0 +1,119 @@
+"""
+Local stand-in for the parts of the Stripe API the app calls, for offline testing.
+
+Implements customers, checkout sessions (create/retrieve) and subscription
+updates. Every call takes --latency seconds. Checkout sessions report as
+paid once retrieved, so the payment-success flow completes. Point the app
+at it with STRIPE_API_BASE:
+
+    python devtools/fake_stripe_server.py --port 12111
+    STRIPE_API_BASE=http://127.0.0.1:12111 STRIPE_SECRET_KEY=sk_test_fake gunicorn app:app
+"""
+import argparse
+import re
+import sys
+import threading
+import time
+import uuid
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+config = {'latency': 0.05}
+objects = {}
+counters = {'requests': 0}
+_lock = threading.Lock()
+
+
+def _new_id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def _form_params():
+    """Stripe's form encoding (metadata[user_id]=1, line_items[0][price]=...) as nested dicts"""
+    params = {}
+    for key, value in request.form.items(multi=True):
+        parts = re.findall(r'[^\[\]]+', key)
+        target = params
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return params
+
+
+@app.before_request
+def simulate_latency():
+    if request.path == '/stats':
+        return
+    with _lock:
+        counters['requests'] += 1
+    time.sleep(config['latency'])
+
+
+@app.route('/v1/customers', methods=['POST'])
+def create_customer():
+    params = _form_params()
+    customer = {'id': _new_id('cus'), 'object': 'customer', 'email': params.get('email'),
+                'name': params.get('name'), 'metadata': params.get('metadata', {})}
+    objects[customer['id']] = customer
+    return jsonify(customer)
+
+
+@app.route('/v1/checkout/sessions', methods=['POST'])
+def create_checkout_session():
+    params = _form_params()
+    session_id = _new_id('cs_test')
+    checkout_session = {
+        'id': session_id, 'object': 'checkout.session', 'mode': params.get('mode', 'subscription'),
+        'customer': params.get('customer'), 'metadata': params.get('metadata', {}),
+        'payment_status': 'unpaid', 'status': 'open', 'subscription': None,
+        'url': f"{request.host_url.rstrip('/')}/pay/{session_id}",
+        'success_url': params.get('success_url'), 'cancel_url': params.get('cancel_url')
+    }
+    objects[session_id] = checkout_session
+    return jsonify(checkout_session)
+
+
+@app.route('/v1/checkout/sessions/<session_id>', methods=['GET'])
+def retrieve_checkout_session(session_id):
+    checkout_session = objects.get(session_id)
+    if checkout_session is None:
+        return jsonify({'error': {'type': 'invalid_request_error', 'message': f'No such checkout.session: {session_id}'}}), 404
+    if checkout_session['payment_status'] != 'paid':
+        # Completed as soon as the app looks at it
+        subscription = {'id': _new_id('sub'), 'object': 'subscription', 'status': 'active',
+                        'customer': checkout_session['customer'], 'cancel_at_period_end': False,
+                        'current_period_end': int(time.time()) + 30 * 24 * 3600}
+        objects[subscription['id']] = subscription
+        checkout_session.update(payment_status='paid', status='complete', subscription=subscription['id'])
+    return jsonify(checkout_session)
+
+
+@app.route('/v1/subscriptions/<subscription_id>', methods=['GET', 'POST'])
+def subscription(subscription_id):
+    subscription = objects.get(subscription_id)
+    if subscription is None:
+        subscription = objects[subscription_id] = {'id': subscription_id, 'object': 'subscription', 'status': 'active',
+                                                   'cancel_at_period_end': False}
+    if request.method == 'POST' and 'cancel_at_period_end' in request.form:
+        subscription['cancel_at_period_end'] = request.form['cancel_at_period_end'] == 'true'
+    return jsonify(subscription)
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(counters)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per API call')
+    args = parser.parse_args(argv)
+
+    config.update(latency=args.latency)
+    print(f"Fake Stripe API on http://127.0.0.1:{args.port}")
+    app.run(host='127.0.0.1', port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
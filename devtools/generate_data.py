@@ -0,0 +1,248 @@
+"""
+Bulk synthetic data for scale testing: users, subscriptions and animations
+with production-like distributions, loaded with batched multi-row INSERTs.
+
+    python devtools/generate_data.py --users 1000000 --avg-animations 12
+    python devtools/generate_data.py --users 20000 --placeholder-media
+
+Distributions:
+  - roles: --subscriber-ratio subscribers (active, monthly/yearly plans, 1-4
+    completed subscription records each), --suspended-ratio suspended
+    users, the rest free users
+  - animations per user: Pareto (heavy tail, most users have a handful,
+    a few have thousands), mean about --avg-animations, capped at --max-per-user
+  - tool_type: free users only save face swaps; subscribers mix
+    faceswap/fomd/makeittalk 50/30/20
+  - file sizes: log-normal per tool type; created_at spread over --days
+  - users.animation_count/storage_bytes match the generated rows
+
+Every account gets the same precomputed password hash (password123), so
+generation isn't bound by scrypt. IDs are assigned explicitly, starting after
+the current maximum, so the script can add to an existing database. Accounts
+are named <prefix><n>@synthetic.example.
+
+--placeholder-media creates the animation files under static/ as hard links
+to one small placeholder per tool type (copies where links aren't supported).
+Uses the MYSQL*/DB_* variables, like the app.
+"""
+import argparse
+import math
+import os
+import random
+import shutil
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import storage  # noqa: E402
+from db_config import DatabaseConnection  # noqa: E402
+
+PASSWORD = 'password123'
+TOOL_MIX = (('faceswap', 0.5), ('fomd', 0.3), ('makeittalk', 0.2))
+EXTENSIONS = {'faceswap': 'png', 'fomd': 'mp4', 'makeittalk': 'mp4'}
+# Median file size (bytes) and log-normal sigma per tool type
+FILE_SIZES = {'faceswap': (350 * 1024, 0.5), 'fomd': (2 * 1024 * 1024, 0.6), 'makeittalk': (3 * 1024 * 1024, 0.7)}
+PLAN_AMOUNTS = {'monthly': 9.99, 'yearly': 99.99}
+PARETO_ALPHA = 1.3
+FIRST_NAMES = ('Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn')
+LAST_NAMES = ('Smith', 'Garcia', 'Chen', 'Okafor', 'Novak', 'Silva', 'Khan', 'Müller', 'Rossi', 'Tanaka')
+
+
+def animation_count(rng, mean, cap):
+    # Pareto(alpha) has mean alpha/(alpha-1); shift to start at 0 and scale to the requested mean
+    scale = mean / (PARETO_ALPHA / (PARETO_ALPHA - 1) - 1)
+    return min(round((rng.paretovariate(PARETO_ALPHA) - 1) * scale), cap)
+
+
+def pick_tool(rng, role):
+    if role == 'user':
+        return 'faceswap'
+    roll = rng.random()
+    for tool, share in TOOL_MIX:
+        if roll < share:
+            return tool
+        roll -= share
+    return TOOL_MIX[-1][0]
+
+
+def file_size(rng, tool):
+    median, sigma = FILE_SIZES[tool]
+    return int(rng.lognormvariate(math.log(median), sigma))
+
+
+class Loader:
+    """Buffers rows per table and writes them with executemany (one multi-row INSERT per batch)"""
+
+    STATEMENTS = {
+        'users': """INSERT INTO users (user_id, fullname, email, password, role, subscription_status,
+                                       subscription_plan, subscription_end_date, animation_count, storage_bytes, created_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+        'subscriptions': """INSERT INTO subscriptions (user_id, plan_type, start_date, end_date, payment_status, amount, created_at)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+        'animations': """INSERT INTO animations (user_id, tool_type, animation_path, file_size, status, last_accessed_at, created_at)
+                         VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+    }
+
+    def __init__(self, db, batch_size):
+        self.db = db
+        self.cursor = db.cursor()
+        self.batch_size = batch_size
+        self.rows = {table: [] for table in self.STATEMENTS}
+        self.counts = {table: 0 for table in self.STATEMENTS}
+
+    def add(self, table, row):
+        rows = self.rows[table]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table=None):
+        # Users go first: a user's row is added before its child rows, so flushing the
+        # buffered users before any child batch never leaves a child without its user
+        for name in ([table] if table else list(self.STATEMENTS)):
+            if name != 'users' and self.rows['users']:
+                self.flush('users')
+            if self.rows[name]:
+                self.cursor.executemany(self.STATEMENTS[name], self.rows[name])
+                self.counts[name] += len(self.rows[name])
+                self.rows[name] = []
+        self.db.commit()
+
+
+class PlaceholderMedia:
+    """Creates animation files as hard links to one placeholder per tool type"""
+
+    def __init__(self, static_root):
+        self.static_root = static_root
+        self.sources = {}
+        self.link = hasattr(os, 'link')
+        placeholder_dir = os.path.join(static_root, 'animations', '.synthetic')
+        os.makedirs(placeholder_dir, exist_ok=True)
+        for tool, extension in EXTENSIONS.items():
+            path = os.path.join(placeholder_dir, f"placeholder_{tool}.{extension}")
+            if not os.path.exists(path):
+                with open(path, 'wb') as f:
+                    f.write(b'synthetic ' + tool.encode() + b' placeholder\n')
+            self.sources[tool] = path
+
+    def create(self, tool, relative_path):
+        full_path = storage.prepare_path(self.static_root, relative_path)
+        if self.link:
+            try:
+                os.link(self.sources[tool], full_path)
+                return
+            except OSError:
+                self.link = False
+        shutil.copyfile(self.sources[tool], full_path)
+
+
+def generate(args):
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(args.seed)
+    password_hash = generate_password_hash(PASSWORD)
+    now = datetime.now().replace(microsecond=0)
+    today = now.date()
+    media = PlaceholderMedia(os.path.join(ROOT, 'static')) if args.placeholder_media else None
+
+    db = DatabaseConnection().get_connection()
+    cursor = db.cursor()
+    cursor.execute("SELECT COALESCE(MAX(user_id), 0) FROM users")
+    next_user_id = cursor.fetchone()[0] + 1
+    if not args.checks:
+        # Every generated row is consistent by construction; skip per-row checks for speed
+        cursor.execute("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+    cursor.close()
+
+    loader = Loader(db, args.batch_size)
+    started = time.perf_counter()
+    try:
+        for index in range(args.users):
+            user_id = next_user_id + index
+            roll = rng.random()
+            if roll < args.subscriber_ratio:
+                role, status = 'subscriber', 'active'
+            elif roll < args.subscriber_ratio + args.suspended_ratio:
+                role, status = 'user', 'suspended'
+            else:
+                role, status = 'user', 'inactive'
+            signed_up = now - timedelta(seconds=rng.randrange(args.days * 86400))
+
+            # Child rows are drawn first (the user's counters depend on them) but added after the user
+            subscriptions, animations = [], []
+            plan, plan_end = None, None
+            if role == 'subscriber':
+                plan = 'yearly' if rng.random() < 0.3 else 'monthly'
+                period = timedelta(days=365 if plan == 'yearly' else 30)
+                renewals = rng.randint(1, 4)
+                start = max(signed_up.date(), today - period * renewals)
+                for _ in range(renewals):
+                    subscriptions.append((user_id, plan, start, start + period, 'completed',
+                                          PLAN_AMOUNTS[plan], datetime.combine(start, signed_up.time())))
+                    start += period
+                plan_end = start
+
+            count = animation_count(rng, args.avg_animations, args.max_per_user)
+            total_bytes = 0
+            age_seconds = max(int((now - signed_up).total_seconds()), 1)
+            for _ in range(count):
+                tool = pick_tool(rng, role)
+                size = file_size(rng, tool)
+                total_bytes += size
+                created = signed_up + timedelta(seconds=rng.randrange(age_seconds))
+                accessed = created + timedelta(seconds=rng.randrange(max(int((now - created).total_seconds()), 1)))
+                relative_path = storage.animation_relpath(tool, f"{tool}_syn{user_id}_{rng.getrandbits(64):016x}.{EXTENSIONS[tool]}")
+                animations.append((user_id, tool, relative_path, size, 'completed', accessed, created))
+                if media:
+                    media.create(tool, relative_path)
+
+            fullname = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            loader.add('users', (user_id, fullname, f"{args.email_prefix}{user_id}@synthetic.example", password_hash,
+                                 role, status, plan, plan_end, count, total_bytes, signed_up))
+            for row in subscriptions:
+                loader.add('subscriptions', row)
+            for row in animations:
+                loader.add('animations', row)
+
+            if (index + 1) % 10000 == 0:
+                elapsed = time.perf_counter() - started
+                print(f"  {index + 1}/{args.users} users ({(index + 1) / elapsed:.0f}/s)", flush=True)
+        loader.flush()
+    finally:
+        if not args.checks:
+            cursor = db.cursor()
+            cursor.execute("SET SESSION unique_checks = 1, foreign_key_checks = 1")
+            cursor.close()
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Inserted {loader.counts['users']} users, {loader.counts['subscriptions']} subscriptions and "
+          f"{loader.counts['animations']} animations in {elapsed:.1f}s (password for every account: {PASSWORD})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--avg-animations', type=float, default=10, help='mean saved animations per user')
+    parser.add_argument('--max-per-user', type=int, default=5000, help='cap on animations for one user')
+    parser.add_argument('--subscriber-ratio', type=float, default=0.18)
+    parser.add_argument('--suspended-ratio', type=float, default=0.01)
+    parser.add_argument('--days', type=int, default=730, help='spread sign-ups and saves over this many days')
+    parser.add_argument('--batch-size', type=int, default=5000, help='rows per multi-row INSERT')
+    parser.add_argument('--email-prefix', default='syn', help='accounts are <prefix><user_id>@synthetic.example')
+    parser.add_argument('--placeholder-media', action='store_true', help='create the animation files under static/')
+    parser.add_argument('--checks', action='store_true', help='keep unique/foreign key checks on during the load')
+    parser.add_argument('--seed', type=int, default=None, help='random seed, for repeatable data')
+    args = parser.parse_args(argv)
+
+    if args.subscriber_ratio + args.suspended_ratio > 1:
+        parser.error('--subscriber-ratio plus --suspended-ratio must not exceed 1')
+    generate(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
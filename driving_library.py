@@ -0,0 +1,201 @@
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+import metrics
+import storage
+from file_cleanup import enqueue_files
+from media_validation import mp4_duration
+
+logger = logging.getLogger(__name__)
+
+# Library of driving videos registered once by an admin and referenced by id.
+# Each clip is pre-processed to the model's input size when ffmpeg is
+# available, and its remote file handle on every backend replica is cached so
+# animate requests only upload the source image.
+
+# FOMD works on 256x256 frames; 0 keeps the clip as uploaded
+PREPROCESS_SIZE = int(os.getenv('DRIVING_VIDEO_SIZE', '256'))
+# How long a backend keeps an uploaded file before we assume it has been cleaned up
+REMOTE_REF_TTL = int(os.getenv('DRIVING_VIDEO_REF_TTL', str(6 * 3600)))
+
+FFMPEG = shutil.which('ffmpeg')
+if not FFMPEG:
+    logger.warning("ffmpeg is not installed. Driving videos will be stored without pre-processing.")
+
+
+def preprocess_video(source_path, destination):
+    """
+    Scale/crop a driving clip to PREPROCESS_SIZE square, drop audio and put
+    the moov box first. Falls back to copying the clip as-is.
+    """
+    if FFMPEG and PREPROCESS_SIZE:
+        size = PREPROCESS_SIZE
+        command = [
+            FFMPEG, '-y', '-loglevel', 'error', '-i', source_path,
+            '-vf', f'scale={size}:{size}:force_original_aspect_ratio=increase,crop={size}:{size}',
+            '-an', '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '20',
+            '-pix_fmt', 'yuv420p', '-movflags', '+faststart', destination
+        ]
+        result = subprocess.run(command, capture_output=True, timeout=300)
+        if result.returncode == 0:
+            return True
+        logger.warning("Driving video pre-processing failed, storing original: %s", result.stderr.decode(errors='replace')[:300])
+    shutil.copyfile(source_path, destination)
+    return False
+
+
+def register_video(db, static_root, source_path, name, created_by=None):
+    """Pre-process a validated clip into the library and insert its row; returns the row"""
+    relative_path = storage.sharded_relpath('videos/library', f"driving_{uuid.uuid4()}.mp4")
+    full_path = storage.prepare_path(static_root, relative_path)
+    preprocessed = preprocess_video(source_path, full_path)
+
+    cursor = db.cursor()
+    try:
+        file_size = os.path.getsize(full_path)
+        duration = mp4_duration(full_path)
+        cursor.execute(
+            """INSERT INTO driving_videos (name, video_path, file_size, duration_seconds, created_by)
+               VALUES (%s, %s, %s, %s, %s)""",
+            (name, relative_path, file_size, duration, created_by)
+        )
+        db.commit()
+        return {
+            'video_id': cursor.lastrowid,
+            'name': name,
+            'video_path': relative_path,
+            'file_size': file_size,
+            'duration_seconds': duration,
+            'preprocessed': preprocessed
+        }
+    except Exception:
+        db.rollback()
+        os.remove(full_path)
+        raise
+    finally:
+        cursor.close()
+
+
+def list_videos(db):
+    cursor = db.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            """SELECT video_id, name, video_path, file_size, duration_seconds, created_at
+               FROM driving_videos ORDER BY name"""
+        )
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def get_video(db, video_id):
+    cursor = db.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            "SELECT video_id, name, video_path FROM driving_videos WHERE video_id = %s",
+            (video_id,)
+        )
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def delete_video(db, video_id):
+    """Remove a library entry and queue its file for cleanup; returns the deleted path or None"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT video_path FROM driving_videos WHERE video_id = %s", (video_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        cursor.execute("DELETE FROM driving_videos WHERE video_id = %s", (video_id,))
+        # The bundled sample clips under videos/ are part of the site; only library uploads are removed
+        if row[0].startswith('videos/library/'):
+            enqueue_files(cursor, [row[0]])
+        db.commit()
+        return row[0]
+    finally:
+        cursor.close()
+
+
+class RemoteFileCache:
+    """
+    Remote file references per (backend, local file), uploaded on first use
+    and re-uploaded once older than ttl_seconds or when a backend reports
+    that it no longer has the file.
+    """
+
+    def __init__(self, ttl_seconds=REMOTE_REF_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def ref_for(self, backend, full_path, force=False, stale_ref=None):
+        """
+        Cached reference for full_path on backend, uploading if needed. With
+        stale_ref, re-upload only if that is still the cached reference (so
+        concurrent requests that all saw it fail trigger a single upload).
+        """
+        key = (backend.base_url, full_path)
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if stale_ref is not None and entry and entry[0] is not stale_ref:
+                return entry[0]
+            if entry and not force and stale_ref is None and entry[1] > time.time():
+                metrics.inc('driving_video_ref_cache_total', result='hit')
+                return entry[0]
+            metrics.inc('driving_video_ref_cache_total', result='refresh' if entry else 'miss')
+            ref = backend.upload(full_path)
+            self._entries[key] = (ref, time.time() + self.ttl_seconds)
+            return ref
+
+    def invalidate(self, full_path):
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == full_path]:
+                del self._entries[key]
+
+    def handle(self, full_path):
+        """An object with the same ref_for(backend) interface as model_backends.SharedUpload"""
+        return CachedUpload(self, full_path)
+
+    def warm(self, pool, full_paths):
+        """Make sure every backend holds a fresh reference for each file; returns uploads done"""
+        uploaded = 0
+        for full_path in full_paths:
+            for backend in pool.backends:
+                key = (backend.base_url, full_path)
+                entry = self._entries.get(key)
+                # Refresh ahead of expiry so requests don't pay for the upload
+                if entry and entry[1] - self.ttl_seconds / 2 > time.time():
+                    continue
+                try:
+                    self.ref_for(backend, full_path, force=True)
+                    uploaded += 1
+                except Exception as e:
+                    logger.warning("Error uploading driving video to %s: %s", backend.base_url, e)
+        return uploaded
+
+
+class CachedUpload:
+    """One library file's view of a RemoteFileCache"""
+
+    def __init__(self, cache, full_path):
+        self.cache = cache
+        self.path = full_path
+
+    def ref_for(self, backend):
+        return self.cache.ref_for(backend, self.path)
+
+    def refresh(self, backend, stale_ref):
+        """Replace a reference the backend rejected; returns True so the caller retries"""
+        self.cache.ref_for(backend, self.path, stale_ref=stale_ref)
+        return True
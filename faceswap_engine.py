@@ -0,0 +1,149 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import metrics
+
+# Server-side face swap with request micro-batching.
+# Swap requests arriving within a short window are grouped and sent to one
+# backend together: all their input images go up in a single /upload
+# request (identical images only once), then the predictions are submitted
+# concurrently so a batching Gradio queue on the space can run them as one
+# model call. A batch holds one of the backend's pool slots. Batches form
+# across one worker's request threads (gunicorn.conf.py runs gthread workers).
+
+BATCH_WINDOW_SECONDS = float(os.getenv('FACESWAP_BATCH_WINDOW_MS', '25')) / 1000
+MAX_BATCH_SIZE = int(os.getenv('FACESWAP_MAX_BATCH_SIZE', '8'))
+REQUEST_TIMEOUT = int(os.getenv('FACESWAP_REQUEST_TIMEOUT', '120'))
+
+
+class BatchTimeout(TimeoutError):
+    """submit() stopped waiting; still_running is True if the item's batch had already started"""
+
+    def __init__(self, still_running):
+        super().__init__('Face swap timed out')
+        self.still_running = still_running
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(256 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def swap_batch(backend, items):
+    """
+    Run one batch of swaps on backend. items are dicts with source_path,
+    target_path and output_path; returns a result (None) or exception per item.
+    """
+    # Upload each distinct image once, in a single request
+    unique_paths = {}
+    item_digests = []
+    for item in items:
+        pair = (_file_digest(item['source_path']), _file_digest(item['target_path']))
+        unique_paths.setdefault(pair[0], item['source_path'])
+        unique_paths.setdefault(pair[1], item['target_path'])
+        item_digests.append(pair)
+    digests = list(unique_paths)
+    refs = dict(zip(digests, backend.upload_many([unique_paths[digest] for digest in digests])))
+    metrics.inc('faceswap_upload_dedup_total', 2 * len(items) - len(digests))
+
+    def run(item, pair):
+        outputs = backend.predict([refs[pair[0]], refs[pair[1]]])
+        backend.download(outputs[0], item['output_path'])
+
+    results = []
+    with ThreadPoolExecutor(max_workers=len(items), thread_name_prefix='faceswap-batch') as executor:
+        futures = [executor.submit(run, item, pair) for item, pair in zip(items, item_digests)]
+        for future in futures:
+            try:
+                future.result()
+                results.append(None)
+            except Exception as e:
+                results.append(e)
+    return results
+
+
+class MicroBatcher:
+    """
+    Groups concurrent submit() calls into batches of up to max_batch_size
+    collected over window_seconds, and runs each batch with
+    process_batch(backend, items) on a backend acquired from pool.
+    """
+
+    def __init__(self, pool, process_batch, window_seconds=BATCH_WINDOW_SECONDS, max_batch_size=MAX_BATCH_SIZE):
+        self.pool = pool
+        self.process_batch = process_batch
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=pool.capacity, thread_name_prefix='faceswap')
+        self._dispatcher = None
+        self._lock = threading.Lock()
+
+    def submit(self, item, timeout=REQUEST_TIMEOUT, on_abandoned=None):
+        """
+        Queue one item and wait for its batch; raises the item's error.
+        After timeout a still queued item is cancelled. If its batch is
+        already running, BatchTimeout.still_running is set and the batch
+        keeps using the item; on_abandoned(item) is called once it's done.
+        """
+        self._ensure_dispatcher()
+        future = Future()
+        self._queue.put((item, future))
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            if future.cancel():
+                metrics.inc('faceswap_timeouts_total', state='queued')
+                raise BatchTimeout(still_running=False)
+            if future.done():
+                return future.result()
+            metrics.inc('faceswap_timeouts_total', state='running')
+            if on_abandoned is not None:
+                future.add_done_callback(lambda _: on_abandoned(item))
+            raise BatchTimeout(still_running=True)
+
+    def _ensure_dispatcher(self):
+        # Started lazily so each gunicorn worker gets its own thread after fork
+        with self._lock:
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name='faceswap-batcher', daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            metrics.observe('faceswap_batch_size', len(batch))
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        # Items whose request gave up while they were queued are skipped
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        items = [item for item, _ in batch]
+        try:
+            with self.pool.acquire() as backend:
+                with metrics.timed('faceswap_batch_seconds'):
+                    results = self.process_batch(backend, items)
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
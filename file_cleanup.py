@@ -0,0 +1,177 @@
+import logging
+import os
+import time
+from mysql.connector import Error as MySQLError
+import metrics
+from storage import resolve_path
+
+logger = logging.getLogger(__name__)
+
+# Durable file deletion queue.
+# Request handlers only record which files must go (in the same transaction
+# that deletes the rows); the reaper job removes them from disk later in batches.
+# Paths are stored relative to the static folder, like animations.animation_path.
+
+MAX_ATTEMPTS = 5
+
+
+def enqueue_files(cursor, relative_paths, archived=False):
+    """
+    Queue files for deletion. Runs inside the caller's transaction.
+    archived: the files were moved to the archive tier, so the archive copy goes too.
+    """
+    rows = [(path, archived) for path in relative_paths if path]
+    if rows:
+        cursor.executemany("INSERT INTO file_cleanup_queue (file_path, archived) VALUES (%s, %s)", rows)
+
+
+def enqueue_user_files(cursor, user_id):
+    """Queue every file owned by a user (profile picture and variants, animations, avatars) for deletion"""
+    cursor.execute(
+        """INSERT INTO file_cleanup_queue (file_path)
+           SELECT profile_picture FROM users WHERE user_id = %s AND profile_picture IS NOT NULL""",
+        (user_id,)
+    )
+    cursor.execute(
+        """INSERT INTO file_cleanup_queue (file_path, archived)
+           SELECT animation_path, storage_tier = 'archived' FROM animations WHERE user_id = %s""",
+        (user_id,)
+    )
+    cursor.execute(
+        """INSERT INTO file_cleanup_queue (file_path)
+           SELECT variant_path FROM profile_picture_variants WHERE user_id = %s""",
+        (user_id,)
+    )
+    # Avatars table only exists on some deployments
+    try:
+        cursor.execute(
+            """INSERT INTO file_cleanup_queue (file_path)
+               SELECT avatar_path FROM avatars WHERE user_id = %s AND avatar_path IS NOT NULL""",
+            (user_id,)
+        )
+    except MySQLError as e:
+        logger.warning("Avatars table may not exist or error accessing it: %s", e)
+
+
+def reap_cleanup_queue(db, static_root='static', batch_size=200, archive_tier=None):
+    """
+    Delete queued files from disk (and the archive-tier copy of archived ones) in batches.
+    Failures, including the archive tier's, are retried with exponential backoff
+    and given up after MAX_ATTEMPTS.
+    Returns the number of queue entries completed.
+    """
+    completed = 0
+    cursor = db.cursor(dictionary=True)
+    try:
+        while True:
+            cursor.execute(
+                """SELECT cleanup_id, file_path, archived, attempts FROM file_cleanup_queue
+                   WHERE next_attempt_at <= NOW()
+                   ORDER BY next_attempt_at
+                   LIMIT %s""",
+                (batch_size,)
+            )
+            entries = cursor.fetchall()
+            if not entries:
+                break
+
+            done_ids = []
+            failed = []
+            for entry in entries:
+                full_path = resolve_path(static_root, entry['file_path'])
+                try:
+                    if entry['archived'] and archive_tier and full_path:
+                        archive_tier.delete(entry['file_path'])
+                    if full_path:
+                        try:
+                            os.remove(full_path)
+                            metrics.inc('file_cleanup_files_removed_total')
+                        except FileNotFoundError:
+                            pass
+                    done_ids.append(entry['cleanup_id'])
+                except Exception as e:
+                    # OSError, or the archive tier's own errors (e.g. botocore's); retried per entry
+                    if entry['attempts'] + 1 >= MAX_ATTEMPTS:
+                        logger.error("Giving up deleting %s after %s attempts: %s", entry['file_path'], MAX_ATTEMPTS, e)
+                        metrics.inc('file_cleanup_abandoned_total')
+                        done_ids.append(entry['cleanup_id'])
+                    else:
+                        failed.append((str(e)[:500], 2 ** entry['attempts'], entry['cleanup_id']))
+
+            if done_ids:
+                placeholders = ', '.join(['%s'] * len(done_ids))
+                cursor.execute(f"DELETE FROM file_cleanup_queue WHERE cleanup_id IN ({placeholders})", done_ids)
+            if failed:
+                metrics.inc('file_cleanup_failures_total', len(failed))
+                cursor.executemany(
+                    """UPDATE file_cleanup_queue
+                       SET attempts = attempts + 1, last_error = %s,
+                           next_attempt_at = NOW() + INTERVAL %s MINUTE
+                       WHERE cleanup_id = %s""",
+                    failed
+                )
+            db.commit()
+            completed += len(done_ids)
+
+            if len(entries) < batch_size:
+                break
+    finally:
+        cursor.close()
+    return completed
+
+
+def iter_files(directory):
+    """Yield (path, DirEntry) for every regular file below directory"""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from iter_files(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path, entry
+    except FileNotFoundError:
+        return
+
+
+def reconcile_animation_files(db, static_root='static', grace_seconds=3600, batch_size=500):
+    """
+    Queue files under static/animations that no animations row references.
+    Catches files left behind by crashes or failed saves. Files younger than
+    grace_seconds are skipped so in-flight saves aren't touched.
+    Returns the number of orphaned files queued.
+    """
+    animations_dir = os.path.join(static_root, 'animations')
+    cutoff = time.time() - grace_seconds
+    queued = 0
+    cursor = db.cursor()
+
+    def flush(candidates):
+        placeholders = ', '.join(['%s'] * len(candidates))
+        cursor.execute(
+            f"SELECT animation_path FROM animations WHERE animation_path IN ({placeholders})",
+            list(candidates)
+        )
+        referenced = {row[0] for row in cursor.fetchall()}
+        orphans = [path for path in candidates if path not in referenced]
+        enqueue_files(cursor, orphans)
+        db.commit()
+        return len(orphans)
+
+    try:
+        candidates = []
+        for path, entry in iter_files(animations_dir):
+            if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                continue
+            candidates.append(os.path.relpath(path, static_root).replace(os.sep, '/'))
+            if len(candidates) >= batch_size:
+                queued += flush(candidates)
+                candidates = []
+        if candidates:
+            queued += flush(candidates)
+    finally:
+        cursor.close()
+
+    if queued:
+        metrics.inc('file_cleanup_orphans_queued_total', queued)
+        logger.info("Reconcile: queued %s orphaned animation file(s) for deletion", queued)
+    return queued
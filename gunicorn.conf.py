@@ -0,0 +1,43 @@
+import os
+import shutil
+
+# Gunicorn settings (loaded automatically from the working directory).
+# Workers write Prometheus metrics to PROMETHEUS_MULTIPROC_DIR so /metrics
+# can aggregate across all of them; the directory is cleared when the
+# server starts and dead workers' live values are dropped. The same goes for
+# the rate limiter's shared state (rate_limit.py).
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/face_animation_metrics')
+
+# Threaded workers: requests mostly wait on model backends, and work that is
+# offloaded per worker (face swap micro-batching, the password hashing pool)
+# only helps when a worker has concurrent requests to batch or turn away
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+
+def on_starting(server):
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+    import rate_limit
+    rate_limit.reset()
+
+
+def post_worker_init(worker):
+    # Background jobs run in the serving workers only, not in everything that imports app
+    import app
+    app.start_background_jobs()
+    # Password hashing pool (and its hash parameters) ready before the first login
+    import password_hashing
+    password_hashing.start()
+
+
+def child_exit(server, worker):
+    import rate_limit
+    rate_limit.release_process(worker.pid)
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,172 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Check if Pillow is available
+try:
+    from PIL import Image, ImageOps, ImageSequence, features
+    WEBP_SUPPORTED = features.check('webp')
+except ImportError:
+    Image = None
+    WEBP_SUPPORTED = False
+    logger.warning("Pillow is not installed. Profile pictures will be served without resized variants. Install it with: pip install Pillow")
+
+# Square avatar sizes generated for every profile picture
+VARIANT_SIZES = (64, 128, 256)
+# Longest side of the stored (metadata-stripped) original
+MAX_ORIGINAL_SIZE = 1024
+# Animated GIF/WebP originals stay animated, smaller (every frame is held in
+# memory while re-encoding) and cut after MAX_ANIMATED_FRAMES frames
+MAX_ANIMATED_SIZE = 256
+MAX_ANIMATED_FRAMES = int(os.getenv('IMAGE_PIPELINE_MAX_ANIMATED_FRAMES', '300'))
+
+_SAVE_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF', 'webp': 'WEBP'}
+
+# Image work is CPU-bound but short; a couple of threads keep it off the request path
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv('IMAGE_PIPELINE_WORKERS', '2')),
+                               thread_name_prefix='image-pipeline')
+
+
+def variant_relpath(original_relpath, size):
+    """Variant of a profile picture lives next to the original: <stem>_<size>.webp"""
+    stem = original_relpath.rsplit('.', 1)[0]
+    extension = 'webp' if WEBP_SUPPORTED else 'jpg'
+    return f"{stem}_{size}.{extension}"
+
+
+def _save_variant(image, full_path):
+    if WEBP_SUPPORTED:
+        image.save(full_path, 'WEBP', quality=80, method=4)
+    else:
+        image.convert('RGB').save(full_path, 'JPEG', quality=85, optimize=True, progressive=True)
+
+
+class ImageProcessingError(Exception):
+    """Raised when an uploaded image can't be re-encoded"""
+    pass
+
+
+def strip_profile_picture(upload_path, original_path):
+    """
+    Re-encode the upload at upload_path to original_path without EXIF/metadata
+    (GPS, camera info), with orientation applied and its longest side capped
+    at MAX_ORIGINAL_SIZE. Animated GIF/WebP originals are kept animated (see
+    _strip_animated). Runs before the picture is published; raises
+    ImageProcessingError if the image can't be processed.
+    """
+    if Image is None:
+        raise ImageProcessingError('Profile pictures cannot be processed on this server.')
+
+    save_format = _SAVE_FORMATS.get(original_path.rsplit('.', 1)[-1].lower(), 'PNG')
+    temp_path = original_path + '.tmp'
+    try:
+        with metrics.timed('image_strip_seconds'):
+            with Image.open(upload_path) as source:
+                if getattr(source, 'is_animated', False) and save_format in ('GIF', 'WEBP'):
+                    _strip_animated(source, temp_path, save_format)
+                else:
+                    # Large JPEGs are decoded at a reduced scale close to what is kept
+                    source.draft('RGB', (MAX_ORIGINAL_SIZE, MAX_ORIGINAL_SIZE))
+                    image = ImageOps.exif_transpose(source)
+                    image.thumbnail((MAX_ORIGINAL_SIZE, MAX_ORIGINAL_SIZE))
+                    if image.mode not in ('RGB', 'RGBA') or 'transparency' in image.info:
+                        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'P') else 'RGB')
+                    if save_format == 'JPEG':
+                        image = image.convert('RGB')
+                    # Re-encoding from pixels without info drops all metadata (comments, XMP, ICC)
+                    image.info = {}
+                    image.save(temp_path, save_format)
+        os.replace(temp_path, original_path)
+    except Exception as e:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        metrics.inc('image_strip_failures_total')
+        raise ImageProcessingError('The image could not be processed. Please upload a different picture.') from e
+
+
+def process_profile_picture(static_root, original_relpath):
+    """
+    Build the avatar variants of a stored (already stripped) profile picture;
+    animated pictures get stills of their first frame.
+    Returns {size: relative_path} of the variants written.
+    """
+    if Image is None:
+        return {}
+
+    with metrics.timed('image_pipeline_seconds'):
+        with Image.open(os.path.join(static_root, original_relpath)) as source:
+            image = source.convert('RGBA' if 'transparency' in source.info or source.mode in ('LA', 'P', 'RGBA') else 'RGB')
+
+        variants = {}
+        for size in VARIANT_SIZES:
+            variant = ImageOps.fit(image, (size, size), method=Image.LANCZOS)
+            relative_path = variant_relpath(original_relpath, size)
+            _save_variant(variant, os.path.join(static_root, relative_path))
+            variants[size] = relative_path
+
+    metrics.inc('image_pipeline_processed_total')
+    return variants
+
+
+def _strip_animated(source, destination, save_format):
+    """
+    Write an animated image's frames to destination (which drops its
+    metadata), keeping frame timings and looping, scaled to
+    MAX_ANIMATED_SIZE and cut after MAX_ANIMATED_FRAMES frames.
+    """
+    frames = []
+    durations = []
+    for frame in ImageSequence.Iterator(source):
+        if len(frames) >= MAX_ANIMATED_FRAMES:
+            logger.info("Animated profile picture cut to %s frames", MAX_ANIMATED_FRAMES)
+            break
+        copy = frame.convert('RGBA')
+        copy.info = {}  # comments, XMP, ICC
+        copy.thumbnail((MAX_ANIMATED_SIZE, MAX_ANIMATED_SIZE))
+        frames.append(copy)
+        durations.append(frame.info.get('duration', 100))
+    frames[0].save(destination, save_format, save_all=True, append_images=frames[1:],
+                   duration=durations, loop=source.info.get('loop', 0), disposal=2)
+
+
+def _process_and_record(get_db, static_root, user_id, original_relpath):
+    try:
+        variants = process_profile_picture(static_root, original_relpath)
+        if not variants:
+            return
+        db = get_db()
+        cursor = db.cursor()
+        try:
+            # Only record variants if this is still the user's current picture
+            cursor.execute(
+                "SELECT profile_picture FROM users WHERE user_id = %s FOR UPDATE",
+                (user_id,)
+            )
+            row = cursor.fetchone()
+            if not row or row[0] != original_relpath:
+                db.rollback()
+                for relative_path in variants.values():
+                    os.remove(os.path.join(static_root, relative_path))
+                return
+            cursor.execute("DELETE FROM profile_picture_variants WHERE user_id = %s", (user_id,))
+            cursor.executemany(
+                "INSERT INTO profile_picture_variants (user_id, size, variant_path) VALUES (%s, %s, %s)",
+                [(user_id, size, relative_path) for size, relative_path in variants.items()]
+            )
+            db.commit()
+        finally:
+            cursor.close()
+            db.close()
+    except Exception as e:
+        metrics.inc('image_pipeline_failures_total')
+        logger.exception("Profile picture processing failed for user %s: %s", user_id, e)
+
+
+def submit_profile_picture(get_db, static_root, user_id, original_relpath):
+    """Build the variants of a freshly stored profile picture in the background"""
+    return _executor.submit(_process_and_record, get_db, static_root, user_id, original_relpath)
@@ -0,0 +1,295 @@
+import os
+import struct
+import metrics
+
+# Upload validation by content instead of filename.
+# The first chunk of an upload is inspected (magic bytes, container headers,
+# image dimensions, video duration) before anything is written to disk, and
+# the size limit is enforced while streaming, so bad or oversized media is
+# rejected before it costs disk I/O or a model run.
+
+SNIFF_BYTES = 64 * 1024
+CHUNK_SIZE = 256 * 1024
+
+MAX_IMAGE_DIMENSION = int(os.getenv('UPLOAD_MAX_IMAGE_DIMENSION', '8192'))
+MIN_IMAGE_DIMENSION = int(os.getenv('UPLOAD_MIN_IMAGE_DIMENSION', '32'))
+MAX_VIDEO_SECONDS = float(os.getenv('UPLOAD_MAX_VIDEO_SECONDS', '120'))
+MAX_AUDIO_SECONDS = float(os.getenv('UPLOAD_MAX_AUDIO_SECONDS', '300'))
+
+# Per-kind size limits (the request as a whole is also capped by MAX_CONTENT_LENGTH)
+MAX_BYTES = {
+    'image': int(os.getenv('UPLOAD_MAX_IMAGE_BYTES', str(10 * 1024 * 1024))),
+    'video': int(os.getenv('UPLOAD_MAX_VIDEO_BYTES', str(16 * 1024 * 1024))),
+    'audio': int(os.getenv('UPLOAD_MAX_AUDIO_BYTES', str(16 * 1024 * 1024)))
+}
+
+# Media types accepted for each kind of upload
+ALLOWED_TYPES = {
+    'image': {'png', 'jpeg', 'gif', 'webp'},
+    'video': {'mp4', 'mov', 'avi', 'webm'},
+    'audio': {'wav', 'mp3', 'ogg', 'flac', 'm4a', 'webm'}
+}
+
+
+# ISO base media (ftyp) major brands we accept. Anything else in an ftyp
+# container (HEIC/AVIF stills, 3GP, ...) is not identified.
+MP4_BRANDS = {b'isom', b'iso2', b'iso4', b'iso5', b'iso6', b'mp41', b'mp42', b'avc1', b'M4V ', b'M4VP', b'dash', b'MSNV'}
+M4A_BRANDS = {b'M4A ', b'M4B '}
+# Generic mp4 brands that also carry audio-only files (AAC from encoders that don't write M4A)
+AUDIO_MP4_BRANDS = {b'isom', b'iso2', b'mp41', b'mp42', b'dash'}
+
+
+class UploadValidationError(Exception):
+    """Raised when an upload's content isn't an acceptable media file"""
+    pass
+
+
+def sniff_type(header):
+    """Identify a media type from its leading bytes; returns a short name or None"""
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        return 'wav'
+    if header[:4] == b'RIFF' and header[8:12] == b'AVI ':
+        return 'avi'
+    if header[4:8] == b'ftyp':
+        brand = header[8:12]
+        if brand == b'qt  ':
+            return 'mov'
+        if brand in M4A_BRANDS:
+            return 'm4a'
+        if brand in MP4_BRANDS:
+            return 'mp4'
+        return None
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'webm'
+    if header.startswith(b'OggS'):
+        return 'ogg'
+    if header.startswith(b'fLaC'):
+        return 'flac'
+    if header.startswith(b'ID3') or (len(header) > 1 and header[0] == 0xff and header[1] & 0xe0 == 0xe0):
+        return 'mp3'
+    return None
+
+
+def image_dimensions(media_type, header):
+    """(width, height) parsed from an image header, or None if not found in the sniffed bytes"""
+    try:
+        if media_type == 'png':
+            return struct.unpack('>II', header[16:24])
+        if media_type == 'gif':
+            return struct.unpack('<HH', header[6:10])
+        if media_type == 'webp':
+            chunk = header[12:16]
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', header[26:30])
+                return width & 0x3fff, height & 0x3fff
+            if chunk == b'VP8L':
+                bits = struct.unpack('<I', header[21:25])[0]
+                return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+            if chunk == b'VP8X':
+                width = int.from_bytes(header[24:27], 'little') + 1
+                height = int.from_bytes(header[27:30], 'little') + 1
+                return width, height
+        if media_type == 'jpeg':
+            # Walk the marker segments up to the first start-of-frame
+            offset = 2
+            while offset + 9 < len(header):
+                if header[offset] != 0xff:
+                    offset += 1
+                    continue
+                marker = header[offset + 1]
+                if marker in (0xd8, 0x01) or 0xd0 <= marker <= 0xd7:
+                    offset += 2
+                    continue
+                length = struct.unpack('>H', header[offset + 2:offset + 4])[0]
+                if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                    height, width = struct.unpack('>HH', header[offset + 5:offset + 9])
+                    return width, height
+                offset += 2 + length
+    except struct.error:
+        pass
+    return None
+
+
+def _mvhd_duration(data):
+    """Duration in seconds from the payload of an mp4/mov 'mvhd' box"""
+    version = data[0]
+    if version == 1:
+        timescale, duration = struct.unpack('>IQ', data[20:32])
+    else:
+        timescale, duration = struct.unpack('>II', data[12:20])
+    return duration / timescale if timescale else None
+
+
+def _find_box(data, box_type):
+    """Payload of the first child box of box_type directly inside data"""
+    offset = 0
+    while offset + 8 <= len(data):
+        size, current = struct.unpack('>I4s', data[offset:offset + 8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header_size = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header_size:
+            return None
+        if current == box_type:
+            return data[offset + header_size:offset + size]
+        offset += size
+    return None
+
+
+def mp4_duration(path):
+    """
+    Duration of an mp4/mov file in seconds, found by walking the top-level
+    boxes with seeks (reads only box headers and the moov box).
+    """
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            offset = 0
+            while offset + 8 <= file_size:
+                f.seek(offset)
+                size, box_type = struct.unpack('>I4s', f.read(8))
+                header_size = 8
+                if size == 1:
+                    size = struct.unpack('>Q', f.read(8))[0]
+                    header_size = 16
+                elif size == 0:
+                    size = file_size - offset
+                if size < header_size:
+                    return None
+                if box_type == b'moov':
+                    moov = f.read(min(size - header_size, 16 * 1024 * 1024))
+                    mvhd = _find_box(moov, b'mvhd')
+                    return _mvhd_duration(mvhd) if mvhd else None
+                offset += size
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def wav_duration(header):
+    """Duration of a PCM WAV file from its fmt/data chunk headers, or None"""
+    try:
+        offset = 12
+        byte_rate = None
+        while offset + 8 <= len(header):
+            chunk_id, chunk_size = struct.unpack('<4sI', header[offset:offset + 8])
+            if chunk_id == b'fmt ':
+                byte_rate = struct.unpack('<I', header[offset + 16:offset + 20])[0]
+            elif chunk_id == b'data':
+                return chunk_size / byte_rate if byte_rate else None
+            offset += 8 + chunk_size + (chunk_size & 1)
+    except struct.error:
+        pass
+    return None
+
+
+def _reject(kind, reason, message):
+    metrics.inc('upload_validation_rejections_total', kind=kind, reason=reason)
+    raise UploadValidationError(message)
+
+
+def validate_header(header, kind):
+    """
+    Check the first bytes of an upload against what `kind` ('image', 'video',
+    'audio') accepts. Returns the detected media type; raises UploadValidationError.
+    """
+    media_type = sniff_type(header)
+    if kind == 'audio' and media_type == 'mp4' and header[8:12] in AUDIO_MP4_BRANDS:
+        media_type = 'm4a'
+    if media_type not in ALLOWED_TYPES[kind]:
+        allowed = ', '.join(sorted(ALLOWED_TYPES[kind])).upper()
+        _reject(kind, 'type', f'Unsupported {kind} file. The file content is not a valid {allowed} {kind}.')
+
+    if kind == 'image':
+        dimensions = image_dimensions(media_type, header)
+        if dimensions:
+            width, height = dimensions
+            if width > MAX_IMAGE_DIMENSION or height > MAX_IMAGE_DIMENSION:
+                _reject(kind, 'dimensions',
+                        f'Image is too large ({width}x{height}). Maximum is {MAX_IMAGE_DIMENSION}x{MAX_IMAGE_DIMENSION} pixels.')
+            if width < MIN_IMAGE_DIMENSION or height < MIN_IMAGE_DIMENSION:
+                _reject(kind, 'dimensions',
+                        f'Image is too small ({width}x{height}). Minimum is {MIN_IMAGE_DIMENSION}x{MIN_IMAGE_DIMENSION} pixels.')
+
+    if kind == 'video' and media_type in ('mp4', 'mov'):
+        moov = _find_box(header, b'moov')
+        mvhd = _find_box(moov, b'mvhd') if moov else None
+        duration = _mvhd_duration(mvhd) if mvhd else None
+        if duration and duration > MAX_VIDEO_SECONDS:
+            _reject(kind, 'duration', f'Video is too long ({duration:.0f}s). Maximum is {MAX_VIDEO_SECONDS:.0f} seconds.')
+
+    if kind == 'audio' and media_type == 'wav':
+        duration = wav_duration(header)
+        if duration and duration > MAX_AUDIO_SECONDS:
+            _reject(kind, 'duration', f'Audio is too long ({duration:.0f}s). Maximum is {MAX_AUDIO_SECONDS:.0f} seconds.')
+
+    return media_type
+
+
+def save_validated_upload(file_storage, destination, kind, max_bytes=None):
+    """
+    Stream an uploaded file to destination, validating its content first.
+    Nothing is written if the header is rejected; a partial file is removed if
+    the upload turns out too large or too long. Returns the detected media type.
+    """
+    if max_bytes is None:
+        max_bytes = MAX_BYTES[kind]
+    stream = file_storage.stream
+    header = b''
+    while len(header) < SNIFF_BYTES:
+        chunk = stream.read(SNIFF_BYTES - len(header))
+        if not chunk:
+            break
+        header += chunk
+    if not header:
+        _reject(kind, 'empty', 'The uploaded file is empty.')
+
+    media_type = validate_header(header, kind)
+
+    written = 0
+    try:
+        with open(destination, 'wb') as out:
+            chunk = header
+            while chunk:
+                written += len(chunk)
+                if written > max_bytes:
+                    _reject(kind, 'size', f'File is too large. Maximum size is {max_bytes // (1024 * 1024)} MB.')
+                out.write(chunk)
+                chunk = stream.read(CHUNK_SIZE)
+
+        # Videos without 'faststart' keep their duration at the end of the file
+        if kind == 'video' and media_type in ('mp4', 'mov'):
+            duration = mp4_duration(destination)
+            if duration and duration > MAX_VIDEO_SECONDS:
+                _reject(kind, 'duration', f'Video is too long ({duration:.0f}s). Maximum is {MAX_VIDEO_SECONDS:.0f} seconds.')
+    except Exception:
+        try:
+            os.remove(destination)
+        except OSError:
+            pass
+        raise
+
+    metrics.inc('upload_validation_accepted_total', kind=kind, media_type=media_type)
+    return media_type
+
+
+def validate_bytes(data, kind, max_bytes=None):
+    """Validate an upload that's already in memory (e.g. decoded base64). Returns the media type."""
+    if max_bytes is None:
+        max_bytes = MAX_BYTES[kind]
+    if not data:
+        _reject(kind, 'empty', 'The uploaded file is empty.')
+    if len(data) > max_bytes:
+        _reject(kind, 'size', f'File is too large. Maximum size is {max_bytes // (1024 * 1024)} MB.')
+    return validate_header(data[:SNIFF_BYTES], kind)
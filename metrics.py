@@ -0,0 +1,140 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Metrics registry, exported on /metrics in Prometheus text format.
+# Counters and histograms are created on first use from their name and label
+# names. With prometheus_client installed, and PROMETHEUS_MULTIPROC_DIR set
+# (gunicorn.conf.py does this), values are aggregated across gunicorn
+# workers. Without it a small in-process registry renders the same format
+# for the current worker only.
+
+try:
+    from prometheus_client import (CollectorRegistry, Counter, Histogram, REGISTRY,
+                                   generate_latest, CONTENT_TYPE_LATEST)
+    from prometheus_client import multiprocess
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+    logger.warning("prometheus_client is not installed. /metrics will only show this worker's metrics. Install it with: pip install prometheus-client")
+
+# Histogram buckets for *_seconds metrics, and for everything else (batch sizes, counts per request)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+_lock = threading.Lock()
+_metrics = {}
+# In-process fallback storage, keyed by metric name plus a sorted tuple of labels
+_counters = {}
+_histograms = {}
+
+
+def _buckets(name):
+    return LATENCY_BUCKETS if name.endswith('_seconds') else COUNT_BUCKETS
+
+
+def _prometheus_metric(kind, name, label_names):
+    metric = _metrics.get(name)
+    if metric is None:
+        with _lock:
+            metric = _metrics.get(name)
+            if metric is None:
+                description = name.replace('_', ' ')
+                if kind == 'counter':
+                    metric = Counter(name, description, label_names)
+                else:
+                    metric = Histogram(name, description, label_names, buckets=_buckets(name))
+                _metrics[name] = metric
+    return metric
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name, value=1, **labels):
+    """Increment a counter"""
+    if PROMETHEUS_AVAILABLE:
+        metric = _prometheus_metric('counter', name, sorted(labels))
+        (metric.labels(**labels) if labels else metric).inc(value)
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record one observation (e.g. a latency in seconds) in a histogram"""
+    if PROMETHEUS_AVAILABLE:
+        metric = _prometheus_metric('histogram', name, sorted(labels))
+        (metric.labels(**labels) if labels else metric).observe(value)
+        return
+    key = _key(name, labels)
+    buckets = _buckets(name)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * len(buckets), 'count': 0, 'sum': 0.0}
+        histogram['count'] += 1
+        histogram['sum'] += value
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram['buckets'][index] += 1
+
+
+@contextmanager
+def timed(name, **labels):
+    """Context manager that observes the elapsed wall-clock time in seconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+               for k, v in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _render_fallback():
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items())
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in histograms:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        for bound, count in zip(_buckets(name), histogram['buckets']):
+            lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, le='+Inf')} {histogram['count']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def render():
+    """Current metrics in Prometheus text format; returns (body, content_type)"""
+    if not PROMETHEUS_AVAILABLE:
+        return _render_fallback(), CONTENT_TYPE_LATEST
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
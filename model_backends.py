@@ -0,0 +1,247 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import requests
+import metrics
+
+# Pool of Gradio model backends (HuggingFace spaces or self-hosted replicas).
+# Inputs are uploaded once per backend with /upload and referenced by their
+# server-side path in predict calls, so the same file can be reused across
+# many predictions without re-sending it. Each backend has a concurrency cap
+# and work goes to the least busy backend that has a free slot.
+
+UPLOAD_TIMEOUT = int(os.getenv('MODEL_UPLOAD_TIMEOUT', '120'))
+PREDICT_TIMEOUT = int(os.getenv('MODEL_PREDICT_TIMEOUT', '300'))
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+
+class BackendError(Exception):
+    """Raised when a model backend call fails"""
+    pass
+
+
+def normalize_space_url(url):
+    """Turn 'user/space' or an hf.space URL into the hf.space base URL"""
+    url = url.strip().rstrip('/')
+    if url.startswith('http://') or url.startswith('https://'):
+        return url
+    if '/' in url:
+        username, space_name = url.split('/', 1)
+        return f"https://{username}-{space_name}.hf.space"
+    return f"https://{url}"
+
+
+class GradioBackend:
+    """One Gradio server, called over its HTTP API"""
+
+    def __init__(self, base_url, max_concurrency=2, api_name='predict'):
+        self.base_url = normalize_space_url(base_url)
+        self.api_name = api_name
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0  # maintained by BackendPool under its lock
+        self._session = requests.Session()
+
+    def __repr__(self):
+        return f"GradioBackend({self.base_url})"
+
+    def upload(self, path):
+        """Upload a local file; returns the file reference to pass to predict()"""
+        return self.upload_many([path])[0]
+
+    def upload_many(self, paths):
+        """Upload several local files in one request; returns their file references in order"""
+        with metrics.timed('model_backend_upload_seconds', backend=self.base_url):
+            handles = [open(path, 'rb') for path in paths]
+            try:
+                response = self._session.post(
+                    f"{self.base_url}/upload",
+                    files=[('files', (os.path.basename(path), handle)) for path, handle in zip(paths, handles)],
+                    timeout=UPLOAD_TIMEOUT
+                )
+            finally:
+                for handle in handles:
+                    handle.close()
+        if response.status_code != 200:
+            metrics.inc('model_backend_errors_total', backend=self.base_url, stage='upload')
+            raise BackendError(f'Upload to {self.base_url} failed with status {response.status_code}: {response.text[:200]}')
+        remote_paths = response.json()
+        if len(remote_paths) != len(paths):
+            raise BackendError(f'Upload to {self.base_url} returned {len(remote_paths)} files for {len(paths)}')
+        metrics.inc('model_backend_upload_bytes_total', sum(os.path.getsize(path) for path in paths),
+                    backend=self.base_url)
+        return [self.file_ref(remote_path, os.path.basename(path)) for remote_path, path in zip(remote_paths, paths)]
+
+    @staticmethod
+    def file_ref(remote_path, orig_name=None):
+        """Predict-call reference to a file already on the server (Gradio 3 and 4 field names)"""
+        return {
+            'path': remote_path,
+            'name': remote_path,
+            'orig_name': orig_name,
+            'is_file': True,
+            'meta': {'_type': 'gradio.FileData'}
+        }
+
+    def predict(self, data):
+        """Run the backend's predict endpoint; returns the response's data list"""
+        with metrics.timed('model_backend_predict_seconds', backend=self.base_url):
+            response = self._session.post(
+                f"{self.base_url}/api/{self.api_name}",
+                json={'data': data},
+                timeout=PREDICT_TIMEOUT
+            )
+        if response.status_code != 200:
+            metrics.inc('model_backend_errors_total', backend=self.base_url, stage='predict')
+            raise BackendError(f'Predict API failed with status {response.status_code}: {response.text[:500]}')
+        result = response.json()
+        if not result.get('data'):
+            raise BackendError('No output data in API response')
+        return result['data']
+
+    def download(self, output, destination):
+        """Stream a predict output (URL, server path or file dict) to destination"""
+        if isinstance(output, dict):
+            output = output.get('video') or output
+            if isinstance(output, dict):
+                output = output.get('url') or output.get('path') or output.get('name')
+        if not isinstance(output, str) or not output:
+            raise BackendError('No file in API response')
+
+        if output.startswith('http'):
+            url = output
+        elif output.startswith('/file=') or output.startswith('/gradio_api/'):
+            url = f"{self.base_url}{output}"
+        else:
+            url = f"{self.base_url}/file={output}"
+
+        downloaded = 0
+        with metrics.timed('model_backend_download_seconds', backend=self.base_url):
+            with self._session.get(url, stream=True, timeout=PREDICT_TIMEOUT) as response:
+                response.raise_for_status()
+                with open(destination, 'wb') as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        downloaded += len(chunk)
+        metrics.inc('model_backend_download_bytes_total', downloaded, backend=self.base_url)
+
+
+class BackendPool:
+    """Replicas of one model, with least-busy selection and per-backend concurrency caps"""
+
+    def __init__(self, backends):
+        if not backends:
+            raise ValueError('BackendPool needs at least one backend')
+        self.backends = backends
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    @classmethod
+    def from_env(cls, prefix, default_url):
+        """
+        Build a pool from {prefix}_HF_SPACE_URLS (comma-separated replicas),
+        falling back to {prefix}_HF_SPACE_URL, with {prefix}_BACKEND_CONCURRENCY
+        slots per replica and {prefix}_API_NAME as the predict endpoint.
+        Returns None when no URL is configured and there is no default.
+        """
+        urls = os.getenv(f'{prefix}_HF_SPACE_URLS') or os.getenv(f'{prefix}_HF_SPACE_URL') or default_url
+        if not urls:
+            return None
+        concurrency = int(os.getenv(f'{prefix}_BACKEND_CONCURRENCY', '2'))
+        api_name = os.getenv(f'{prefix}_API_NAME', 'predict')
+        return cls([
+            GradioBackend(url, max_concurrency=concurrency, api_name=api_name)
+            for url in urls.split(',') if url.strip()
+        ])
+
+    @property
+    def capacity(self):
+        return sum(backend.max_concurrency for backend in self.backends)
+
+    @contextmanager
+    def acquire(self):
+        """Wait for a free slot on the least busy backend and hold it"""
+        with self._available:
+            while True:
+                free = [b for b in self.backends if b.in_flight < b.max_concurrency]
+                if free:
+                    backend = min(free, key=lambda b: b.in_flight)
+                    backend.in_flight += 1
+                    break
+                self._available.wait()
+        try:
+            yield backend
+        finally:
+            with self._available:
+                backend.in_flight -= 1
+                self._available.notify()
+
+
+class SharedUpload:
+    """
+    A local file uploaded lazily, at most once per backend, so that every
+    prediction routed to a backend reuses the same remote reference.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._refs = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def ref_for(self, backend):
+        with self._lock:
+            lock = self._locks.setdefault(backend.base_url, threading.Lock())
+        with lock:
+            ref = self._refs.get(backend.base_url)
+            if ref is None:
+                ref = self._refs[backend.base_url] = backend.upload(self.path)
+            else:
+                metrics.inc('model_backend_upload_reuse_total', backend=backend.base_url)
+            return ref
+
+    def refresh(self, backend, stale_ref):
+        """Freshly uploaded for this request, so a rejected reference isn't worth retrying"""
+        return False
+
+
+def run_batch(pool, items, work, max_concurrency=None, retries=0):
+    """
+    Run work(backend, item) for each item on the pool, at most max_concurrency
+    at a time (default: the pool's total slots). A failing item is retried up
+    to `retries` times, each time on whichever backend is free. Yields
+    (index, result, error) in completion order, so callers can report each
+    item as soon as it's done. Closing the generator early cancels the items
+    that haven't started.
+    """
+    if not items:
+        return
+    workers = min(len(items), max_concurrency or pool.capacity)
+
+    def run(item):
+        for attempt in range(retries + 1):
+            try:
+                with pool.acquire() as backend:
+                    return work(backend, item)
+            except Exception:
+                if attempt == retries:
+                    raise
+                metrics.inc('model_batch_item_retries_total')
+                time.sleep(min(2 ** attempt, 10))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='model-batch') as executor:
+        futures = {executor.submit(run, item): index for index, item in enumerate(items)}
+        try:
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    metrics.inc('model_batch_item_errors_total')
+                    yield index, None, e
+                    continue
+                yield index, result, None
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,161 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Password hashing off the request threads.
+# scrypt (werkzeug's default, N=32768) takes tens of milliseconds of CPU and
+# ~32 MB per call, so hashes run in a small per-worker process pool instead
+# of on the request thread. At most PASSWORD_HASH_MAX_PENDING hashes may be
+# queued or running per worker; a request that can't get a slot within
+# PASSWORD_HASH_QUEUE_TIMEOUT seconds gets HashingBusy, so a login storm is
+# turned away instead of stalling every other route. This needs threaded
+# workers (gunicorn.conf.py runs gthread): a sync worker serves one request
+# at a time, which waits for its hash either way, so nothing else is kept
+# responsive and the admission limit is never reached. Hashes made with
+# different parameters than PASSWORD_HASH_METHOD are upgraded on login.
+
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '16'))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', '2'))
+# Seconds clients are asked to wait before retrying a rejected request
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv('PASSWORD_HASH_RETRY_AFTER', '2'))
+
+_slots = threading.BoundedSemaphore(max(PASSWORD_HASH_MAX_PENDING, 1))
+_pool_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_pending = 0
+_pending_lock = threading.Lock()
+_current_prefix = None
+_prefix_future = None
+
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already queued in this worker"""
+
+    def __init__(self, retry_after=PASSWORD_HASH_RETRY_AFTER):
+        super().__init__('Too many password hashes in progress')
+        self.retry_after = retry_after
+
+
+def _method_prefix(method):
+    # werkzeug fills in the default cost parameters, so read them off a real hash
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def _get_pool():
+    """This process's hashing pool (created on first use, and again after a fork or crash)"""
+    global _pool, _pool_pid, _prefix_future
+    if PASSWORD_HASH_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # forkserver/spawn children don't inherit the gunicorn worker's threads and sockets
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            try:
+                _pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=context)
+                _pool_pid = os.getpid()
+                if _current_prefix is None:
+                    _prefix_future = _pool.submit(_method_prefix, PASSWORD_HASH_METHOD)
+            except (OSError, ValueError) as e:
+                logger.warning("Could not start the password hashing pool, hashing inline: %s", e)
+                return None
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(operation, func, *args):
+    global _pending
+    if not _slots.acquire(timeout=PASSWORD_HASH_QUEUE_TIMEOUT):
+        metrics.inc('password_hash_rejected_total', operation=operation)
+        raise HashingBusy()
+    with _pending_lock:
+        _pending += 1
+        depth = _pending
+    metrics.observe('password_hash_queue_depth', depth)
+    started_at = time.perf_counter()
+    try:
+        pool = _get_pool()
+        if pool is None:
+            return func(*args)
+        try:
+            return pool.submit(func, *args).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool for later calls, hash this one inline
+            logger.warning("Password hashing pool broke, restarting it")
+            _reset_pool(pool)
+            return func(*args)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+        _slots.release()
+        metrics.observe('password_hash_seconds', time.perf_counter() - started_at, operation=operation)
+
+
+def hash_password(password):
+    """Hash with PASSWORD_HASH_METHOD; raises HashingBusy when the pool is saturated"""
+    return _run('hash', generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    """check_password_hash in the pool; raises HashingBusy when the pool is saturated"""
+    return _run('verify', check_password_hash, password_hash, password)
+
+
+def start():
+    """Start this worker's pool, which works out the current hash parameters off the request path"""
+    global _current_prefix
+    if _get_pool() is None and _current_prefix is None:
+        _current_prefix = _method_prefix(PASSWORD_HASH_METHOD)
+
+
+def needs_rehash(password_hash):
+    """
+    True if the stored hash was made with other parameters than
+    PASSWORD_HASH_METHOD. False while the pool is still working them out;
+    the hash is then upgraded on a later login.
+    """
+    global _current_prefix, _prefix_future
+    if _current_prefix is None:
+        future = _prefix_future
+        if future is None:
+            # Inline hashing (PASSWORD_HASH_WORKERS=0) without start()
+            if _get_pool() is not None:
+                return False
+            _current_prefix = _method_prefix(PASSWORD_HASH_METHOD)
+        elif not future.done():
+            return False
+        else:
+            try:
+                _current_prefix = future.result()
+            except Exception as e:
+                logger.warning("Could not work out the current password hash parameters: %s", e)
+                _prefix_future = None
+                return False
+    return password_hash.split('$', 1)[0] != _current_prefix
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,227 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from itsdangerous import BadSignature, URLSafeSerializer
+
+logger = logging.getLogger(__name__)
+
+# On-demand request profiling for production.
+# A request is profiled when it carries a token signed for an admin (header
+# X-Profile-Token or query parameter _profile), or when it is picked by the
+# PROFILE_SAMPLE_RATE random sample. The profiler covers the handler on the
+# request thread: cProfile (saved as .prof, readable with pstats/snakeviz) or
+# a stack sampler (saved as collapsed stacks for flamegraph.pl/speedscope).
+# Profiles go to PROFILE_DIR, shared by the workers; the oldest are pruned.
+# tracemalloc snapshots are per worker process.
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/face_animation_profiles')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '50'))
+PROFILE_TOKEN_TTL = int(os.getenv('PROFILE_TOKEN_TTL', '900'))
+# Stack sampler interval for mode 'sample'
+SAMPLE_INTERVAL_SECONDS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5')) / 1000
+
+MODES = ('cprofile', 'sample')
+PROFILE_NAME_PATTERN = re.compile(r'^[\w.-]+\.(prof|collapsed)$')
+
+# cProfile can only be enabled once per process at a time (from 3.12 it runs on
+# interpreter-wide sys.monitoring); concurrent profiled requests use the sampler
+_cprofile_lock = threading.Lock()
+_tracemalloc_lock = threading.Lock()
+_last_snapshot = None
+
+
+def _serializer(secret):
+    return URLSafeSerializer(secret, salt='request-profile')
+
+
+def make_token(secret, mode='cprofile', ttl=PROFILE_TOKEN_TTL):
+    """Signed token that turns profiling on for requests carrying it, for ttl seconds"""
+    if mode not in MODES:
+        raise ValueError(f"Unknown profiler mode: {mode}")
+    return _serializer(secret).dumps({'mode': mode, 'exp': int(time.time()) + ttl})
+
+
+def check_token(secret, token):
+    """Profiler mode for a valid, unexpired token; None otherwise"""
+    try:
+        payload = _serializer(secret).loads(token)
+    except BadSignature:
+        return None
+    if not isinstance(payload, dict) or payload.get('exp', 0) < time.time() or payload.get('mode') not in MODES:
+        return None
+    return payload['mode']
+
+
+def should_sample():
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+class StackSampler:
+    """Samples one thread's stack every interval from a helper thread; counts collapsed stacks"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfile:
+    """A running profile of the current thread"""
+
+    def __init__(self, mode):
+        if mode == 'cprofile' and not _cprofile_lock.acquire(blocking=False):
+            mode = 'sample'
+        self.mode = mode
+        self.started_at = time.time()
+        self._stopped = False
+        if mode == 'sample':
+            self._profiler = StackSampler(threading.get_ident())
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        if self.mode == 'sample':
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+            _cprofile_lock.release()
+
+    def save(self, label):
+        """Write the profile to PROFILE_DIR; returns its file name"""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        safe_label = re.sub(r'[^\w.-]+', '_', label)[:80]
+        extension = 'collapsed' if self.mode == 'sample' else 'prof'
+        name = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(self.started_at))}_{safe_label}.{extension}"
+        path = os.path.join(PROFILE_DIR, name)
+        if self.mode == 'sample':
+            with open(path, 'w') as f:
+                f.write(self._profiler.collapsed())
+        else:
+            self._profiler.dump_stats(path)
+        _prune()
+        return name
+
+
+def start(mode):
+    return RequestProfile(mode)
+
+
+def _prune():
+    try:
+        names = sorted(name for name in os.listdir(PROFILE_DIR) if PROFILE_NAME_PATTERN.match(name))
+    except FileNotFoundError:
+        return
+    for name in names[:-PROFILE_MAX_FILES] if PROFILE_MAX_FILES > 0 else []:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError as e:
+            logger.warning("Could not remove old profile %s: %s", name, e)
+
+
+def list_profiles():
+    """Saved profiles, newest first"""
+    try:
+        names = [name for name in os.listdir(PROFILE_DIR) if PROFILE_NAME_PATTERN.match(name)]
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in sorted(names, reverse=True):
+        stat = os.stat(os.path.join(PROFILE_DIR, name))
+        profiles.append({'name': name, 'size': stat.st_size, 'created_at': stat.st_mtime})
+    return profiles
+
+
+def profile_path(name):
+    """Full path of a saved profile, or None if the name is invalid or missing"""
+    if not PROFILE_NAME_PATTERN.match(name):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def pstats_text(path, sort='cumulative', limit=50):
+    """Top functions of a cProfile dump as text"""
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+def tracemalloc_start(frames=10):
+    with _tracemalloc_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+
+def tracemalloc_stop():
+    global _last_snapshot
+    with _tracemalloc_lock:
+        tracemalloc.stop()
+        _last_snapshot = None
+
+
+def tracemalloc_report(limit=25):
+    """
+    Top allocation sites of this process, and the growth per site since the
+    previous report (the first report only has the top sites).
+    """
+    global _last_snapshot
+    with _tracemalloc_lock:
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        previous, _last_snapshot = _last_snapshot, snapshot
+    current, peak = tracemalloc.get_traced_memory()
+    report = {
+        'pid': os.getpid(),
+        'traced_bytes': current,
+        'peak_bytes': peak,
+        'top': [{'site': str(stat.traceback[0]), 'size': stat.size, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:limit]],
+        'growth': None
+    }
+    if previous is not None:
+        report['growth'] = [{'site': str(stat.traceback[0]), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff}
+                            for stat in snapshot.compare_to(previous, 'lineno')[:limit]]
+    return report
@@ -0,0 +1,155 @@
+import logging
+import os
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _limit(name, default):
+    value = os.getenv(name, default)
+    return int(value) if value else None
+
+
+# Per-role storage limits; None means unlimited
+PLAN_LIMITS = {
+    'user': {
+        'max_animations': _limit('QUOTA_USER_MAX_ANIMATIONS', '50'),
+        'max_bytes': _limit('QUOTA_USER_MAX_BYTES', str(200 * 1024 * 1024))
+    },
+    'subscriber': {
+        'max_animations': _limit('QUOTA_SUBSCRIBER_MAX_ANIMATIONS', '2000'),
+        'max_bytes': _limit('QUOTA_SUBSCRIBER_MAX_BYTES', str(10 * 1024 * 1024 * 1024))
+    },
+    'admin': {
+        'max_animations': None,
+        'max_bytes': None
+    }
+}
+
+
+class QuotaExceeded(Exception):
+    """Raised when a save would take a user past their plan's storage limits"""
+    pass
+
+
+def _limits_for(role):
+    return PLAN_LIMITS.get(role, PLAN_LIMITS['user'])
+
+
+def check_quota(cursor, user_id, role, incoming_bytes=0):
+    """
+    Cheap pre-flight check before accepting an upload: a single primary-key
+    lookup of the user's counters, against the limits of role (the same role
+    later passed to reserve). Raises QuotaExceeded.
+    """
+    cursor.execute(
+        "SELECT animation_count, storage_bytes FROM users WHERE user_id = %s",
+        (user_id,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return
+    animation_count, storage_bytes = (row['animation_count'], row['storage_bytes']) if isinstance(row, dict) else row
+    limits = _limits_for(role)
+    if limits['max_animations'] is not None and animation_count >= limits['max_animations']:
+        metrics.inc('quota_rejections_total', reason='animations')
+        raise QuotaExceeded(f"You have reached your limit of {limits['max_animations']} saved items. "
+                            "Delete some items to save new ones.")
+    if limits['max_bytes'] is not None and storage_bytes + incoming_bytes > limits['max_bytes']:
+        metrics.inc('quota_rejections_total', reason='bytes')
+        raise QuotaExceeded(f"This would exceed your storage limit of {limits['max_bytes'] // (1024 * 1024)} MB. "
+                            "Delete some items to free up space.")
+
+
+def reserve(cursor, user_id, role, file_size):
+    """
+    Atomically add one file of file_size bytes to the user's counters if it fits
+    their plan. Runs inside the caller's transaction. Raises QuotaExceeded.
+    """
+    limits = _limits_for(role)
+    max_animations = limits['max_animations']
+    max_bytes = limits['max_bytes']
+    cursor.execute(
+        """UPDATE users
+           SET animation_count = animation_count + 1, storage_bytes = storage_bytes + %s
+           WHERE user_id = %s
+             AND (%s IS NULL OR animation_count < %s)
+             AND (%s IS NULL OR storage_bytes + %s <= %s)""",
+        (file_size, user_id, max_animations, max_animations, max_bytes, file_size, max_bytes)
+    )
+    if cursor.rowcount == 0:
+        metrics.inc('quota_rejections_total', reason='reserve')
+        raise QuotaExceeded("Saving this item would exceed your storage quota. "
+                            "Delete some items to free up space.")
+
+
+def release(cursor, user_id, file_size):
+    """Remove one file of file_size bytes from the user's counters (inside the caller's transaction)"""
+    cursor.execute(
+        """UPDATE users
+           SET animation_count = GREATEST(animation_count - 1, 0),
+               storage_bytes = GREATEST(storage_bytes - %s, 0)
+           WHERE user_id = %s""",
+        (file_size or 0, user_id)
+    )
+
+
+def reconcile_usage(db, static_root, batch_size=1000):
+    """
+    Periodic correction of the denormalized counters.
+    Back-fills animations.file_size for rows saved before sizes were
+    recorded, then recomputes animation_count/storage_bytes per user range.
+    Returns the number of users whose counters changed.
+    """
+    cursor = db.cursor()
+    corrected = 0
+    try:
+        # Back-fill missing sizes from disk
+        while True:
+            cursor.execute(
+                "SELECT animation_id, animation_path FROM animations WHERE file_size IS NULL LIMIT %s",
+                (batch_size,)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            sizes = []
+            for animation_id, animation_path in rows:
+                try:
+                    size = os.path.getsize(os.path.join(static_root, animation_path))
+                except OSError:
+                    size = 0
+                sizes.append((size, animation_id))
+            cursor.executemany("UPDATE animations SET file_size = %s WHERE animation_id = %s", sizes)
+            db.commit()
+            if len(rows) < batch_size:
+                break
+
+        # Recompute counters one user-id range at a time
+        cursor.execute("SELECT COALESCE(MAX(user_id), 0) FROM users")
+        max_user_id = cursor.fetchone()[0]
+        for low in range(0, max_user_id + 1, batch_size):
+            high = low + batch_size - 1
+            cursor.execute(
+                """UPDATE users u
+                   LEFT JOIN (
+                       SELECT user_id, COUNT(*) AS item_count, COALESCE(SUM(file_size), 0) AS total_bytes
+                       FROM animations WHERE user_id BETWEEN %s AND %s
+                       GROUP BY user_id
+                   ) a ON a.user_id = u.user_id
+                   SET u.animation_count = COALESCE(a.item_count, 0),
+                       u.storage_bytes = COALESCE(a.total_bytes, 0)
+                   WHERE u.user_id BETWEEN %s AND %s
+                     AND (u.animation_count <> COALESCE(a.item_count, 0)
+                          OR u.storage_bytes <> COALESCE(a.total_bytes, 0))""",
+                (low, high, low, high)
+            )
+            corrected += cursor.rowcount
+            db.commit()
+    finally:
+        cursor.close()
+
+    if corrected:
+        metrics.inc('quota_counters_corrected_total', corrected)
+        logger.info("Quota reconcile: corrected counters for %s user(s)", corrected)
+    return corrected
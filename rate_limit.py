@@ -0,0 +1,172 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Admission control for expensive endpoints.
+# Every policy has a token bucket per caller (user id, or client address for
+# logins), an optional global token bucket, and an optional cap on a
+# caller's concurrent requests. Active subscribers get larger per-user
+# buckets and may use the part of the global bucket held back for them
+# (subscriber_reserve); free users are turned away once only the reserve is
+# left. State lives in a small SQLite file (RATE_LIMIT_DB) that the gunicorn
+# workers on a host share, so limits hold across workers; gunicorn.conf.py
+# clears it on start and drops a dead worker's running jobs. If the state
+# file can't be used, requests are let through.
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', '/tmp/face_animation_rate_limits.sqlite3')
+# A concurrency slot is given up after this long even if its request never finished
+JOB_LEASE_SECONDS = int(os.getenv('RATE_LIMIT_JOB_LEASE_SECONDS', '900'))
+# Retry-After for requests over their concurrency cap
+CONCURRENCY_RETRY_AFTER = int(os.getenv('RATE_LIMIT_CONCURRENCY_RETRY_AFTER', '10'))
+
+# Buckets are (burst, per_minute). *_concurrent: None means unlimited.
+POLICIES = {
+    # Model backend calls (FOMD, MakeItTalk, face swap)
+    'animate': {
+        'user': (3, 6), 'subscriber': (10, 30),
+        'global': (int(os.getenv('RATE_LIMIT_ANIMATE_GLOBAL_BURST', '40')),
+                   int(os.getenv('RATE_LIMIT_ANIMATE_GLOBAL_PER_MINUTE', '120'))),
+        'subscriber_reserve': 0.25,
+        'user_concurrent': 1, 'subscriber_concurrent': 2,
+    },
+    # Result uploads
+    'save': {
+        'user': (10, 30), 'subscriber': (30, 120),
+        'global': None, 'subscriber_reserve': 0,
+        'user_concurrent': 2, 'subscriber_concurrent': 4,
+    },
+    # Per client address; password hashing has its own admission control
+    'login': {
+        'user': (10, 20), 'subscriber': (10, 20),
+        'global': None, 'subscriber_reserve': 0,
+        'user_concurrent': None, 'subscriber_concurrent': None,
+    },
+}
+
+_local = threading.local()
+
+
+class RateLimited(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(int(retry_after + 0.999), 1)
+
+
+def _connect():
+    """This thread's connection to the state file (reopened after a fork)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(RATE_LIMIT_DB, timeout=5, isolation_level=None)
+    # The state is disposable: no need to survive a crash, only to be fast
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("CREATE TABLE IF NOT EXISTS buckets (bucket TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS jobs (job_id INTEGER PRIMARY KEY, caller TEXT NOT NULL,
+                                                     pid INTEGER NOT NULL, started_at REAL NOT NULL)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_caller ON jobs(caller)")
+    _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def _bucket_tokens(conn, bucket, burst, per_minute, now):
+    row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE bucket = ?", (bucket,)).fetchone()
+    if row is None:
+        return float(burst)
+    tokens, updated_at = row
+    return min(float(burst), tokens + max(now - updated_at, 0) * per_minute / 60)
+
+
+def admit(policy_name, caller, subscriber=False):
+    """
+    Take a token for caller (and from the global bucket) and a concurrency slot.
+    Returns a job id to pass to release(), or None if no slot is held.
+    Raises RateLimited with the seconds to wait.
+    """
+    if not RATE_LIMIT_ENABLED:
+        return None
+    policy = POLICIES[policy_name]
+    burst, per_minute = policy['subscriber' if subscriber else 'user']
+    max_concurrent = policy['subscriber_concurrent' if subscriber else 'user_concurrent']
+    caller_key = f"{policy_name}:{caller}"
+    now = time.time()
+    try:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens = _bucket_tokens(conn, caller_key, burst, per_minute, now)
+            if tokens < 1:
+                metrics.inc('rate_limited_total', policy=policy_name, reason='caller')
+                raise RateLimited('Too many requests. Please slow down.', (1 - tokens) * 60 / per_minute)
+
+            global_tokens = None
+            if policy['global']:
+                global_burst, global_per_minute = policy['global']
+                global_key = f"{policy_name}:*"
+                global_tokens = _bucket_tokens(conn, global_key, global_burst, global_per_minute, now)
+                # Free users can't dip into the share held back for subscribers
+                floor = 0 if subscriber else policy['subscriber_reserve'] * global_burst
+                if global_tokens - 1 < floor:
+                    metrics.inc('rate_limited_total', policy=policy_name, reason='global')
+                    raise RateLimited('The service is busy. Please try again shortly.',
+                                      (floor + 1 - global_tokens) * 60 / global_per_minute)
+
+            job_id = None
+            if max_concurrent is not None:
+                conn.execute("DELETE FROM jobs WHERE started_at < ?", (now - JOB_LEASE_SECONDS,))
+                running = conn.execute("SELECT COUNT(*) FROM jobs WHERE caller = ?", (caller_key,)).fetchone()[0]
+                if running >= max_concurrent:
+                    metrics.inc('rate_limited_total', policy=policy_name, reason='concurrency')
+                    raise RateLimited('You already have a request in progress. Please wait for it to finish.',
+                                      CONCURRENCY_RETRY_AFTER)
+                job_id = conn.execute("INSERT INTO jobs (caller, pid, started_at) VALUES (?, ?, ?)",
+                                      (caller_key, os.getpid(), now)).lastrowid
+
+            conn.execute("INSERT OR REPLACE INTO buckets (bucket, tokens, updated_at) VALUES (?, ?, ?)",
+                         (caller_key, tokens - 1, now))
+            if global_tokens is not None:
+                conn.execute("INSERT OR REPLACE INTO buckets (bucket, tokens, updated_at) VALUES (?, ?, ?)",
+                             (global_key, global_tokens - 1, now))
+            conn.execute("COMMIT")
+            return job_id
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        logger.warning("Rate limit state unavailable, letting request through: %s", e)
+        metrics.inc('rate_limit_errors_total')
+        return None
+
+
+def release(job_id):
+    """Give back the concurrency slot taken by admit()"""
+    if job_id is None:
+        return
+    try:
+        _connect().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+    except sqlite3.Error as e:
+        logger.warning("Could not release rate limit slot %s: %s", job_id, e)
+
+
+def release_process(pid):
+    """Drop the slots held by a worker process that exited"""
+    try:
+        _connect().execute("DELETE FROM jobs WHERE pid = ?", (pid,))
+    except sqlite3.Error as e:
+        logger.warning("Could not release rate limit slots of process %s: %s", pid, e)
+
+
+def reset():
+    """Remove all state (on server start)"""
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(RATE_LIMIT_DB + suffix)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,212 @@
+import gzip
+import logging
+import os
+import shutil
+import threading
+import uuid
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Tiered retention for generated files.
+# Files nobody has looked at for a while are moved from static/animations to
+# a cheaper archive tier and restored on their next access. Access times are
+# buffered in memory and written to animations.last_accessed_at in batches.
+
+# Optional S3-compatible archive tier
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+
+class LocalArchiveTier:
+    """Archive tier backed by gzip-compressed files in a local directory outside static/"""
+
+    def __init__(self, root, compresslevel=6):
+        self.root = root
+        self.compresslevel = compresslevel
+
+    def _path(self, key):
+        return os.path.join(self.root, key + '.gz')
+
+    def archive(self, source_path, key):
+        destination = self._path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temp_path = f"{destination}.{uuid.uuid4().hex}.tmp"
+        with open(source_path, 'rb') as src, gzip.open(temp_path, 'wb', compresslevel=self.compresslevel) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(temp_path, destination)
+
+    def restore(self, key, destination_path):
+        with gzip.open(self._path(key), 'rb') as src, open(destination_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3ArchiveTier:
+    """Archive tier backed by an S3-compatible bucket (AWS, MinIO, R2, ...)"""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def archive(self, source_path, key):
+        self.client.upload_file(source_path, self.bucket, self.prefix + key,
+                                ExtraArgs={'StorageClass': os.getenv('ARCHIVE_S3_STORAGE_CLASS', 'STANDARD_IA')})
+
+    def restore(self, key, destination_path):
+        self.client.download_file(self.bucket, self.prefix + key, destination_path)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+
+def tier_from_env():
+    """Archive tier configured by ARCHIVE_S3_BUCKET (if boto3 is installed) or ARCHIVE_FOLDER"""
+    bucket = os.getenv('ARCHIVE_S3_BUCKET')
+    if bucket:
+        if boto3 is None:
+            logger.warning("ARCHIVE_S3_BUCKET is set but boto3 is not installed; using local archive folder")
+        else:
+            return S3ArchiveTier(bucket, os.getenv('ARCHIVE_S3_PREFIX', ''), os.getenv('ARCHIVE_S3_ENDPOINT_URL'))
+    return LocalArchiveTier(os.getenv('ARCHIVE_FOLDER', 'archive'))
+
+
+class AccessRecorder:
+    """Buffers animation accesses in memory; flush() writes them in one UPDATE per batch"""
+
+    def __init__(self):
+        self._paths = set()
+        self._lock = threading.Lock()
+
+    def record(self, animation_path):
+        with self._lock:
+            self._paths.add(animation_path)
+
+    def flush(self, db, batch_size=500):
+        with self._lock:
+            paths, self._paths = list(self._paths), set()
+        if not paths:
+            return 0
+        cursor = db.cursor()
+        try:
+            for i in range(0, len(paths), batch_size):
+                batch = paths[i:i + batch_size]
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(
+                    f"UPDATE animations SET last_accessed_at = NOW() WHERE animation_path IN ({placeholders})",
+                    batch
+                )
+            db.commit()
+        finally:
+            cursor.close()
+        metrics.inc('retention_accesses_flushed_total', len(paths))
+        return len(paths)
+
+
+def archive_cold_animations(db, static_root, tier, min_age_days=30, min_size_bytes=0, batch_size=100):
+    """
+    Move animations not accessed for min_age_days (and at least min_size_bytes)
+    to the archive tier. The archive copy is written and the row marked
+    'archived' before the local file is removed. Returns the number archived.
+    """
+    archived = 0
+    cursor = db.cursor()
+    try:
+        while True:
+            cursor.execute(
+                """SELECT animation_id, animation_path FROM animations
+                   WHERE storage_tier = 'hot' AND status = 'completed'
+                     AND last_accessed_at < NOW() - INTERVAL %s DAY
+                     AND COALESCE(file_size, 0) >= %s
+                   ORDER BY animation_id
+                   LIMIT %s""",
+                (min_age_days, min_size_bytes, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            moved = []
+            for animation_id, animation_path in rows:
+                full_path = os.path.join(static_root, animation_path)
+                try:
+                    tier.archive(full_path, animation_path)
+                    moved.append((animation_id, full_path))
+                except FileNotFoundError:
+                    # Nothing on disk to archive; leave it for the reconcile/cleanup jobs
+                    moved.append((animation_id, None))
+                except Exception as e:
+                    logger.warning("Retention: could not archive %s: %s", animation_path, e)
+
+            if moved:
+                placeholders = ', '.join(['%s'] * len(moved))
+                cursor.execute(
+                    f"UPDATE animations SET storage_tier = 'archived' WHERE animation_id IN ({placeholders})",
+                    [animation_id for animation_id, _ in moved]
+                )
+                db.commit()
+                for _, full_path in moved:
+                    if full_path:
+                        try:
+                            os.remove(full_path)
+                        except FileNotFoundError:
+                            pass
+                archived += len(moved)
+
+            if len(rows) < batch_size or not moved:
+                break
+    finally:
+        cursor.close()
+
+    if archived:
+        metrics.inc('retention_archived_total', archived)
+        logger.info("Retention: archived %s cold animation(s)", archived)
+    return archived
+
+
+_restore_lock = threading.Lock()
+
+
+def restore_animation(db, static_root, tier, animation_path):
+    """
+    Bring an archived animation back to the hot tier.
+    Returns the local path, or None if no archived animation has that path.
+    """
+    cursor = db.cursor()
+    try:
+        cursor.execute(
+            "SELECT animation_id FROM animations WHERE animation_path = %s AND storage_tier = 'archived'",
+            (animation_path,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+
+        full_path = os.path.join(static_root, animation_path)
+        # Serialize restores in this process so concurrent requests don't fetch the same file twice
+        with _restore_lock:
+            if not os.path.exists(full_path):
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                temp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+                with metrics.timed('retention_restore_seconds'):
+                    tier.restore(animation_path, temp_path)
+                os.replace(temp_path, full_path)
+
+        cursor.execute(
+            "UPDATE animations SET storage_tier = 'hot', last_accessed_at = NOW() WHERE animation_id = %s",
+            (row[0],)
+        )
+        db.commit()
+        tier.delete(animation_path)
+        metrics.inc('retention_restored_total')
+        return full_path
+    finally:
+        cursor.close()
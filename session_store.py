@@ -0,0 +1,303 @@
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from flask import has_request_context, session as current_session
+from flask.sessions import SecureCookieSession, SessionInterface
+from flask.json.tag import TaggedJSONSerializer
+
+logger = logging.getLogger(__name__)
+
+# Optional server-side sessions.
+# With SESSION_BACKEND=local (a SQLite file shared by the workers on one host)
+# or SESSION_BACKEND=db (the user_sessions table in MySQL) the session cookie
+# only carries a random session id and the session data stays on the server.
+# The default, 'cookie', keeps Flask's signed cookie sessions.
+#
+# The backend also keeps a versioned snapshot of each user's entitlement
+# ({role, subscription_status}). Anything that changes a user's role or status
+# bumps the user's version, which drops the snapshot; until then every worker
+# can trust the snapshot without reading the users table, for at most
+# ENTITLEMENT_SNAPSHOT_TTL seconds: if a bump fails, a stale snapshot is not
+# trusted for longer than the per-process cache of cookie sessions
+# (ENTITLEMENT_CACHE_TTL in app.py). The snapshot of the session's own user is
+# read together with the session.
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'cookie')
+SESSION_LOCAL_DB = os.getenv('SESSION_LOCAL_DB', '/tmp/face_animation_sessions.sqlite3')
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{43}$')
+ENTITLEMENT_SNAPSHOT_TTL = int(os.getenv('ENTITLEMENT_SNAPSHOT_TTL', '30'))
+
+_backend = None
+_serializer = TaggedJSONSerializer()
+
+
+class ServerSession(SecureCookieSession):
+    """Session data loaded from the backend, with its id and the user's entitlement snapshot"""
+
+    def __init__(self, initial=None, sid=None, expires_at=None, entitlement=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.new = sid is None
+        self.expires_at = expires_at
+        self.loaded_user_id = self.get('user_id')
+        # (version, snapshot or None) for entitlement_user_id
+        self.entitlement_user_id = self.loaded_user_id
+        self.entitlement = entitlement
+
+
+class SqliteBackend:
+    """Sessions and entitlement snapshots in a SQLite file shared by this host's workers"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, user_id INTEGER,
+                                                             data TEXT NOT NULL, expires_at REAL NOT NULL)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS entitlements (user_id INTEGER PRIMARY KEY, version INTEGER NOT NULL,
+                                                                 role TEXT, subscription_status TEXT, cached_at REAL)""")
+        if 'cached_at' not in [column[1] for column in conn.execute("PRAGMA table_info(entitlements)")]:
+            # State file from before snapshots expired
+            try:
+                conn.execute("ALTER TABLE entitlements ADD COLUMN cached_at REAL")
+            except sqlite3.OperationalError:
+                pass
+        self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def load(self, sid):
+        row = self._connect().execute(
+            """SELECT s.data, s.expires_at, s.user_id, e.version, e.role, e.subscription_status, e.cached_at
+               FROM sessions s LEFT JOIN entitlements e ON e.user_id = s.user_id
+               WHERE s.session_id = ? AND s.expires_at > ?""", (sid, time.time())).fetchone()
+        return _session_record(row)
+
+    def save(self, sid, user_id, data, expires_at):
+        self._connect().execute("INSERT OR REPLACE INTO sessions (session_id, user_id, data, expires_at) VALUES (?, ?, ?, ?)",
+                                (sid, user_id, data, expires_at))
+
+    def delete(self, sid):
+        self._connect().execute("DELETE FROM sessions WHERE session_id = ?", (sid,))
+
+    def purge_expired(self):
+        return self._connect().execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def get_entitlement(self, user_id):
+        row = self._connect().execute("SELECT version, role, subscription_status, cached_at FROM entitlements WHERE user_id = ?",
+                                      (user_id,)).fetchone()
+        return _entitlement(row)
+
+    def put_entitlement(self, user_id, version, snapshot):
+        # Not stored if the version was bumped since it was read
+        self._connect().execute(
+            """INSERT INTO entitlements (user_id, version, role, subscription_status, cached_at) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET role = excluded.role, subscription_status = excluded.subscription_status,
+                                                  cached_at = excluded.cached_at
+               WHERE entitlements.version = excluded.version""",
+            (user_id, version, snapshot['role'], snapshot['subscription_status'], time.time()))
+
+    def bump_entitlement(self, user_id):
+        self._connect().execute(
+            """INSERT INTO entitlements (user_id, version) VALUES (?, 1)
+               ON CONFLICT(user_id) DO UPDATE SET version = version + 1, role = NULL, subscription_status = NULL,
+                                                  cached_at = NULL""",
+            (user_id,))
+
+
+class MySQLBackend:
+    """Sessions and entitlement snapshots in the user_sessions and user_entitlements tables"""
+
+    def __init__(self, get_db):
+        self.get_db = get_db
+
+    def _execute(self, query, params, fetch=False):
+        db = self.get_db()
+        cursor = db.cursor()
+        try:
+            cursor.execute(query, params)
+            if fetch:
+                return cursor.fetchone()
+            db.commit()
+            return cursor.rowcount
+        finally:
+            cursor.close()
+            db.close()
+
+    def load(self, sid):
+        row = self._execute(
+            """SELECT s.data, UNIX_TIMESTAMP(s.expires_at), s.user_id, e.version, e.role, e.subscription_status,
+                      UNIX_TIMESTAMP(e.cached_at)
+               FROM user_sessions s LEFT JOIN user_entitlements e ON e.user_id = s.user_id
+               WHERE s.session_id = %s AND s.expires_at > NOW()""", (sid,), fetch=True)
+        return _session_record(row)
+
+    def save(self, sid, user_id, data, expires_at):
+        self._execute(
+            """INSERT INTO user_sessions (session_id, user_id, data, expires_at) VALUES (%s, %s, %s, FROM_UNIXTIME(%s))
+               ON DUPLICATE KEY UPDATE user_id = VALUES(user_id), data = VALUES(data), expires_at = VALUES(expires_at)""",
+            (sid, user_id, data, int(expires_at)))
+
+    def delete(self, sid):
+        self._execute("DELETE FROM user_sessions WHERE session_id = %s", (sid,))
+
+    def purge_expired(self):
+        return self._execute("DELETE FROM user_sessions WHERE expires_at <= NOW()", ())
+
+    def get_entitlement(self, user_id):
+        row = self._execute("""SELECT version, role, subscription_status, UNIX_TIMESTAMP(cached_at)
+                               FROM user_entitlements WHERE user_id = %s""", (user_id,), fetch=True)
+        return _entitlement(row)
+
+    def put_entitlement(self, user_id, version, snapshot):
+        # Not stored if the version was bumped since it was read
+        self._execute(
+            """INSERT INTO user_entitlements (user_id, version, role, subscription_status, cached_at)
+               VALUES (%s, %s, %s, %s, NOW())
+               ON DUPLICATE KEY UPDATE
+                   role = IF(version = VALUES(version), VALUES(role), role),
+                   subscription_status = IF(version = VALUES(version), VALUES(subscription_status), subscription_status),
+                   cached_at = IF(version = VALUES(version), VALUES(cached_at), cached_at)""",
+            (user_id, version, snapshot['role'], snapshot['subscription_status']))
+
+    def bump_entitlement(self, user_id):
+        self._execute(
+            """INSERT INTO user_entitlements (user_id, version) VALUES (%s, 1)
+               ON DUPLICATE KEY UPDATE version = version + 1, role = NULL, subscription_status = NULL, cached_at = NULL""",
+            (user_id,))
+
+
+def _entitlement(row):
+    """
+    (version, snapshot or None) from a version/role/status/cached_at row; a
+    missing row is version 0, and a snapshot older than ENTITLEMENT_SNAPSHOT_TTL is None
+    """
+    if row is None or row[0] is None:
+        return 0, None
+    version, role, subscription_status, cached_at = row
+    if role is None or cached_at is None or float(cached_at) < time.time() - ENTITLEMENT_SNAPSHOT_TTL:
+        return version, None
+    return version, {'role': role, 'subscription_status': subscription_status}
+
+
+def _session_record(row):
+    if row is None:
+        return None
+    data, expires_at, user_id, *entitlement = row
+    return _serializer.loads(data), float(expires_at), (_entitlement(entitlement) if user_id is not None else None)
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID_PATTERN.match(sid):
+            try:
+                record = self.backend.load(sid)
+            except Exception as e:
+                logger.warning("Could not load session: %s", e)
+                record = None
+            if record:
+                data, expires_at, entitlement = record
+                return ServerSession(data, sid=sid, expires_at=expires_at, entitlement=entitlement)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and session.sid:
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app), httponly=self.get_cookie_httponly(app))
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        # Only written when changed, or when more than half of its lifetime has passed
+        if not session.modified and session.sid and session.expires_at - now > lifetime / 2:
+            return
+
+        sid = session.sid
+        if sid is None or session.get('user_id') != session.loaded_user_id:
+            # New id whenever the session changes hands (login), against session fixation
+            if sid is not None:
+                self.backend.delete(sid)
+            sid = secrets.token_urlsafe(32)
+        self.backend.save(sid, session.get('user_id'), _serializer.dumps(dict(session)), now + lifetime)
+        response.set_cookie(name, sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+def init_app(app, get_db):
+    """Install the SESSION_BACKEND session interface on app; returns True if server-side sessions are on"""
+    global _backend
+    if SESSION_BACKEND == 'local':
+        _backend = SqliteBackend(SESSION_LOCAL_DB)
+    elif SESSION_BACKEND == 'db':
+        _backend = MySQLBackend(get_db)
+    else:
+        if SESSION_BACKEND != 'cookie':
+            logger.warning("Unknown SESSION_BACKEND %r, using cookie sessions", SESSION_BACKEND)
+        return False
+    app.session_interface = ServerSessionInterface(_backend)
+    return True
+
+
+def enabled():
+    return _backend is not None
+
+
+def _session_for(user_id):
+    """The current request's server session, if it belongs to user_id"""
+    if has_request_context() and isinstance(current_session, ServerSession) and current_session.get('user_id') == user_id:
+        return current_session
+    return None
+
+
+def get_entitlement(user_id):
+    """(version, snapshot or None) for user_id; None snapshot means it has to be loaded from users"""
+    session = _session_for(user_id)
+    if session is not None and session.entitlement is not None and session.entitlement_user_id == user_id:
+        return session.entitlement
+    entitlement = _backend.get_entitlement(user_id)
+    if session is not None:
+        session.entitlement_user_id, session.entitlement = user_id, entitlement
+    return entitlement
+
+
+def put_entitlement(user_id, version, snapshot):
+    """Store the snapshot read from users at version (dropped if the version moved on meanwhile)"""
+    _backend.put_entitlement(user_id, version, snapshot)
+    session = _session_for(user_id)
+    if session is not None:
+        session.entitlement_user_id, session.entitlement = user_id, (version, snapshot)
+
+
+def bump_entitlement(user_id):
+    """Invalidate user_id's snapshot everywhere"""
+    _backend.bump_entitlement(user_id)
+    session = _session_for(user_id)
+    if session is not None:
+        session.entitlement = None
+
+
+def purge_expired():
+    return _backend.purge_expired()
@@ -102,7 +102,7 @@ if (window.location.pathname.includes('user.html') || window.location.pathname =
         if (profilePicture) {
           if (data.user.profile_picture) {
             // User has a profile picture - load it
-            const imageUrl = `/static/${data.user.profile_picture}?t=${Date.now()}`;
+            const imageUrl = data.user.profile_picture_url || `/static/${data.user.profile_picture}`;
             console.log('📸 Setting profile picture src to:', imageUrl);
             profilePicture.src = imageUrl;
             
@@ -562,7 +562,7 @@ if (window.location.pathname.includes('subscriber.html') || window.location.path
         if (profilePicture) {
           if (data.user.profile_picture) {
             // User has a profile picture - load it
-            const imageUrl = `/static/${data.user.profile_picture}?t=${Date.now()}`;
+            const imageUrl = data.user.profile_picture_url || `/static/${data.user.profile_picture}`;
             console.log('📸 Setting profile picture src to:', imageUrl);
             profilePicture.src = imageUrl;
             
@@ -896,7 +896,7 @@ if (window.location.pathname.includes('admin.html') || window.location.pathname
         if (profilePicture) {
           if (data.user.profile_picture) {
             // User has a profile picture - load it
-            const imageUrl = `/static/${data.user.profile_picture}?t=${Date.now()}`;
+            const imageUrl = data.user.profile_picture_url || `/static/${data.user.profile_picture}`;
             console.log('📸 Setting profile picture src to:', imageUrl);
             profilePicture.src = imageUrl;
             
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import re
+import time
+
+# Sharded on-disk layout for generated files.
+# Every file lives two hashed directory levels below its folder, e.g.
+#   animations/fomd/3f/a2/fomd_<uuid>.mp4
+#   uploads/profile_pictures/9c/01/<user_id>_<timestamp>.jpg
+# so no single directory grows past a few thousand entries.
+# Paths are relative to the static folder, the same form stored in the DB.
+
+
+def _shard(filename):
+    digest = hashlib.md5(filename.encode('utf-8')).hexdigest()
+    return digest[:2], digest[2:4]
+
+
+def sharded_relpath(folder, filename):
+    """Relative path of filename inside folder using the two-level hashed layout"""
+    first, second = _shard(filename)
+    return f"{folder}/{first}/{second}/{filename}"
+
+
+def animation_relpath(tool_type, filename):
+    return sharded_relpath(f"animations/{tool_type}", filename)
+
+
+def profile_picture_relpath(filename):
+    return sharded_relpath("uploads/profile_pictures", filename)
+
+
+def resolve_path(static_root, relative_path):
+    """Absolute path for a stored relative path, or None if it points outside static_root"""
+    root = os.path.realpath(static_root)
+    full_path = os.path.realpath(os.path.join(root, relative_path))
+    if not full_path.startswith(root + os.sep):
+        return None
+    return full_path
+
+
+def prepare_path(static_root, relative_path):
+    """Absolute path for a new file, creating its shard directories"""
+    full_path = os.path.join(static_root, relative_path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    return full_path
+
+
+# Legacy flat layout: animations/<tool>/<file> and uploads/profile_pictures/<file>
+_LEGACY_ANIMATION = re.compile(r'^(animations/[^/]+)/([^/]+)$')
+_LEGACY_PROFILE_PICTURE = re.compile(r'^(uploads/profile_pictures)/([^/]+)$')
+
+
+def _move(static_root, old_relative_path, new_relative_path):
+    """
+    Make the file available at its new location. Hard-links where possible
+    so the old URL keeps working until the DB row is updated.
+    Returns False if the file is missing from both locations.
+    """
+    source = os.path.join(static_root, old_relative_path)
+    destination = prepare_path(static_root, new_relative_path)
+    if os.path.exists(destination):
+        return True
+    if not os.path.exists(source):
+        return False
+    try:
+        os.link(source, destination)
+    except OSError:
+        os.replace(source, destination)
+    return True
+
+
+def _migrate_table(db, static_root, table, id_column, path_column, pattern, batch_size, pause_seconds):
+    migrated = 0
+    last_id = 0
+    cursor = db.cursor()
+    try:
+        while True:
+            cursor.execute(
+                f"""SELECT {id_column}, {path_column} FROM {table}
+                    WHERE {id_column} > %s AND {path_column} IS NOT NULL
+                    ORDER BY {id_column} LIMIT %s""",
+                (last_id, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            updates = []
+            for row_id, relative_path in rows:
+                match = pattern.match(relative_path)
+                if not match:
+                    continue
+                new_relative_path = sharded_relpath(match.group(1), match.group(2))
+                if _move(static_root, relative_path, new_relative_path):
+                    updates.append((new_relative_path, row_id, relative_path))
+
+            if updates:
+                cursor.executemany(
+                    f"UPDATE {table} SET {path_column} = %s WHERE {id_column} = %s AND {path_column} = %s",
+                    updates
+                )
+                db.commit()
+                # The DB now points at the new location; drop the old links
+                for new_relative_path, _, old_relative_path in updates:
+                    old_path = os.path.join(static_root, old_relative_path)
+                    if os.path.exists(old_path):
+                        os.remove(old_path)
+                migrated += len(updates)
+
+            if pause_seconds:
+                time.sleep(pause_seconds)
+    finally:
+        cursor.close()
+    return migrated
+
+
+def migrate_to_sharded_layout(db, static_root, batch_size=500, pause_seconds=0.1):
+    """
+    Move files stored in the legacy flat layout into shard directories and
+    rewrite animations.animation_path / users.profile_picture in batches.
+    Safe to re-run; rows already in the sharded layout are skipped.
+    """
+    animations = _migrate_table(db, static_root, 'animations', 'animation_id', 'animation_path',
+                                _LEGACY_ANIMATION, batch_size, pause_seconds)
+    profile_pictures = _migrate_table(db, static_root, 'users', 'user_id', 'profile_picture',
+                                      _LEGACY_PROFILE_PICTURE, batch_size, pause_seconds)
+    return {'animations': animations, 'profile_pictures': profile_pictures}
@@ -0,0 +1,88 @@
+import os
+import time
+import stripe
+import metrics
+from cache import TTLCache
+
+# How long Stripe objects stay cached (seconds).
+# Paid checkout sessions never change again, so they can be kept for a while;
+# unpaid ones are negatively cached only briefly so the success page polling
+# picks up the payment quickly.
+PAID_SESSION_TTL = int(os.getenv('STRIPE_PAID_SESSION_TTL', '600'))
+UNPAID_SESSION_TTL = int(os.getenv('STRIPE_UNPAID_SESSION_TTL', '5'))
+SUBSCRIPTION_TTL = int(os.getenv('STRIPE_SUBSCRIPTION_TTL', '300'))
+
+_cache = TTLCache(max_entries=2048)
+
+
+def metadata_value(stripe_object, key, default=None):
+    """A metadata entry of a Stripe object (StripeObject isn't a dict in newer stripe releases)"""
+    metadata = stripe_object['metadata']
+    if metadata and key in metadata:
+        return metadata[key]
+    return default
+
+
+def _call(operation, fn, *args, **kwargs):
+    """Call the Stripe API, recording latency, outcome and rate-limit counters"""
+    start = time.perf_counter()
+    outcome = 'ok'
+    try:
+        return fn(*args, **kwargs)
+    except stripe.error.RateLimitError:
+        outcome = 'rate_limited'
+        metrics.inc('stripe_rate_limited_total', operation=operation)
+        raise
+    except stripe.error.StripeError:
+        outcome = 'error'
+        raise
+    finally:
+        metrics.inc('stripe_requests_total', operation=operation, outcome=outcome)
+        metrics.observe('stripe_request_seconds', time.perf_counter() - start, operation=operation)
+
+
+def retrieve_checkout_session(session_id):
+    """Retrieve a checkout session, served from cache when possible"""
+    key = ('checkout_session', session_id)
+    checkout_session = _cache.get(key)
+    if checkout_session is not None:
+        metrics.inc('stripe_cache_hits_total', object='checkout_session')
+        return checkout_session
+
+    metrics.inc('stripe_cache_misses_total', object='checkout_session')
+    checkout_session = _call('checkout.Session.retrieve', stripe.checkout.Session.retrieve, session_id)
+    ttl = PAID_SESSION_TTL if checkout_session.payment_status == 'paid' else UNPAID_SESSION_TTL
+    _cache.set(key, checkout_session, ttl)
+    return checkout_session
+
+
+def cancel_subscription_at_period_end(subscription_id):
+    """
+    Mark a subscription to cancel at period end.
+    Repeated cancel requests for a subscription we already know is canceling
+    are answered from cache without another Stripe call.
+    """
+    key = ('subscription', subscription_id)
+    subscription = _cache.get(key)
+    if subscription is not None and subscription.get('cancel_at_period_end'):
+        metrics.inc('stripe_cache_hits_total', object='subscription')
+        return subscription
+
+    metrics.inc('stripe_cache_misses_total', object='subscription')
+    subscription = _call('Subscription.modify', stripe.Subscription.modify,
+                         subscription_id, cancel_at_period_end=True)
+    _cache.set(key, subscription, SUBSCRIPTION_TTL)
+    return subscription
+
+
+def invalidate_subscription(subscription_id):
+    """Forget a cached subscription (call when a webhook reports it changed)"""
+    _cache.delete(('subscription', subscription_id))
+
+
+def create_customer(**params):
+    return _call('Customer.create', stripe.Customer.create, **params)
+
+
+def create_checkout_session(**params):
+    return _call('checkout.Session.create', stripe.checkout.Session.create, **params)
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+from mysql.connector import IntegrityError
+
+# Plan length (days) and price charged for each plan type
+PLAN_DETAILS = {
+    'monthly': (30, 9.99),
+    'yearly': (365, 99.99)
+}
+
+
+def _as_date(value):
+    """Normalize a DATE column value (date or 'YYYY-MM-DD' string) to a date"""
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+def activate_subscription(db, user_id, plan_type, stripe_subscription_id, stripe_session_id):
+    """
+    Apply a paid Stripe checkout session to a user in a single transaction.
+
+    Both verify_session and the checkout.session.completed webhook call this
+    for the same payment. The user row is locked with SELECT ... FOR UPDATE
+    and the checkout session id is checked against already-applied payments,
+    so whichever caller arrives second sees the first one's work and writes
+    nothing.
+
+    Returns a dict with 'applied' (False if the session was already applied
+    or the user doesn't exist) and the user's resulting role/status/plan.
+    """
+    if plan_type not in PLAN_DETAILS:
+        plan_type = 'monthly'
+    days, amount = PLAN_DETAILS[plan_type]
+
+    cursor = db.cursor(dictionary=True)
+    try:
+        db.start_transaction()
+
+        # Lock the user row so concurrent activations for this user serialize here
+        cursor.execute(
+            """SELECT role, subscription_status, subscription_plan, subscription_end_date
+               FROM users WHERE user_id = %s FOR UPDATE""",
+            (user_id,)
+        )
+        user = cursor.fetchone()
+        if not user:
+            db.rollback()
+            return {'applied': False, 'role': None, 'subscription_status': None, 'subscription_plan': None}
+
+        # Has this checkout session already been applied?
+        cursor.execute(
+            "SELECT subscription_id FROM subscriptions WHERE stripe_session_id = %s",
+            (stripe_session_id,)
+        )
+        if cursor.fetchone():
+            db.rollback()
+            return {
+                'applied': False,
+                'role': user.get('role', 'user'),
+                'subscription_status': user.get('subscription_status', 'inactive'),
+                'subscription_plan': user.get('subscription_plan')
+            }
+
+        # Plan change extends from the existing end date, new subscription starts today
+        existing_end_date = None
+        if user.get('subscription_status') == 'active' and user.get('subscription_end_date'):
+            existing_end_date = _as_date(user['subscription_end_date'])
+        start_date = existing_end_date or datetime.now().date()
+        end_date = start_date + timedelta(days=days)
+
+        cursor.execute(
+            """UPDATE users
+               SET role = 'subscriber',
+                   subscription_status = 'active',
+                   stripe_subscription_id = %s,
+                   subscription_plan = %s,
+                   subscription_end_date = %s
+               WHERE user_id = %s""",
+            (stripe_subscription_id, plan_type, end_date, user_id)
+        )
+        cursor.execute(
+            """INSERT INTO subscriptions
+               (user_id, plan_type, start_date, end_date, payment_status, amount,
+                stripe_subscription_id, stripe_session_id)
+               VALUES (%s, %s, %s, %s, 'completed', %s, %s, %s)""",
+            (user_id, plan_type, start_date, end_date, amount, stripe_subscription_id, stripe_session_id)
+        )
+        db.commit()
+
+        return {
+            'applied': True,
+            'role': 'subscriber',
+            'subscription_status': 'active',
+            'subscription_plan': plan_type,
+            'end_date': end_date
+        }
+    except IntegrityError:
+        # Unique stripe_session_id: another worker applied this session first
+        db.rollback()
+        cursor.execute(
+            "SELECT role, subscription_status, subscription_plan FROM users WHERE user_id = %s",
+            (user_id,)
+        )
+        user = cursor.fetchone() or {}
+        return {
+            'applied': False,
+            'role': user.get('role'),
+            'subscription_status': user.get('subscription_status'),
+            'subscription_plan': user.get('subscription_plan')
+        }
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
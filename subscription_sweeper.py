@@ -0,0 +1,56 @@
+import logging
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_expired_subscriptions(db, batch_size=500):
+    """
+    Downgrade subscribers whose subscription_end_date has passed.
+
+    Works in chunks of batch_size using idx_user_subscription_expiry so the
+    UPDATE never locks large parts of the users table. Admins are never
+    touched. Returns the list of downgraded user ids so callers can drop
+    any cached entitlements for them.
+    """
+    downgraded = []
+    cursor = db.cursor()
+    try:
+        while True:
+            cursor.execute(
+                """SELECT user_id FROM users
+                   WHERE subscription_status = 'active' AND subscription_end_date < CURDATE()
+                     AND role = 'subscriber'
+                   ORDER BY subscription_end_date
+                   LIMIT %s""",
+                (batch_size,)
+            )
+            user_ids = [row[0] for row in cursor.fetchall()]
+            if not user_ids:
+                break
+
+            placeholders = ', '.join(['%s'] * len(user_ids))
+            # Re-check the expiry condition so a renewal that landed in between wins
+            cursor.execute(
+                f"""UPDATE users
+                    SET role = 'user', subscription_status = 'inactive',
+                        subscription_plan = NULL, subscription_end_date = NULL
+                    WHERE user_id IN ({placeholders})
+                      AND subscription_status = 'active' AND subscription_end_date < CURDATE()
+                      AND role = 'subscriber'""",
+                user_ids
+            )
+            db.commit()
+
+            downgraded.extend(user_ids)
+            metrics.inc('subscriptions_expired_total', cursor.rowcount)
+            metrics.inc('subscription_sweep_batches_total')
+
+            if len(user_ids) < batch_size:
+                break
+    finally:
+        cursor.close()
+
+    if downgraded:
+        logger.info("Subscription sweep: downgraded %s expired subscriber(s)", len(downgraded))
+    return downgraded
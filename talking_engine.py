@@ -0,0 +1,154 @@
+import array
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import wave
+import metrics
+from model_backends import run_batch
+from video_segments import concat_videos
+
+logger = logging.getLogger(__name__)
+
+# MakeItTalk engine: audio pre-processing plus chunked, parallel rendering.
+# The audio is resampled to the model's rate and stripped of leading and
+# trailing silence; long audio is cut into chunks at the quietest point near
+# each boundary, every chunk is rendered against the same source image on
+# the backend pool, and the clips are joined without re-encoding.
+
+FFMPEG = shutil.which('ffmpeg')
+
+SAMPLE_RATE = int(os.getenv('MAKEITTALK_SAMPLE_RATE', '16000'))
+SILENCE_THRESHOLD_DB = int(os.getenv('MAKEITTALK_SILENCE_THRESHOLD_DB', '-40'))
+# Target chunk length; 0 renders the whole clip as one job
+CHUNK_SECONDS = float(os.getenv('MAKEITTALK_CHUNK_SECONDS', '15'))
+CHUNK_RETRIES = int(os.getenv('MAKEITTALK_CHUNK_RETRIES', '2'))
+# How far either side of a chunk boundary to look for a quiet cut point
+CUT_SEARCH_SECONDS = 1.0
+CUT_WINDOW_SECONDS = 0.02
+
+if not FFMPEG:
+    logger.warning("ffmpeg is not installed. MakeItTalk audio will be sent without pre-processing or chunking.")
+
+
+def preprocess_audio(audio_path, out_dir):
+    """
+    Convert to mono 16-bit PCM WAV at SAMPLE_RATE and trim silence from both
+    ends. Returns the new path, or None when ffmpeg isn't available.
+    """
+    if not FFMPEG:
+        return None
+    trim = f'silenceremove=start_periods=1:start_threshold={SILENCE_THRESHOLD_DB}dB'
+    output_path = os.path.join(out_dir, 'audio.wav')
+    result = subprocess.run(
+        [FFMPEG, '-y', '-loglevel', 'error', '-i', audio_path,
+         '-af', f'{trim},areverse,{trim},areverse',
+         '-ac', '1', '-ar', str(SAMPLE_RATE), '-c:a', 'pcm_s16le', output_path],
+        capture_output=True, timeout=300
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Audio pre-processing failed: {result.stderr.decode(errors='replace')[:300]}")
+    return output_path
+
+
+def _quietest_frame(samples, start, end, window):
+    """Start of the lowest-energy window in samples[start:end]"""
+    best_frame, best_energy = start, None
+    for frame in range(start, max(start + 1, end - window), window):
+        energy = sum(abs(sample) for sample in samples[frame:frame + window])
+        if best_energy is None or energy < best_energy:
+            best_frame, best_energy = frame, energy
+    return best_frame
+
+
+def split_audio(wav_path, chunk_seconds, out_dir):
+    """
+    Cut a mono 16-bit WAV into ~chunk_seconds pieces, moving each cut to the
+    quietest point within CUT_SEARCH_SECONDS so words aren't split.
+    Returns the chunk paths in order (just [wav_path] if it's short).
+    """
+    with wave.open(wav_path, 'rb') as source:
+        params = source.getparams()
+        rate = source.getframerate()
+        samples = array.array('h', source.readframes(source.getnframes()))
+    if sys.byteorder == 'big':
+        samples.byteswap()
+
+    chunk_frames = int(chunk_seconds * rate)
+    # The last chunk ends up between 0.5 and 1.5 chunk lengths
+    if len(samples) < 1.5 * chunk_frames:
+        return [wav_path]
+
+    search = int(CUT_SEARCH_SECONDS * rate)
+    window = max(1, int(CUT_WINDOW_SECONDS * rate))
+    cuts = [0]
+    while len(samples) - cuts[-1] >= 1.5 * chunk_frames:
+        target = cuts[-1] + chunk_frames
+        cuts.append(_quietest_frame(samples, target - search, target + search, window))
+    cuts.append(len(samples))
+
+    chunk_paths = []
+    for index in range(len(cuts) - 1):
+        chunk = samples[cuts[index]:cuts[index + 1]]
+        if sys.byteorder == 'big':
+            chunk.byteswap()
+        chunk_path = os.path.join(out_dir, f'chunk_{index:04d}.wav')
+        with wave.open(chunk_path, 'wb') as out:
+            out.setparams(params)
+            out.writeframes(chunk.tobytes())
+        chunk_paths.append(chunk_path)
+    return chunk_paths
+
+
+def render_talking(pool, render_chunk, audio_path, output_path, work_root=None,
+                   chunk_seconds=None, retries=None):
+    """
+    Pre-process audio_path and render it in parallel chunks.
+
+    render_chunk(backend, chunk_audio_path, chunk_output_path) renders one
+    chunk against the source image; a failed chunk is retried on whichever
+    backend is free. Returns a status dict like create_fomd_animation.
+    """
+    chunk_seconds = CHUNK_SECONDS if chunk_seconds is None else chunk_seconds
+    retries = CHUNK_RETRIES if retries is None else retries
+    work_dir = tempfile.mkdtemp(prefix='talking_', dir=work_root)
+    try:
+        with metrics.timed('makeittalk_render_seconds'):
+            prepared = preprocess_audio(audio_path, work_dir) or audio_path
+            if prepared != audio_path and chunk_seconds:
+                chunks = split_audio(prepared, chunk_seconds, work_dir)
+            else:
+                chunks = [prepared]
+            metrics.observe('makeittalk_chunks_per_render', len(chunks))
+
+            if len(chunks) == 1:
+                outputs = [output_path]
+            else:
+                outputs = [f"{chunk[:-4]}_out.mp4" for chunk in chunks]
+
+            def work(backend, index):
+                render_chunk(backend, chunks[index], outputs[index])
+
+            for index, _, error in run_batch(pool, list(range(len(chunks))), work, retries=retries):
+                if error is not None:
+                    return {
+                        'status': 'error',
+                        'message': f'Audio chunk {index + 1} of {len(chunks)} failed: {error}'
+                    }
+
+            if len(chunks) > 1:
+                concat_videos(outputs, output_path, work_dir)
+        return {
+            'status': 'success',
+            'message': 'Animation created successfully'
+        }
+    except Exception as e:
+        logger.error("MakeItTalk render error: %s", e)
+        return {
+            'status': 'error',
+            'message': f'Animation creation failed: {str(e)}'
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
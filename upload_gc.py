@@ -0,0 +1,162 @@
+import logging
+import os
+import time
+import metrics
+from file_cleanup import iter_files
+
+logger = logging.getLogger(__name__)
+
+# Garbage collection for static/uploads.
+# Temp inputs of the animate endpoints are recorded in temp_uploads with an
+# expiry; the collector removes them once expired, plus anything in the
+# uploads folder that nothing references (untracked leftovers, profile
+# pictures no user points at). Paths are relative to the static folder.
+
+
+def track_temp_uploads(db, relative_paths, ttl_seconds):
+    """Record temp input files so they're reclaimed after ttl_seconds even if the request never cleans up"""
+    rows = [(path, ttl_seconds) for path in relative_paths]
+    if not rows:
+        return
+    cursor = db.cursor()
+    try:
+        cursor.executemany(
+            "INSERT INTO temp_uploads (file_path, expires_at) VALUES (%s, NOW() + INTERVAL %s SECOND)",
+            rows
+        )
+        db.commit()
+    finally:
+        cursor.close()
+
+
+class _Collector:
+    """Removes files while pacing disk I/O and tallying what was reclaimed"""
+
+    def __init__(self, static_root, batch_size, pause_seconds):
+        self.static_root = static_root
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.files = 0
+        self.bytes = 0
+        self._ops = 0
+
+    def throttle(self):
+        # Yield to request-serving I/O after every batch of filesystem operations
+        self._ops += 1
+        if self._ops % self.batch_size == 0:
+            time.sleep(self.pause_seconds)
+
+    def remove(self, full_path, size=None):
+        try:
+            if size is None:
+                size = os.stat(full_path).st_size
+            os.remove(full_path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning("Upload GC: could not remove %s: %s", full_path, e)
+            return
+        self.files += 1
+        self.bytes += size
+
+    def relative(self, full_path):
+        return os.path.relpath(full_path, self.static_root).replace(os.sep, '/')
+
+
+def _collect_expired_temp_uploads(db, collector):
+    cursor = db.cursor()
+    try:
+        while True:
+            cursor.execute(
+                """SELECT temp_upload_id, file_path FROM temp_uploads
+                   WHERE expires_at < NOW() ORDER BY expires_at LIMIT %s""",
+                (collector.batch_size,)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            for _, file_path in rows:
+                collector.remove(os.path.join(collector.static_root, file_path))
+                collector.throttle()
+            placeholders = ', '.join(['%s'] * len(rows))
+            cursor.execute(f"DELETE FROM temp_uploads WHERE temp_upload_id IN ({placeholders})",
+                           [row[0] for row in rows])
+            db.commit()
+            if len(rows) < collector.batch_size:
+                break
+    finally:
+        cursor.close()
+
+
+def _collect_unreferenced(db, collector, candidates, reference_query):
+    """Remove candidate files (relative path -> (full path, size)) that reference_query doesn't return"""
+    cursor = db.cursor()
+    try:
+        placeholders = ', '.join(['%s'] * len(candidates))
+        # The query may test the candidates against several columns
+        params = list(candidates) * reference_query.count('{placeholders}')
+        cursor.execute(reference_query.format(placeholders=placeholders), params)
+        referenced = {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+    for relative_path, (full_path, size) in candidates.items():
+        if relative_path not in referenced:
+            collector.remove(full_path, size)
+
+
+def _top_level_files(directory):
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                yield entry.path, entry
+
+
+def _scan(db, collector, directory, recursive, min_age_seconds, reference_query):
+    cutoff = time.time() - min_age_seconds
+    entries = iter_files(directory) if recursive else _top_level_files(directory)
+
+    candidates = {}
+    for full_path, entry in entries:
+        collector.throttle()
+        if entry.name.startswith('.'):
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        if stat.st_mtime > cutoff:
+            continue
+        candidates[collector.relative(full_path)] = (full_path, stat.st_size)
+        if len(candidates) >= collector.batch_size:
+            _collect_unreferenced(db, collector, candidates, reference_query)
+            candidates = {}
+    if candidates:
+        _collect_unreferenced(db, collector, candidates, reference_query)
+
+
+def collect_uploads(db, static_root, upload_folder, profile_pictures_folder,
+                    orphan_ttl_seconds=86400, batch_size=200, pause_seconds=0.05):
+    """
+    Reclaim expired temp inputs and unreferenced files under static/uploads.
+    Returns {'files': n, 'bytes': n} reclaimed.
+    """
+    collector = _Collector(static_root, batch_size, pause_seconds)
+
+    _collect_expired_temp_uploads(db, collector)
+
+    # Loose files directly in the uploads folder are only ever temp inputs;
+    # anything still tracked in temp_uploads hasn't expired yet
+    if os.path.isdir(upload_folder):
+        _scan(db, collector, upload_folder, recursive=False, min_age_seconds=orphan_ttl_seconds,
+              reference_query="SELECT file_path FROM temp_uploads WHERE file_path IN ({placeholders})")
+
+    # Profile pictures and variants no user points at (failed or superseded uploads)
+    if os.path.isdir(profile_pictures_folder):
+        _scan(db, collector, profile_pictures_folder, recursive=True, min_age_seconds=orphan_ttl_seconds,
+              reference_query="""SELECT profile_picture FROM users WHERE profile_picture IN ({placeholders})
+                                 UNION ALL
+                                 SELECT variant_path FROM profile_picture_variants
+                                 WHERE variant_path IN ({placeholders})""")
+
+    metrics.inc('upload_gc_files_reclaimed_total', collector.files)
+    metrics.inc('upload_gc_bytes_reclaimed_total', collector.bytes)
+    if collector.files:
+        logger.info("Upload GC: reclaimed %s file(s), %.1f MB", collector.files, collector.bytes / (1024 * 1024))
+    return {'files': collector.files, 'bytes': collector.bytes}
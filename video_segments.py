@@ -0,0 +1,108 @@
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import metrics
+from media_validation import mp4_duration
+from model_backends import run_batch
+
+logger = logging.getLogger(__name__)
+
+# Segment-parallel rendering for long driving videos.
+# The driving video is cut into keyframe-aligned segments with a stream copy
+# (no re-encode), every segment is rendered on the backend pool in parallel
+# with per-segment retries, and the rendered segments are joined with the
+# concat demuxer, again without re-encoding.
+
+FFMPEG = shutil.which('ffmpeg')
+
+# Target segment length; 0 turns segmenting off
+SEGMENT_SECONDS = float(os.getenv('FOMD_SEGMENT_SECONDS', '10'))
+# Extra attempts per segment before the whole render fails
+SEGMENT_RETRIES = int(os.getenv('FOMD_SEGMENT_RETRIES', '2'))
+
+
+def should_segment(pool, video_path):
+    """Only worth it for clips spanning several segments when more than one render can run at once"""
+    if not FFMPEG or not SEGMENT_SECONDS or pool.capacity < 2:
+        return False
+    duration = mp4_duration(video_path)
+    return bool(duration and duration >= 2 * SEGMENT_SECONDS)
+
+
+def _ffmpeg(*args):
+    result = subprocess.run([FFMPEG, '-y', '-loglevel', 'error', *args], capture_output=True, timeout=600)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace')[:300]}")
+
+
+def split_video(video_path, segment_seconds, out_dir):
+    """
+    Cut video_path into ~segment_seconds pieces. With stream copy the cuts
+    land on the next keyframe, so every segment decodes on its own.
+    Returns the segment paths in order.
+    """
+    _ffmpeg('-i', video_path, '-map', '0:v:0', '-c', 'copy',
+            '-f', 'segment', '-segment_time', str(segment_seconds), '-reset_timestamps', '1',
+            os.path.join(out_dir, 'segment_%04d.mp4'))
+    return sorted(
+        os.path.join(out_dir, name) for name in os.listdir(out_dir)
+        if name.startswith('segment_') and name.endswith('.mp4')
+    )
+
+
+def concat_videos(paths, output_path, work_dir):
+    """Join rendered segments without re-encoding (they share the backend's codec settings)"""
+    list_path = os.path.join(work_dir, 'concat.txt')
+    with open(list_path, 'w') as f:
+        for path in paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    _ffmpeg('-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', '-movflags', '+faststart', output_path)
+
+
+def render_segmented(pool, render_segment, video_path, output_path, work_root=None,
+                     segment_seconds=None, retries=None):
+    """
+    Render a long driving video in parallel segments.
+
+    render_segment(backend, segment_path, segment_output_path) renders one
+    segment; a failed segment is retried (on whichever backend is free) up
+    to `retries` times without touching the others.
+    Returns a status dict like create_fomd_animation.
+    """
+    segment_seconds = segment_seconds or SEGMENT_SECONDS
+    retries = SEGMENT_RETRIES if retries is None else retries
+    work_dir = tempfile.mkdtemp(prefix='segments_', dir=work_root)
+    try:
+        with metrics.timed('fomd_segmented_render_seconds'):
+            segments = split_video(video_path, segment_seconds, work_dir)
+            if not segments:
+                return {'status': 'error', 'message': 'Driving video could not be split into segments'}
+            metrics.observe('fomd_segments_per_render', len(segments))
+
+            outputs = [f"{segment[:-4]}_out.mp4" for segment in segments]
+
+            def work(backend, index):
+                render_segment(backend, segments[index], outputs[index])
+
+            for index, _, error in run_batch(pool, list(range(len(segments))), work, retries=retries):
+                if error is not None:
+                    return {
+                        'status': 'error',
+                        'message': f'Segment {index + 1} of {len(segments)} failed: {error}'
+                    }
+
+            concat_videos(outputs, output_path, work_dir)
+        return {
+            'status': 'success',
+            'message': 'Animation created successfully'
+        }
+    except Exception as e:
+        logger.error("Segmented FOMD render error: %s", e)
+        return {
+            'status': 'error',
+            'message': f'Animation creation failed: {str(e)}'
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)